@@ -0,0 +1,398 @@
+# コストシミュレータのベンチマーク
+# 2026/10/19
+#
+# 合成シナリオ(synthetic_workbook)を使い、シナリオ数・工程数を変えて各処理段階の所要時間を計測する。
+#   parse     : read_parameters によるワークブック1ファイルの読み込み
+#   chain     : calculate_total_cost_by_scenario による全シナリオの工程チェーン計算
+#   process_memo: chain と同じ計算を工程のメモ (cost_engine.PROCESS_MEMO) の有無で比べる
+#               (function=memo_off: メモなし, memo_cold: 空のメモから計算, memo_warm: 同じシナリオを計算済みのメモで再計算)
+#   downstream: 下流の2工程だけが異なるシナリオ群の工程チェーン計算
+#               (function=naive: シナリオごとに計算, function=shared_prefix: 共通の上流工程を1回だけ計算)
+#   aggregate : build_key_results によるサマリー集計
+# process_memo 以外の段階はメモを使わずに計測する (繰り返しや前の段階の計算結果がメモに残ると、
+# 計算そのものではなくメモの参照時間を測ることになるため)。
+#   monte_carlo: parallel_mc.run_parallel による三角分布のモンテカルロ (function=workers_N: ワーカー N 個)。
+#               ワーカー数ごとの所要時間と 1 ワーカーに対する速度向上率を記録する (--mc-samples 0 で計測しない)
+#   throughput: throughput_sim.simulate_year による1年分の離散事象シミュレーション (シード 0〜2 の合成シナリオ)
+#               (function=hybrid: 処理回数の多い工程を流体近似, function=discrete: 全工程を1回ずつ扱う。
+#                discrete は --throughput-discrete-max-processes 以下の工程数のみ)
+#   figures   : plot_* 関数によるグラフ作成 (--max-figure-scenarios 以下のシナリオ数のみ)
+#
+# 結果は JSON ファイルに保存する。--compare で過去の結果と比較し、遅くなった項目があれば終了コード1を返す。
+#
+# 使い方:
+#   python benchmark.py --output benchmark_results.json
+#   python benchmark.py --quick --compare benchmark_results.json
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import cost_engine
+import parallel_mc
+import synthetic_workbook
+import throughput_sim
+
+DEFAULT_SCENARIOS = [1, 10, 100, 1000]
+DEFAULT_PROCESSES = [10, 27, 50, 100, 200]
+QUICK_SCENARIOS = [1, 10]
+QUICK_PROCESSES = [10, 27]
+DEFAULT_MC_SAMPLES = 1 << 18
+QUICK_MC_SAMPLES = 1 << 15
+# モンテカルロで振るパラメータ
+MC_PARAMETERS = ['num_of_units', 'unit_cost', 'yield_rate']
+# 離散事象シミュレーションに使う合成シナリオのシード
+THROUGHPUT_SEEDS = [0, 1, 2]
+
+###################################################################################
+# 計測
+def _measure(func, repeat):
+    """
+    func を repeat 回実行し、各回の所要時間[s]のリストを返す。
+    func は毎回の前準備(計測対象外)を済ませた「計測対象の処理」を返す関数。
+    """
+    times = []
+    for _ in range(repeat):
+        target = func()
+        start = time.perf_counter()
+        target()
+        times.append(time.perf_counter() - start)
+    return times
+
+def _result(stage, scenarios, processes, times, **extra):
+    entry = {
+        'stage': stage,
+        'scenarios': scenarios,
+        'processes': processes,
+        'repeat': len(times),
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+    }
+    entry.update(extra)
+    return entry
+
+@contextmanager
+def _process_memo(max_entries):
+    """
+    計測の間だけ cost_engine.PROCESS_MEMO の上限件数を切り替える。前後でメモを空にする
+    """
+    memo = cost_engine.PROCESS_MEMO
+    saved = memo.max_entries
+    memo.max_entries = max_entries
+    memo.clear()
+    try:
+        yield memo
+    finally:
+        memo.max_entries = saved
+        memo.clear()
+
+def bench_parse(processes, repeat):
+    workbook = synthetic_workbook.make_workbook_bytes(processes)
+    times = _measure(lambda: (lambda: cost_engine.read_parameters(io.BytesIO(workbook))), repeat)
+    return _result('parse', 1, processes, times, payload_bytes=len(workbook))
+
+def _make_scenarios(scenarios, processes):
+    return [synthetic_workbook.make_scenario(processes, seed) for seed in range(scenarios)]
+
+def _run_chain(inputs):
+    return [
+        (f'scenario_{i + 1:04d}', *cost_engine.calculate_total_cost_by_scenario(process_input, metadata, 'standard'))
+        for i, (metadata, process_input) in enumerate(inputs)
+    ]
+
+def bench_chain(scenarios, processes, repeat):
+    def prepare():
+        inputs = _make_scenarios(scenarios, processes)
+        return lambda: _run_chain(inputs)
+    with _process_memo(0):
+        return _result('chain', scenarios, processes, _measure(prepare, repeat))
+
+def bench_process_memo(scenarios, processes, repeat):
+    inputs = _make_scenarios(scenarios, processes)
+    variants = [('memo_off', 0, False)]
+    if cost_engine.PROCESS_MEMO_MAX_ENTRIES > 0:
+        variants += [('memo_cold', cost_engine.PROCESS_MEMO_MAX_ENTRIES, False),
+                     ('memo_warm', cost_engine.PROCESS_MEMO_MAX_ENTRIES, True)]
+    results = []
+    for function, max_entries, warm in variants:
+        with _process_memo(max_entries) as memo:
+            lookups = {'hits': 0, 'misses': 0}
+
+            def prepare():
+                # 前の回の結果を使わないよう毎回空にする (memo_warm は計測前に1回計算してメモを埋める)
+                memo.clear()
+                if warm:
+                    _run_chain(inputs)
+
+                def target():
+                    before = memo.stats()
+                    _run_chain(inputs)
+                    after = memo.stats()
+                    for name in lookups:
+                        lookups[name] += after[name] - before[name]
+                return target
+
+            times = _measure(prepare, repeat)
+        total = lookups['hits'] + lookups['misses']
+        results.append(_result('process_memo', scenarios, processes, times, function=function,
+                               hit_rate=lookups['hits'] / total if total else 0.0))
+    return results
+
+def _make_downstream_scenarios(scenarios, processes):
+    # 1つのシナリオを元に、最後の2工程の装置台数・歩留まりだけを変えたシナリオ群
+    metadata, base = synthetic_workbook.make_scenario(processes)
+    inputs = []
+    for i in range(scenarios):
+        process_input = OrderedDict((name, dict(cases)) for name, cases in base.items())
+        for offset, name in enumerate(list(base)[-2:]):
+            standard = dict(base[name]['standard'])
+            standard['num_of_units'] += (i + offset) % 3
+            standard['yield_rate'] = round(standard['yield_rate'] - (i % 50) * 0.1, 6)
+            process_input[name]['standard'] = standard
+        inputs.append((metadata, process_input))
+    return inputs
+
+def bench_downstream(scenarios, processes, repeat):
+    def prepare_naive():
+        inputs = _make_downstream_scenarios(scenarios, processes)
+        return lambda: _run_chain(inputs)
+
+    def prepare_shared_prefix():
+        inputs = [(process_input, metadata) for metadata, process_input in _make_downstream_scenarios(scenarios, processes)]
+        return lambda: cost_engine.calculate_scenarios_with_shared_prefix(inputs)
+
+    with _process_memo(0):
+        inputs = [(process_input, metadata) for metadata, process_input in _make_downstream_scenarios(scenarios, processes)]
+        _, stats = cost_engine.calculate_scenarios_with_shared_prefix(inputs)
+        return [
+            _result('downstream', scenarios, processes, _measure(prepare_naive, repeat), function='naive'),
+            _result('downstream', scenarios, processes, _measure(prepare_shared_prefix, repeat), function='shared_prefix',
+                    process_evaluations=stats['process_evaluations']),
+        ]
+
+def _mc_worker_counts():
+    # 1, 2, 4, ... と CPU数 (最大32)
+    cpu_count = min(os.cpu_count() or 1, 32)
+    counts = [1]
+    while counts[-1] * 2 <= cpu_count:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpu_count:
+        counts.append(cpu_count)
+    return counts
+
+def bench_monte_carlo(processes, n_samples, repeat, worker_counts=None):
+    metadata, process_input = synthetic_workbook.make_scenario(processes)
+    results = []
+    baseline = None
+    for workers in worker_counts or _mc_worker_counts():
+        # プールの起動 (ワーカープロセスの spawn) は計測に含めない
+        parallel_mc.run_parallel(process_input, metadata, MC_PARAMETERS, parallel_mc.DEFAULT_CHUNK_SIZE * workers,
+                                 workers=workers)
+        times = _measure(lambda: (lambda: parallel_mc.run_parallel(
+            process_input, metadata, MC_PARAMETERS, n_samples, workers=workers
+        )), repeat)
+        baseline = baseline or min(times)
+        results.append(_result('monte_carlo', n_samples, processes, times, function=f'workers_{workers}',
+                               speedup=baseline / min(times)))
+    return results
+
+def bench_throughput(processes, repeat, discrete=True):
+    inputs = [synthetic_workbook.make_scenario(processes, seed)[1] for seed in THROUGHPUT_SEEDS]
+    variants = [('hybrid', throughput_sim.MAX_DISCRETE_RUNS)]
+    if discrete:
+        variants.append(('discrete', None))
+    results = []
+    for function, max_discrete_runs in variants:
+        events = []
+
+        def target():
+            events.clear()
+            for process_input in inputs:
+                events.append(throughput_sim.simulate_year(process_input, max_discrete_runs=max_discrete_runs)['events'])
+
+        # 全工程を1回ずつ扱う場合は時間がかかるので1回だけ計測する
+        times = _measure(lambda: target, repeat if function == 'hybrid' else 1)
+        results.append(_result('throughput', len(inputs), processes, times, function=function,
+                               events=sum(events), per_year_s=min(times) / len(inputs)))
+    return results
+
+def bench_aggregate(scenarios, processes, repeat):
+    scenario_results = _run_chain(_make_scenarios(scenarios, processes))
+    times = _measure(lambda: (lambda: cost_engine.build_key_results(scenario_results)), repeat)
+    return _result('aggregate', scenarios, processes, times)
+
+def _plot_functions():
+    # グラフ作成関数は Streamlit の画面モジュールにあるため、必要になったときだけ import する
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+    import cost_simulator
+
+    def unwrap(func):
+        # stage_timing.timed の計測ログを出さないよう、元の関数を呼ぶ
+        return getattr(func, '__wrapped__', func)
+
+    return {
+        'plot_unit_product_cost_per_process': unwrap(cost_simulator.plot_unit_product_cost_per_process),
+        'plot_annual_costs_per_process': unwrap(cost_simulator.plot_annual_costs_per_process),
+        'plot_capacity_per_process': unwrap(cost_simulator.plot_capacity_per_process),
+        'plot_product_ratio': unwrap(cost_simulator.plot_product_ratio),
+        'plot_cost_composition_per_wafer': unwrap(cost_simulator.plot_cost_composition_per_wafer),
+        'plot_scenario_scatter': unwrap(cost_simulator.plot_scenario_scatter),
+    }
+
+def bench_figures(scenarios, processes, repeat, plot_functions):
+    scenario_results = _run_chain(_make_scenarios(scenarios, processes))
+    full_results = {name: details for name, _, _, details in scenario_results}
+    key_results = cost_engine.build_key_results(scenario_results)
+
+    results = []
+    for name, func in plot_functions.items():
+        if name == 'plot_scenario_scatter':
+            target = lambda: func(key_results)
+        else:
+            target = lambda: func(full_results, "基板")
+        results.append(_result('figures', scenarios, processes, _measure(lambda: target, repeat), function=name))
+    return results
+
+###################################################################################
+# 実行環境
+def _environment():
+    def version(module_name):
+        try:
+            return __import__(module_name).__version__
+        except ImportError:
+            return None
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': {name: version(name) for name in ('numpy', 'pandas', 'openpyxl', 'plotly', 'streamlit')},
+    }
+
+###################################################################################
+# 過去の結果との比較
+def _result_key(entry):
+    return (entry['stage'], entry['scenarios'], entry['processes'], entry.get('function'))
+
+def compare(baseline, current, tolerance):
+    """
+    baseline, current: ベンチマーク結果(JSON)の辞書
+    min_s が baseline の tolerance 倍を超えた項目のリストを返す
+    """
+    baseline_results = {_result_key(entry): entry for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        old = baseline_results.get(_result_key(entry))
+        if old is None or old['min_s'] <= 0:
+            continue
+        ratio = entry['min_s'] / old['min_s']
+        if ratio > tolerance:
+            regressions.append({
+                'stage': entry['stage'],
+                'function': entry.get('function'),
+                'scenarios': entry['scenarios'],
+                'processes': entry['processes'],
+                'baseline_s': old['min_s'],
+                'current_s': entry['min_s'],
+                'ratio': ratio,
+            })
+    return regressions
+
+###################################################################################
+# コマンドライン
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='コストシミュレータのベンチマーク')
+    parser.add_argument('--scenarios', type=int, nargs='+', help='シナリオ数 (既定: 1 10 100 1000)')
+    parser.add_argument('--processes', type=int, nargs='+', help='工程数 (既定: 10 27 50 100 200)')
+    parser.add_argument('--quick', action='store_true', help='小さい規模だけを計測する')
+    parser.add_argument('--repeat', type=int, default=3, help='各計測の繰り返し回数')
+    parser.add_argument('--max-figure-scenarios', type=int, default=100,
+                        help='グラフ作成を計測する最大シナリオ数 (0 でグラフ作成を計測しない)')
+    parser.add_argument('--mc-samples', type=int,
+                        help='モンテカルロの点数 (既定: 262144、--quick では 32768。0 でモンテカルロを計測しない)')
+    parser.add_argument('--throughput-discrete-max-processes', type=int, default=27,
+                        help='離散事象シミュレーションを全工程1回ずつでも計測する最大工程数 (0 で計測しない)')
+    parser.add_argument('--output', default='benchmark_results.json', help='結果の出力先(JSON)')
+    parser.add_argument('--compare', help='比較対象の過去の結果(JSON)')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='この倍率を超えて遅くなったら回帰とみなす')
+    args = parser.parse_args(argv)
+
+    scenario_counts = args.scenarios or (QUICK_SCENARIOS if args.quick else DEFAULT_SCENARIOS)
+    process_counts = args.processes or (QUICK_PROCESSES if args.quick else DEFAULT_PROCESSES)
+    plot_functions = _plot_functions() if args.max_figure_scenarios > 0 else {}
+    mc_samples = args.mc_samples if args.mc_samples is not None else (QUICK_MC_SAMPLES if args.quick else DEFAULT_MC_SAMPLES)
+
+    results = []
+    for processes in process_counts:
+        results.append(bench_parse(processes, args.repeat))
+        print(f"parse      processes={processes:4d}  {results[-1]['min_s']:.4f}s", flush=True)
+        for scenarios in scenario_counts:
+            # 規模が大きいときは繰り返し回数を減らす
+            repeat = 1 if scenarios * processes >= 50000 else args.repeat
+            results.append(bench_chain(scenarios, processes, repeat))
+            print(f"chain      scenarios={scenarios:4d} processes={processes:4d}  {results[-1]['min_s']:.4f}s", flush=True)
+            memo_results = bench_process_memo(scenarios, processes, repeat)
+            results.extend(memo_results)
+            print(f"memo       scenarios={scenarios:4d} processes={processes:4d}  " + ' / '.join(
+                f"{entry['function']} {entry['min_s']:.4f}s (hit {entry['hit_rate']:.0%})" for entry in memo_results
+            ), flush=True)
+            results.append(bench_aggregate(scenarios, processes, repeat))
+            print(f"aggregate  scenarios={scenarios:4d} processes={processes:4d}  {results[-1]['min_s']:.4f}s", flush=True)
+            naive, shared_prefix = bench_downstream(scenarios, processes, repeat)
+            results.extend([naive, shared_prefix])
+            print(f"downstream scenarios={scenarios:4d} processes={processes:4d}  {naive['min_s']:.4f}s -> "
+                  f"{shared_prefix['min_s']:.4f}s (shared prefix)", flush=True)
+            if plot_functions and scenarios <= args.max_figure_scenarios:
+                figure_results = bench_figures(scenarios, processes, repeat, plot_functions)
+                results.extend(figure_results)
+                total = sum(entry['min_s'] for entry in figure_results)
+                print(f"figures    scenarios={scenarios:4d} processes={processes:4d}  {total:.4f}s", flush=True)
+        for entry in bench_throughput(processes, args.repeat, processes <= args.throughput_discrete_max_processes):
+            results.append(entry)
+            print(f"throughput processes={processes:4d} {entry['function']:>8s}  {entry['per_year_s']:.4f}s/year "
+                  f"({entry['events'] // entry['scenarios']:,} events/year)", flush=True)
+        if mc_samples > 0:
+            for entry in bench_monte_carlo(processes, mc_samples, args.repeat):
+                results.append(entry)
+                print(f"monte_carlo samples={mc_samples} processes={processes:4d} {entry['function']:>10s}  "
+                      f"{entry['min_s']:.4f}s (x{entry['speedup']:.2f})", flush=True)
+
+    report = {'schema_version': 1, 'environment': _environment(), 'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        for r in regressions:
+            label = r['stage'] if r['function'] is None else f"{r['stage']}:{r['function']}"
+            print(f"REGRESSION {label} scenarios={r['scenarios']} processes={r['processes']} "
+                  f"{r['baseline_s']:.4f}s -> {r['current_s']:.4f}s (x{r['ratio']:.2f})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# 需要からの装置台数計画 (歩留まりの逆算)
+# 2026/10/19
+#
+# 100mmウエハの年間需要から工程チェーンを後ろ向きにたどり、各工程に必要な処理数量・工程実施回数と
+# 最小の装置台数 ceil(必要工程実施回数 / 装置1台の年間工程キャパシティ) を求め、その台数でのコストを計算する。
+#   最終工程の必要良品数 = 需要 / 100mm品製造比率
+#   各工程の必要投入数   = 必要良品数 / 歩留まり
+#   必要工程実施回数     = 必要投入数 / バッチ処理数量 / 製品分割数
+#   前工程の必要良品数   = 必要投入数 / 製品分割数
+# 需要は配列で渡し、すべての需要水準を一括で計算する。
+
+import numpy as np
+import pandas as pd
+
+from cost_engine import calculate_chain_batch
+
+###################################################################################
+# 後ろ向きの必要量計算
+def required_units(processes_input, demand_levels, scenario='standard'):
+    """
+    processes_input: read_parameters の parameters
+    demand_levels: 100mmウエハ年間需要[pcs/year] の配列 (G 個)
+    戻り値: (必要装置台数 {'工程名': 配列(G)}, 必要工程実施回数 {'工程名': 配列(G)}, 最初の工程の必要投入数 配列(G))
+    """
+    demand = np.asarray(demand_levels, dtype=float)
+    process_names = list(processes_input)
+    units = {}
+    runs = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 最終工程の良品のうち 100mm品の割合で割り戻す
+        last = processes_input[process_names[-1]][scenario]
+        good = demand / (last['production_ratio_100mm'] / 100)
+        for process_name in reversed(process_names):
+            params = processes_input[process_name][scenario]
+            # 歩留まりで割り戻した、この工程で処理する数量[pcs/year]
+            processed = good / (params['yield_rate'] / 100)
+            runs[process_name] = processed / params['batch_process_quantity'] / params['product_split_count']
+            units[process_name] = np.maximum(1.0, np.ceil(runs[process_name] / params['annual_process_capacity_per_unit']))
+            # 前工程に必要な良品数 (分割前の個数)
+            good = processed / params['product_split_count']
+
+    # 工程順に並べ直す
+    units = {process_name: units[process_name] for process_name in process_names}
+    runs = {process_name: runs[process_name] for process_name in process_names}
+    return units, runs, good
+
+###################################################################################
+# 需要水準ごとの計画
+def plan_capacity(processes_input, metadata, demand_levels, scenario='standard'):
+    """
+    demand_levels の各需要水準について、必要最小限の装置台数と、その台数・投入数でのコストを計算する。
+    最初の工程の前工程からの供給(upstream_total_annual_production)は需要を満たす量に置き換える。
+
+    戻り値: (summary, units)
+      summary: 需要水準ごとの DataFrame
+        列: demand, required_input, wafer_cost, wafer_production, capex
+      units: 需要水準 × 工程 の必要装置台数の DataFrame (index は demand)
+    """
+    demand = np.asarray(demand_levels, dtype=float).ravel()
+    units, _, required_input = required_units(processes_input, demand, scenario)
+
+    first_process = next(iter(processes_input))
+    overrides = {(process_name, 'num_of_units'): values for process_name, values in units.items()}
+    overrides[(first_process, 'upstream_total_annual_production')] = required_input
+    wafer_cost, wafer_production, instances = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+    capex = sum(process.unit_cost * process.num_of_units for process in instances.values())
+
+    summary = pd.DataFrame({
+        'demand': demand,
+        'required_input': required_input,
+        'wafer_cost': np.broadcast_to(wafer_cost, demand.shape),
+        'wafer_production': np.broadcast_to(wafer_production, demand.shape),
+        'capex': np.broadcast_to(capex, demand.shape),
+    })
+    units_frame = pd.DataFrame(units, index=pd.Index(demand, name='demand')).astype(int)
+    return summary, units_frame
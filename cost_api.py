@@ -0,0 +1,321 @@
+# コスト計算エンジンのローカル HTTP JSON API
+# 2026/10/19
+#
+# Streamlit の画面を介さずに、他のツールから JSON でパラメータを渡してコストを計算するためのサービス。
+# 標準ライブラリの http.server だけで動く。
+#
+# エンドポイント
+#   GET  /health   : 稼働確認 {"status": "ok", "engine_version": ...}
+#   POST /process  : 1工程の計算
+#       {"params": {ProcessCost の引数 ...}, "metadata": {...}(省略可)}
+#       → {"outputs": {属性名: 値, ...}}
+#   POST /chain    : 工程チェーン全体の計算 (calculate_total_cost_by_scenario)
+#       {"metadata": {...}, "processes": {"工程名": {パラメータ...}, ...}, "scenario": "standard"(省略可)}
+#       工程ごとのパラメータは {"standard": {...}, "best": {...}, "worst": {...}} の形でもよい
+#       → {"wafer_cost": ..., "wafer_production": ..., "processes": {"工程名": {...}, ...}}
+#   POST /batch    : 多数のパラメータセットの一括計算 (calculate_chain_batch)
+#       /chain と同じ入力に加えて
+#       "overrides": [{"process": "工程名" または "__Metadata", "parameter": "パラメータ名", "values": [...]}, ...]
+#       → {"size": N, "wafer_cost": [...], "wafer_production": [...], "capex": [...]}
+#   POST /scenarios: 複数シナリオの計算 (calculate_scenarios_with_shared_prefix。共通の上流工程は1回だけ計算する)
+#       {"metadata": {...}, "scenarios": [{"name": ..., "processes": {...}, "metadata": {...}(省略可)}, ...],
+#        "scenario": "standard"(省略可)}
+#       → {"scenarios": [{"name": ..., "wafer_cost": ..., "wafer_production": ...}, ...],
+#          "process_evaluations": 実際に計算した工程数, "naive_evaluations": シナリオごとに計算した場合の工程数}
+#   計算できない値 (0除算など) は null で返す。入力の誤りは 400 とエラーメッセージを返す。
+#
+# 使い方:
+#   python cost_api.py --port 8520
+#   curl -s -X POST localhost:8520/chain -d @chain.json
+
+import argparse
+import json
+import logging
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from cost_engine import (
+    ENGINE_VERSION, ProcessCost, calculate_chain_batch, calculate_scenarios_with_shared_prefix,
+    calculate_total_cost_by_scenario,
+)
+from pareto import total_capex
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8520
+# 1リクエストの本文の上限 [bytes]
+MAX_BODY_BYTES = 64 * 1024 * 1024
+# /batch で1リクエストに計算できるパラメータセット数の上限
+MAX_BATCH_SIZE = 1_000_000
+# 1回の一括計算で扱う 工程数 × 点数 の上限 (pareto.sweep_frontier と同じ)
+_CHUNK_ELEMENTS = 1 << 18
+# ProcessCost の引数名 (工程パラメータとメタデータ)
+PARAMETER_NAMES = ProcessCost.__init__.__code__.co_varnames[1:ProcessCost.__init__.__code__.co_argcount]
+
+class RequestError(Exception):
+    """
+    入力の誤り (400 Bad Request として返す)
+    """
+
+###################################################################################
+# JSON への変換
+def _to_json_value(value):
+    # numpy の値を JSON に変換する。NaN・無限大は null にする
+    if isinstance(value, np.ndarray):
+        return [_to_json_value(v) for v in value.tolist()]
+    if isinstance(value, (list, tuple)):
+        return [_to_json_value(v) for v in value]
+    if isinstance(value, (np.floating, np.integer)):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def _array_to_json(values):
+    return [v if math.isfinite(v) else None for v in np.asarray(values, dtype=float).tolist()]
+
+###################################################################################
+# 入力の解釈
+def _parse_processes(body, scenario):
+    """
+    body['processes'] を calculate_total_cost_by_scenario が受け取る
+    {'工程名': {'シナリオ': {パラメータ...}}} の形にそろえる (入力は変更しない)
+    """
+    processes = body.get('processes')
+    if not isinstance(processes, dict) or not processes:
+        raise RequestError("'processes' must be a non-empty object")
+    processes_input = {}
+    for process_name, params in processes.items():
+        if not isinstance(params, dict):
+            raise RequestError(f"parameters of process '{process_name}' must be an object")
+        if scenario in params and isinstance(params[scenario], dict):
+            processes_input[process_name] = {scenario: dict(params[scenario])}
+        else:
+            processes_input[process_name] = {scenario: dict(params)}
+    return processes_input
+
+def _parse_metadata(body):
+    metadata = body.get('metadata', {})
+    if not isinstance(metadata, dict):
+        raise RequestError("'metadata' must be an object")
+    return dict(metadata)
+
+def _check_numeric(processes_input, metadata, scenario):
+    for process_name, cases in processes_input.items():
+        for name, value in {**cases[scenario], **metadata}.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise RequestError(f"parameter '{name}' of process '{process_name}' must be a number")
+
+def _check_complete(processes_input, metadata, scenario):
+    # ProcessCost の引数の過不足を確認する
+    for process_name, cases in processes_input.items():
+        params = {**cases[scenario], **metadata}
+        missing = [name for name in PARAMETER_NAMES if name not in params]
+        if missing:
+            raise RequestError(f"process '{process_name}' is missing parameters: {', '.join(missing)}")
+        unknown = [name for name in params if name not in PARAMETER_NAMES]
+        if unknown:
+            raise RequestError(f"process '{process_name}' has unknown parameters: {', '.join(unknown)}")
+
+###################################################################################
+# 計算
+def evaluate_process(body):
+    params = body.get('params')
+    if not isinstance(params, dict):
+        raise RequestError("'params' must be an object")
+    params = {**params, **_parse_metadata(body)}
+    processes_input = {'process': {'standard': params}}
+    _check_numeric(processes_input, {}, 'standard')
+    _check_complete(processes_input, {}, 'standard')
+
+    process = ProcessCost(**params)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        try:
+            process.calculate_cost_per_process()
+        except ZeroDivisionError as e:
+            raise RequestError(f'division by zero in the process: {e}') from e
+    return {'outputs': {name: _to_json_value(value) for name, value in vars(process).items()}}
+
+def evaluate_chain(body):
+    scenario = body.get('scenario', 'standard')
+    processes_input = _parse_processes(body, scenario)
+    metadata = _parse_metadata(body)
+    _check_numeric(processes_input, metadata, scenario)
+    _check_complete(processes_input, metadata, scenario)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        try:
+            wafer_cost, wafer_production, cost_details_by_process = calculate_total_cost_by_scenario(
+                processes_input, metadata, scenario
+            )
+        except ZeroDivisionError as e:
+            raise RequestError(f'division by zero in the chain: {e}') from e
+    return {
+        'wafer_cost': _to_json_value(wafer_cost),
+        'wafer_production': _to_json_value(wafer_production),
+        'processes': {
+            process_name: {name: _to_json_value(value) for name, value in details.items()}
+            for process_name, details in cost_details_by_process.items()
+        },
+    }
+
+def _parse_overrides(body, processes_input):
+    overrides = body.get('overrides')
+    if not isinstance(overrides, list) or not overrides:
+        raise RequestError("'overrides' must be a non-empty list")
+    parsed = {}
+    size = None
+    for entry in overrides:
+        if not isinstance(entry, dict) or not {'process', 'parameter', 'values'} <= set(entry):
+            raise RequestError("each override needs 'process', 'parameter' and 'values'")
+        process_name, param_name = entry['process'], entry['parameter']
+        if process_name != '__Metadata' and process_name not in processes_input:
+            raise RequestError(f"unknown process in overrides: '{process_name}'")
+        if param_name not in PARAMETER_NAMES:
+            raise RequestError(f"unknown parameter in overrides: '{param_name}'")
+        try:
+            values = np.asarray(entry['values'], dtype=float)
+        except (TypeError, ValueError) as e:
+            raise RequestError(f"values of {process_name}/{param_name} must be numbers") from e
+        if values.ndim != 1:
+            raise RequestError(f"values of {process_name}/{param_name} must be a flat list")
+        if size is not None and len(values) != size:
+            raise RequestError('all override value lists must have the same length')
+        size = len(values)
+        parsed[(process_name, param_name)] = values
+    if size == 0 or size > MAX_BATCH_SIZE:
+        raise RequestError(f'batch size must be between 1 and {MAX_BATCH_SIZE}')
+    return parsed, size
+
+def evaluate_batch(body):
+    scenario = body.get('scenario', 'standard')
+    processes_input = _parse_processes(body, scenario)
+    metadata = _parse_metadata(body)
+    _check_numeric(processes_input, metadata, scenario)
+    _check_complete(processes_input, metadata, scenario)
+    overrides, size = _parse_overrides(body, processes_input)
+
+    # 工程ごとの中間配列が大きくなりすぎないよう、チャンクに分けて計算する
+    chunk_size = max(1000, _CHUNK_ELEMENTS // len(processes_input))
+    wafer_cost = np.empty(size)
+    wafer_production = np.empty(size)
+    capex = np.empty(size)
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        chunk = {key: values[start:stop] for key, values in overrides.items()}
+        cost, production, instances = calculate_chain_batch(processes_input, metadata, scenario, chunk)
+        wafer_cost[start:stop] = cost
+        wafer_production[start:stop] = production
+        capex[start:stop] = total_capex(instances)
+    return {
+        'size': size,
+        'wafer_cost': _array_to_json(wafer_cost),
+        'wafer_production': _array_to_json(wafer_production),
+        'capex': _array_to_json(capex),
+    }
+
+def evaluate_scenarios(body):
+    scenario = body.get('scenario', 'standard')
+    scenarios = body.get('scenarios')
+    if not isinstance(scenarios, list) or not scenarios:
+        raise RequestError("'scenarios' must be a non-empty list")
+    if len(scenarios) > MAX_BATCH_SIZE:
+        raise RequestError(f'number of scenarios must be at most {MAX_BATCH_SIZE}')
+    common_metadata = _parse_metadata(body)
+    names = []
+    inputs = []
+    for i, entry in enumerate(scenarios):
+        if not isinstance(entry, dict):
+            raise RequestError('each scenario must be an object')
+        processes_input = _parse_processes(entry, scenario)
+        # シナリオごとのメタデータは共通のメタデータを上書きする
+        metadata = {**common_metadata, **_parse_metadata(entry)}
+        _check_numeric(processes_input, metadata, scenario)
+        _check_complete(processes_input, metadata, scenario)
+        names.append(entry.get('name', i))
+        inputs.append((processes_input, metadata))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        try:
+            results, stats = calculate_scenarios_with_shared_prefix(inputs, scenario)
+        except ZeroDivisionError as e:
+            raise RequestError(f'division by zero in the chain: {e}') from e
+    return {
+        'scenarios': [
+            {'name': name, 'wafer_cost': _to_json_value(wafer_cost), 'wafer_production': _to_json_value(wafer_production)}
+            for name, (wafer_cost, wafer_production, _) in zip(names, results)
+        ],
+        **stats,
+    }
+
+ENDPOINTS = {
+    '/process': evaluate_process,
+    '/chain': evaluate_chain,
+    '/batch': evaluate_batch,
+    '/scenarios': evaluate_scenarios,
+}
+
+###################################################################################
+# HTTP サーバー
+class CostAPIHandler(BaseHTTPRequestHandler):
+    server_version = 'CostAPI/1.0'
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'engine_version': ENGINE_VERSION})
+        else:
+            self._send_json(404, {'error': f'unknown path: {self.path}'})
+
+    def do_POST(self):
+        handler = ENDPOINTS.get(self.path)
+        if handler is None:
+            self._send_json(404, {'error': f'unknown path: {self.path}'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {'error': f'request body exceeds {MAX_BODY_BYTES} bytes'})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise RequestError('request body must be a JSON object')
+            self._send_json(200, handler(body))
+        except json.JSONDecodeError as e:
+            self._send_json(400, {'error': f'invalid JSON: {e}'})
+        except RequestError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            logging.exception('cost api error on %s', self.path)
+            self._send_json(500, {'error': repr(e)})
+
+    def log_message(self, format, *args):
+        logging.info('%s - %s', self.address_string(), format % args)
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), CostAPIHandler)
+    logging.info('cost api listening on %s:%d', host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='コスト計算エンジンの HTTP JSON API')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'待ち受けるアドレス (既定: {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'待ち受けるポート (既定: {DEFAULT_PORT})')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    serve(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
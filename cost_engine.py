@@ -0,0 +1,850 @@
+# コスト計算エンジン
+# 2026/10/19
+#
+# cost_simulator.py から、Streamlit に依存しない計算部分(コスト計算クラス・シナリオ別計算・
+# パラメータ読み込み・サマリー集計)を分離したもの。
+# ベンチマークやワーカープロセスから Streamlit の画面初期化なしで import できる。
+
+# ライブラリのインポート
+
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 計算エンジンのバージョン (このファイルの内容のハッシュ)。
+# 計算式を変更するとキャッシュのキーが変わり、古い計算結果は使われなくなる。
+with open(__file__, 'rb') as _engine_source:
+    ENGINE_VERSION = hashlib.sha256(_engine_source.read()).hexdigest()[:12]
+
+###################################################################################
+# コスト計算クラス
+class ProcessCost:
+    def __init__(self, product_split_count, batch_process_quantity, annual_process_capacity_per_unit, num_of_units, unit_cost, depreciation_period, yield_rate, material_cost_per_process, labor_cost_per_hour, labor_hours_per_process, auxiliary_material_cost_per_process, utility_cost_per_process, maintenance_cost_per_process, subcontract_cost_per_process, other_cost_per_process, upstream_total_annual_production, upstream_total_product_cost, cost_allocation_ratio_100mm, production_ratio_100mm, depreciation_allocation_ratio, maintenance_cost_allocation_ratio, consumables_cost_per_process, common_consumables_allocation_ratio, annual_depreciation_common_equipments, labor_cost_indirect_direct_ratio, annual_maintenance_common_equipment_cost, annual_common_consumables_cost):
+        # input 
+        self.product_split_count = product_split_count #製品分割数[pcs/pcs]
+        self.batch_process_quantity = batch_process_quantity #バッチ処理数量[pcs/run]
+        self.annual_process_capacity_per_unit = annual_process_capacity_per_unit #装置1台の年間工程キャパシティ[run/year]
+        self.num_of_units = num_of_units #装置台数[unit]
+        self.unit_cost = unit_cost #装置単価[yen/unit]
+        self.depreciation_period = depreciation_period #装置減価償却期間[year]
+        self.yield_rate = yield_rate #歩留まり[%]
+        self.material_cost_per_process = material_cost_per_process #1工程あたりの材料費[yen/run]
+        self.labor_cost_per_hour = labor_cost_per_hour #労務費単価[yen/h]
+        self.labor_hours_per_process = labor_hours_per_process #1工程あたりの人工数[h/run]
+        self.auxiliary_material_cost_per_process = auxiliary_material_cost_per_process #1工程あたりの補助材料費[yen/run]
+        self.utility_cost_per_process = utility_cost_per_process #1工程あたりの水光熱費[yen/run]
+        self.maintenance_cost_per_process = maintenance_cost_per_process #1工程あたりの保守維持費[yen/run]
+        self.subcontract_cost_per_process = subcontract_cost_per_process #1工程あたりの外注加工費[yen/run]
+        self.other_cost_per_process = other_cost_per_process #1工程あたりのその他費用[yen/run]
+        self.upstream_total_annual_production = upstream_total_annual_production #前工程の中間製品の総年間生産数量[pcs/year]
+        self.upstream_total_product_cost = upstream_total_product_cost #前工程の中間製品の総コスト[yen/pcs]
+        # 24/8/8追加input
+        self.production_ratio_100mm = production_ratio_100mm #100mm品製造比率[%]
+        self.cost_allocation_ratio_100mm = cost_allocation_ratio_100mm #100mm品製造コスト比率[%]
+        self.depreciation_allocation_ratio = depreciation_allocation_ratio #共通設備の減価償却費の配賦比率[%]
+        self.maintenance_cost_allocation_ratio = maintenance_cost_allocation_ratio #共通設備の保守維持費の配賦比率[%]
+        self.consumables_cost_per_process = consumables_cost_per_process #1工程あたりの消耗品費[yen/run]
+        self.common_consumables_allocation_ratio = common_consumables_allocation_ratio #共通消耗品費の配賦比率[%]
+
+        # metadata
+        self.annual_depreciation_common_equipments = annual_depreciation_common_equipments #共通設備の年間減価償却費[yen/year]
+        self.labor_cost_indirect_direct_ratio = labor_cost_indirect_direct_ratio #労務費間接費/直接費比率[-]
+        self.annual_maintenance_common_equipment_cost = annual_maintenance_common_equipment_cost #共通設備の年間保守維持費[yen/year]
+        self.annual_common_consumables_cost = annual_common_consumables_cost #年間共通消耗品費[yen/year]
+      
+    def calculate_cost_per_process(self):
+        # 1工程あたりの直接労務費[yen/run]
+        self.direct_labor_cost_per_process = self.labor_cost_per_hour * self.labor_hours_per_process
+        # 1工程あたりの労務費[yen/run]
+        self.labor_cost_per_process = self.direct_labor_cost_per_process * (1 + self.labor_cost_indirect_direct_ratio)
+        # 前工程に律速される総年間生産数量[pcs/year]
+        self.upstream_constrained_annual_production = self.upstream_total_annual_production * self.product_split_count
+        # 装置1台の年間生産キャパシティ[pcs/year/unit]
+        self.annual_product_capacity_per_unit = self.batch_process_quantity * self.annual_process_capacity_per_unit * self.product_split_count
+        # 総年間生産キャパシティ[pcs/year]
+        self.total_annual_capacity = self.annual_product_capacity_per_unit * self.num_of_units
+        # 装置1台の年間減価償却費[yen/year/unit]
+        self.annual_depreciation_per_unit = self.unit_cost / self.depreciation_period
+
+        # 2024/9/5修正
+        #総年間生産数量(歩留まり考慮)[pcs/year]
+        # 2026/10/19 np.minimum に変更 (配列を渡して一括計算できるように)
+        self.total_annual_production_with_yield = np.minimum(self.upstream_constrained_annual_production, self.total_annual_capacity) * self.yield_rate / 100
+
+        # 2024/9/5追加
+        # 100mm品総年間生産数量(歩留まり考慮)[pcs/year]
+        self.total_annual_production_with_yield_100mm = self.total_annual_production_with_yield * self.production_ratio_100mm / 100
+
+        # 総年間工程実施回数[run/year]
+        # self.total_annual_processes = self.total_annual_production_with_yield / self.batch_process_quantity
+        self.total_annual_processes = self.total_annual_production_with_yield / self.batch_process_quantity / self.product_split_count
+
+        # 2024/9/5追加
+        # 共通設備の年間装置減価償却費配賦後費用[yen/year]
+        self.allocated_annual_depreciation = self.annual_depreciation_common_equipments * self.depreciation_allocation_ratio / 100
+        # 年間装置減価償却費[yen/year]
+        self.annual_depreciation = self.annual_depreciation_per_unit * self.num_of_units + self.allocated_annual_depreciation
+        # 年間前工程製品費[yen/year]
+        self.annual_upstream_product_cost = self.upstream_total_product_cost * self.upstream_total_annual_production
+        # 年間材料費[yen/year]
+        self.annual_material_cost = self.material_cost_per_process * self.total_annual_processes
+        # 年間労務費[yen/year]
+        self.annual_labor_cost = self.labor_cost_per_process * self.total_annual_processes
+        # 年間労務時間[h/year]
+        self.annual_labor_hours = self.labor_hours_per_process * self.total_annual_processes
+        # 年間補助材料費[yen/year]
+        self.annual_auxiliary_material_cost = self.auxiliary_material_cost_per_process * self.total_annual_processes
+        # 年間水光熱費[yen/year]
+        self.annual_utility_cost = self.utility_cost_per_process * self.total_annual_processes
+        # 2024/9/5追加
+        # 共通設備の年間保守維持費配賦後費用[yen/year]
+        self.allocated_annual_maintenance_cost = self.annual_maintenance_common_equipment_cost * self.maintenance_cost_allocation_ratio / 100
+        # 年間保守維持費[yen/year]
+        self.annual_maintenance_cost = self.maintenance_cost_per_process * self.total_annual_processes + self.allocated_annual_maintenance_cost
+        # 年間その他費用[yen/year]
+        self.annual_other_cost = self.other_cost_per_process * self.total_annual_processes
+        # 2024/9/5追加
+        # 年間共通消耗品費配賦後費用[yen/year]
+        self.allocated_annual_consumables_cost = self.annual_common_consumables_cost * self.common_consumables_allocation_ratio / 100
+        # 年間消耗品費[yen/year]
+        self.annual_consumables_cost = self.consumables_cost_per_process * self.total_annual_processes + self.allocated_annual_consumables_cost
+
+        #年間総コスト[yen/year]
+        self.total_annual_cost = (
+            self.annual_upstream_product_cost +
+            self.annual_depreciation + 
+            self.annual_material_cost + 
+            self.annual_labor_cost + 
+            self.annual_auxiliary_material_cost + 
+            self.annual_utility_cost + 
+            self.annual_maintenance_cost + 
+            self.annual_other_cost +
+            self.annual_consumables_cost
+        )      
+
+        # 前工程の中間製品の総コストを除いた年間総コスト[yen/year]
+        self.total_annual_cost_without_upstream_product_cost = (
+            self.annual_depreciation + 
+            self.annual_material_cost + 
+            self.annual_labor_cost + 
+            self.annual_auxiliary_material_cost + 
+            self.annual_utility_cost + 
+            self.annual_maintenance_cost + 
+            self.annual_other_cost +
+            self.annual_consumables_cost
+        )
+
+        # 前工程の中間製品の総コストを除いた年間総コストのうち、100mm相当分[yen/year]
+        self.total_annual_cost_without_upstream_product_cost_100mm = (
+            self.annual_depreciation + 
+            self.annual_material_cost + 
+            self.annual_labor_cost + 
+            self.annual_auxiliary_material_cost + 
+            self.annual_utility_cost + 
+            self.annual_maintenance_cost + 
+            self.annual_other_cost +
+            self.annual_consumables_cost
+        ) * self.cost_allocation_ratio_100mm / 100
+
+        # 生産能力利用率[%]
+        self.production_capacity_utilization_rate = np.minimum(self.upstream_constrained_annual_production, self.total_annual_capacity) / self.total_annual_capacity * 100
+
+        # 中間製品あたりの変動費[yen/pcs] 精度要確認、モンテカルロシミュレーションの下限値と異なる
+        self.unit_variable_cost = ((
+            self.material_cost_per_process +
+            self.labor_cost_per_process +
+            self.auxiliary_material_cost_per_process +
+            self.utility_cost_per_process + 
+            self.other_cost_per_process +
+            self.consumables_cost_per_process + 
+            self.maintenance_cost_per_process + 
+            self.annual_depreciation_per_unit / self.annual_process_capacity_per_unit
+        ) / self.batch_process_quantity / self.product_split_count) / (self.yield_rate / 100)
+
+        # 100mm品中間製品あたりの変動費[yen/pcs]
+        self.unit_variable_cost_100mm = self.unit_variable_cost * self.cost_allocation_ratio_100mm / 100
+        # print('temp_unit_variable_cost',round(self.unit_variable_cost))
+
+        #中間製品あたりの総コスト[yen/pcs]
+        self.unit_product_cost = self.total_annual_cost / self.total_annual_production_with_yield
+        # print('temp_unit_product_cost',self.unit_product_cost)
+
+        # 100mm品中間製品あたりの総コスト[yen/pcs]
+        self.unit_product_cost_100mm = (self.total_annual_cost * self.cost_allocation_ratio_100mm / 100) / self.total_annual_production_with_yield_100mm
+    
+    def update_parameter_and_calculate_cost(self, parameter_name, new_value):
+        setattr(self, parameter_name, new_value)
+        self.calculate_cost_per_process()
+        return self.unit_product_cost
+
+# 整数値しか取らないパラメータ (スイープ・逆算・乱数で振るときは 1 以上の整数に丸める)
+INTEGER_PARAMETERS = frozenset({'num_of_units', 'batch_process_quantity'})
+
+###################################################################################
+# 工程ごとの計算結果のメモ
+# 1工程の calculate_cost_per_process の結果は、その工程のパラメータ・メタデータと
+# 前工程からの2つの値 (upstream_total_annual_production, upstream_total_product_cost) だけで決まる。
+# シナリオ間・スイープ・再計算で同じ入力の工程が繰り返し現れるので、入力をキーに計算結果を使い回す。
+# 上限件数は環境変数 COST_SIMULATOR_PROCESS_MEMO で指定できる (0 でメモを使わない)。
+PROCESS_MEMO_MAX_ENTRIES = int(os.environ.get('COST_SIMULATOR_PROCESS_MEMO', '10000'))
+# ProcessCost の入力の数 (__init__ の引数の数)。__init__ で代入した順に vars() の先頭に並ぶ
+_PROCESS_INPUT_COUNT = ProcessCost.__init__.__code__.co_argcount - 1
+
+class ProcessMemo:
+    """
+    工程の入力の値のタプル (ProcessCost.__init__ の引数順。前工程からの値は上書き後の値) をキーに、
+    calculate_cost_per_process 後の全属性を保持する。上限件数を超えたら最も長く使われていないものから捨てる (LRU)。
+    配列を含む入力 (calculate_chain_batch) はキーにできないので、メモを使わずにそのまま計算する。
+    """
+    def __init__(self, max_entries=PROCESS_MEMO_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def calculate(self, process):
+        """
+        process.calculate_cost_per_process() と同じ。同じ入力の計算結果があればその属性を写す
+        """
+        if self.max_entries <= 0:
+            process.calculate_cost_per_process()
+            return
+        key = tuple(list(vars(process).values())[:_PROCESS_INPUT_COUNT])
+        try:
+            with self._lock:
+                attributes = self._entries.get(key)
+                if attributes is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+        except TypeError:
+            # 配列の入力
+            process.calculate_cost_per_process()
+            return
+        if attributes is not None:
+            process.__dict__.update(attributes)
+            return
+
+        process.calculate_cost_per_process()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = dict(vars(process))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+# プロセス全体で1つのメモを共有する
+PROCESS_MEMO = ProcessMemo()
+
+###################################################################################
+# シナリオ別のコスト計算関数
+def calculate_total_cost_by_scenario(processes_input, metadata, scenario):
+    process_instances = {}
+    cost_details_by_process = {}  # 新しい辞書を追加して、各工程のコスト詳細を保存
+
+    # 各工程のインスタンスを作成し、指定されたシナリオに基づくパラメータを使用
+    for process_name, scenarios in processes_input.items():
+        params = scenarios[scenario]  # シナリオに応じたパラメータを取得
+        params.update(metadata)  # メタデータを追加
+        process = ProcessCost(**params)
+        process_instances[process_name] = process
+    
+    # 最初の工程のコストを計算
+    process_names = list(process_instances.keys())
+    PROCESS_MEMO.calculate(process_instances[process_names[0]])
+    
+    # 最初の工程のコスト詳細を保存
+    cost_details_by_process[process_names[0]] = {
+        # input
+        'product_split_count' : process_instances[process_names[0]].product_split_count,
+        'batch_process_quantity' : process_instances[process_names[0]].batch_process_quantity,
+        'annual_process_capacity_per_unit' : process_instances[process_names[0]].annual_process_capacity_per_unit,
+        'num_of_units' : process_instances[process_names[0]].num_of_units,
+        'unit_cost' : process_instances[process_names[0]].unit_cost,
+        'depreciation_period' : process_instances[process_names[0]].depreciation_period,
+        'yield_rate' : process_instances[process_names[0]].yield_rate,
+        'material_cost_per_process' : process_instances[process_names[0]].material_cost_per_process,
+        'labor_cost_per_hour' : process_instances[process_names[0]].labor_cost_per_hour,
+        'labor_hours_per_process' : process_instances[process_names[0]].labor_hours_per_process,
+        'auxiliary_material_cost_per_process' : process_instances[process_names[0]].auxiliary_material_cost_per_process,
+        'utility_cost_per_process' : process_instances[process_names[0]].utility_cost_per_process,
+        'maintenance_cost_per_process' : process_instances[process_names[0]].maintenance_cost_per_process,
+        'other_cost_per_process' : process_instances[process_names[0]].other_cost_per_process,
+        'production_ratio_100mm' : process_instances[process_names[0]].production_ratio_100mm,
+        'cost_allocation_ratio_100mm' : process_instances[process_names[0]].cost_allocation_ratio_100mm,
+        'depreciation_allocation_ratio' : process_instances[process_names[0]].depreciation_allocation_ratio,
+        'maintenance_cost_allocation_ratio' : process_instances[process_names[0]].maintenance_cost_allocation_ratio,
+        'consumables_cost_per_process' : process_instances[process_names[0]].consumables_cost_per_process,
+        'common_consumables_allocation_ratio' : process_instances[process_names[0]].common_consumables_allocation_ratio,
+        
+        # output
+        'total_annual_processes': process_instances[process_names[0]].total_annual_processes,
+        'upstream_total_product_cost': process_instances[process_names[0]].upstream_total_product_cost,
+        'annual_upstream_product_cost': process_instances[process_names[0]].annual_upstream_product_cost,
+        # 2024/9/5追加
+        'allocated_annual_depreciation': process_instances[process_names[0]].allocated_annual_depreciation,
+        'annual_depreciation': process_instances[process_names[0]].annual_depreciation,
+        'annual_material_cost': process_instances[process_names[0]].annual_material_cost,
+        'annual_labor_cost': process_instances[process_names[0]].annual_labor_cost,
+        'annual_labour_hours': process_instances[process_names[0]].annual_labor_hours,
+        'annual_auxiliary_material_cost': process_instances[process_names[0]].annual_auxiliary_material_cost,
+        'annual_utility_cost': process_instances[process_names[0]].annual_utility_cost,
+        # 2024/9/5追加
+        'allocated_annual_maintenance_cost': process_instances[process_names[0]].allocated_annual_maintenance_cost,
+        'annual_maintenance_cost': process_instances[process_names[0]].annual_maintenance_cost,
+        'annual_other_cost': process_instances[process_names[0]].annual_other_cost,
+        # 2024/9/5追加
+        'allocated_annual_consumables_cost': process_instances[process_names[0]].allocated_annual_consumables_cost,
+        'annual_consumables_cost': process_instances[process_names[0]].annual_consumables_cost,
+        'production_capacity_utilization_rate' : process_instances[process_names[0]].production_capacity_utilization_rate,
+        'upstream_constrained_annual_production' : process_instances[process_names[0]].upstream_constrained_annual_production,
+        'total_annual_capacity' : process_instances[process_names[0]].total_annual_capacity,
+        'total_annual_production_with_yield' : process_instances[process_names[0]].total_annual_production_with_yield,
+        'total_annual_production_with_yield_100mm' : process_instances[process_names[0]].total_annual_production_with_yield_100mm,
+        'total_annual_cost' : process_instances[process_names[0]].total_annual_cost,
+        'unit_product_cost' : process_instances[process_names[0]].unit_product_cost,
+        'unit_product_cost_100mm' : process_instances[process_names[0]].unit_product_cost_100mm,
+        # 2024/9/19追加
+        'total_annual_cost_without_upstream_product_cost' : process_instances[process_names[0]].total_annual_cost_without_upstream_product_cost,
+        'total_annual_cost_without_upstream_product_cost_100mm' : process_instances[process_names[0]].total_annual_cost_without_upstream_product_cost_100mm,
+        # 2024/10/1追加
+        'unit_variable_cost' : process_instances[process_names[0]].unit_variable_cost,
+        'unit_variable_cost_100mm' : process_instances[process_names[0]].unit_variable_cost_100mm,
+        # 2024/11/27追加
+        'labor_cost_per_process' : process_instances[process_names[0]].labor_cost_per_process,
+        'annual_product_capacity_per_unit' : process_instances[process_names[0]].annual_product_capacity_per_unit,
+    }
+
+    # 連続した工程のコストを計算し、各工程の出力を次の工程の入力として使用
+    for i in range(1, len(process_names)):
+        previous_process = process_instances[process_names[i-1]]
+        current_process = process_instances[process_names[i]]
+        # 前工程の出力を次工程の入力として設定
+        current_process.upstream_total_annual_production = previous_process.total_annual_production_with_yield
+        current_process.upstream_total_product_cost = previous_process.unit_product_cost
+        PROCESS_MEMO.calculate(current_process)
+
+        # 各工程のコスト詳細を保存
+        cost_details_by_process[process_names[i]] = {
+            # input
+            'product_split_count' : current_process.product_split_count,
+            'batch_process_quantity' : current_process.batch_process_quantity,
+            'annual_process_capacity_per_unit' : current_process.annual_process_capacity_per_unit,
+            'num_of_units' : current_process.num_of_units,
+            'unit_cost' : current_process.unit_cost,
+            'depreciation_period' : current_process.depreciation_period,
+            'yield_rate' : current_process.yield_rate,
+            'material_cost_per_process' : current_process.material_cost_per_process,
+            'labor_cost_per_hour' : current_process.labor_cost_per_hour,
+            'labor_hours_per_process' : current_process.labor_hours_per_process,
+            'auxiliary_material_cost_per_process' : current_process.auxiliary_material_cost_per_process,
+            'utility_cost_per_process' : current_process.utility_cost_per_process,
+            'maintenance_cost_per_process' : current_process.maintenance_cost_per_process,
+            'other_cost_per_process' : current_process.other_cost_per_process,
+            'production_ratio_100mm' : current_process.production_ratio_100mm,
+            'cost_allocation_ratio_100mm' : current_process.cost_allocation_ratio_100mm,
+            'depreciation_allocation_ratio' : current_process.depreciation_allocation_ratio,
+            'maintenance_cost_allocation_ratio' : current_process.maintenance_cost_allocation_ratio,
+            'consumables_cost_per_process' : current_process.consumables_cost_per_process,
+            'common_consumables_allocation_ratio' : current_process.common_consumables_allocation_ratio,
+
+            # output
+            'total_annual_processes': current_process.total_annual_processes,
+            'upstream_total_product_cost': current_process.upstream_total_product_cost,
+            'annual_upstream_product_cost': current_process.annual_upstream_product_cost,
+            # 2024/9/5追加
+            'allocated_annual_depreciation': current_process.allocated_annual_depreciation,
+            'annual_depreciation': current_process.annual_depreciation,
+            'annual_material_cost': current_process.annual_material_cost,
+            'annual_labor_cost': current_process.annual_labor_cost,
+            'annual_labour_hours': current_process.annual_labor_hours,
+            'annual_auxiliary_material_cost': current_process.annual_auxiliary_material_cost,
+            'annual_utility_cost': current_process.annual_utility_cost,
+            # 2024/9/5追加
+            'allocated_annual_maintenance_cost': current_process.allocated_annual_maintenance_cost,
+            'annual_maintenance_cost': current_process.annual_maintenance_cost,
+            'annual_other_cost': current_process.annual_other_cost,
+            # 2024/9/5追加
+            'allocated_annual_consumables_cost': current_process.allocated_annual_consumables_cost,
+            'annual_consumables_cost': current_process.annual_consumables_cost,
+            'production_capacity_utilization_rate' : current_process.production_capacity_utilization_rate,
+            'upstream_constrained_annual_production' : current_process.upstream_constrained_annual_production,
+            'total_annual_capacity' : current_process.total_annual_capacity,
+            'total_annual_production_with_yield' : current_process.total_annual_production_with_yield,
+            'total_annual_production_with_yield_100mm' : current_process.total_annual_production_with_yield_100mm,
+            'total_annual_cost' : current_process.total_annual_cost,
+            'unit_product_cost' : current_process.unit_product_cost,
+            'unit_product_cost_100mm' : current_process.unit_product_cost_100mm,
+            # 2024/9/19追加
+            'total_annual_cost_without_upstream_product_cost' : current_process.total_annual_cost_without_upstream_product_cost,
+            'total_annual_cost_without_upstream_product_cost_100mm' : current_process.total_annual_cost_without_upstream_product_cost_100mm,
+            # 2024/10/1追加
+            'unit_variable_cost' : current_process.unit_variable_cost,
+            'unit_variable_cost_100mm' : current_process.unit_variable_cost_100mm,
+            # 2024/11/27追加
+            'labor_cost_per_process' : current_process.labor_cost_per_process,
+            'annual_product_capacity_per_unit' : current_process.annual_product_capacity_per_unit,
+        }
+    
+    # 返す値を変更: 最後の工程の単位製品コストと各工程のコスト詳細
+    final_process = process_instances[process_names[-1]]
+    # final_unit_cost = final_process.unit_product_cost
+    final_unit_cost = final_process.unit_product_cost_100mm
+    # wafer_production = final_process.total_annual_production_with_yield
+    wafer_production = final_process.total_annual_production_with_yield_100mm
+    return final_unit_cost,wafer_production, cost_details_by_process
+
+###################################################################################
+# 途中の工程からの再計算
+def calculate_total_cost_from(processes_input, metadata, scenario, cost_details_by_process, start):
+    """
+    前回の計算結果 cost_details_by_process のうち、先頭から start 個の工程はそのまま使い、
+    start 番目以降の工程だけを計算し直す (ワークブックの一部の工程だけが変わった場合)。
+    start 番目の工程の前工程からの入力は、前回の計算結果の (start-1) 番目の工程の出力を使う。
+    戻り値: calculate_total_cost_by_scenario と同じ (100mmウエハ単価, 100mmウエハ生産数量, cost_details_by_process)
+    """
+    process_names = list(processes_input)
+    if start <= 0:
+        return calculate_total_cost_by_scenario(processes_input, metadata, scenario)
+    if start >= len(process_names):
+        last = cost_details_by_process[process_names[-1]]
+        return (last['unit_product_cost_100mm'], last['total_annual_production_with_yield_100mm'],
+                OrderedDict((name, cost_details_by_process[name]) for name in process_names))
+
+    # 後半の工程だけのチェーンを作り、先頭の工程の入力を前工程の前回の出力に置き換える
+    previous = cost_details_by_process[process_names[start - 1]]
+    tail_input = OrderedDict(
+        (name, {scenario: dict(processes_input[name][scenario])}) for name in process_names[start:]
+    )
+    tail_input[process_names[start]][scenario]['upstream_total_annual_production'] = previous['total_annual_production_with_yield']
+    tail_input[process_names[start]][scenario]['upstream_total_product_cost'] = previous['unit_product_cost']
+    final_cost, wafer_production, tail_details = calculate_total_cost_by_scenario(tail_input, metadata, scenario)
+
+    details = OrderedDict((name, cost_details_by_process[name]) for name in process_names[:start])
+    details.update(tail_details)
+    return final_cost, wafer_production, details
+
+###################################################################################
+# 先頭の工程が共通なシナリオの一括計算
+def calculate_scenarios_with_shared_prefix(scenarios, scenario='standard'):
+    """
+    scenarios: [(processes_input, metadata), ...] (入力は変更しない)
+    複数シナリオを、先頭から同じパラメータが続く工程をまとめた木 (プレフィックス木) にして計算する。
+    工程の計算結果は (メタデータ, 前工程までの木の節, 工程名, パラメータの値) ごとに1回だけ計算し、
+    シナリオどうしで初めてパラメータが異なる工程から先だけを別々に計算する
+    (下流の研磨・検査工程だけを変えたスイープでは、上流の工程の計算は1回で済む)。
+
+    戻り値: (results, stats)
+      results: [(100mmウエハ単価, 100mmウエハ生産数量, cost_details_by_process), ...] (scenarios の順。
+               calculate_total_cost_by_scenario と同じ値。共通の工程の cost_details の辞書はシナリオ間で共有する)
+      stats: {'process_evaluations': 実際に計算した工程数, 'naive_evaluations': シナリオごとに全工程を計算した場合の工程数}
+    """
+    # 木の節: {(工程名, パラメータの値のタプル): (ProcessCost, cost_details, 子の節)}
+    # 根はメタデータの値ごとに分ける (メタデータは全工程に効く)
+    roots = {}
+    results = []
+    evaluations = 0
+    for processes_input, metadata in scenarios:
+        children = roots.setdefault(tuple(metadata.items()), {})
+        previous_process = None
+        cost_details_by_process = {}
+        for process_name, cases in processes_input.items():
+            key = (process_name, tuple(cases[scenario].items()))
+            if key not in children:
+                params = dict(cases[scenario])
+                params.update(metadata)
+                process = ProcessCost(**params)
+                if previous_process is not None:
+                    # 前工程の出力を次工程の入力として設定
+                    process.upstream_total_annual_production = previous_process.total_annual_production_with_yield
+                    process.upstream_total_product_cost = previous_process.unit_product_cost
+                PROCESS_MEMO.calculate(process)
+                details = {key_name: getattr(process, _DETAIL_ATTRIBUTES.get(key_name, key_name)) for key_name in COST_DETAIL_KEYS}
+                children[key] = (process, details, {})
+                evaluations += 1
+            previous_process, cost_details_by_process[process_name], children = children[key]
+        results.append((
+            previous_process.unit_product_cost_100mm,
+            previous_process.total_annual_production_with_yield_100mm,
+            cost_details_by_process,
+        ))
+    stats = {
+        'process_evaluations': evaluations,
+        'naive_evaluations': sum(len(processes_input) for processes_input, _ in scenarios),
+    }
+    return results, stats
+
+###################################################################################
+# 配列入力による一括計算
+def calculate_chain_batch(processes_input, metadata, scenario='standard', overrides=None):
+    """
+    calculate_total_cost_by_scenario の一括計算版。
+    指定したパラメータを配列で上書きし、配列の要素ごとに工程チェーン全体を同時に計算する。
+
+    processes_input: read_parameters の parameters (変更しない)
+    metadata: read_parameters の metadata
+    overrides: {
+        ('工程名', 'パラメータ名'): 配列,
+        ('__Metadata', 'メタデータ名'): 配列,   # 全工程のメタデータを上書き
+        ...
+    }
+      配列どうしは numpy のブロードキャスト規則で組み合わされる。上書きしないパラメータは元の値のまま。
+
+    戻り値: (100mmウエハ単価の配列, 100mmウエハ生産数量の配列, {'工程名': ProcessCost, ...})
+      ProcessCost の各属性も配列になる
+    """
+    overrides = overrides or {}
+    metadata = dict(metadata)
+    for (process_name, param_name), values in overrides.items():
+        if process_name == '__Metadata':
+            metadata[param_name] = np.asarray(values, dtype=float)
+
+    process_instances = OrderedDict()
+    for process_name, scenarios in processes_input.items():
+        params = dict(scenarios[scenario])
+        params.update(metadata)
+        process_instances[process_name] = params
+    for (process_name, param_name), values in overrides.items():
+        if process_name != '__Metadata':
+            process_instances[process_name][param_name] = np.asarray(values, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        previous_process = None
+        for process_name, params in process_instances.items():
+            process = ProcessCost(**params)
+            if previous_process is not None:
+                # 前工程の出力を次工程の入力として設定
+                process.upstream_total_annual_production = previous_process.total_annual_production_with_yield
+                process.upstream_total_product_cost = previous_process.unit_product_cost
+            process.calculate_cost_per_process()
+            process_instances[process_name] = process
+            previous_process = process
+
+    return previous_process.unit_product_cost_100mm, previous_process.total_annual_production_with_yield_100mm, process_instances
+
+# calculate_total_cost_by_scenario の cost_details_by_process の項目 (並び順も同じ)
+COST_DETAIL_KEYS = (
+    # input
+    'product_split_count', 'batch_process_quantity', 'annual_process_capacity_per_unit', 'num_of_units',
+    'unit_cost', 'depreciation_period', 'yield_rate', 'material_cost_per_process', 'labor_cost_per_hour',
+    'labor_hours_per_process', 'auxiliary_material_cost_per_process', 'utility_cost_per_process',
+    'maintenance_cost_per_process', 'other_cost_per_process', 'production_ratio_100mm',
+    'cost_allocation_ratio_100mm', 'depreciation_allocation_ratio', 'maintenance_cost_allocation_ratio',
+    'consumables_cost_per_process', 'common_consumables_allocation_ratio',
+    # output
+    'total_annual_processes', 'upstream_total_product_cost', 'annual_upstream_product_cost',
+    'allocated_annual_depreciation', 'annual_depreciation', 'annual_material_cost', 'annual_labor_cost',
+    'annual_labour_hours', 'annual_auxiliary_material_cost', 'annual_utility_cost',
+    'allocated_annual_maintenance_cost', 'annual_maintenance_cost', 'annual_other_cost',
+    'allocated_annual_consumables_cost', 'annual_consumables_cost', 'production_capacity_utilization_rate',
+    'upstream_constrained_annual_production', 'total_annual_capacity', 'total_annual_production_with_yield',
+    'total_annual_production_with_yield_100mm', 'total_annual_cost', 'unit_product_cost', 'unit_product_cost_100mm',
+    'total_annual_cost_without_upstream_product_cost', 'total_annual_cost_without_upstream_product_cost_100mm',
+    'unit_variable_cost', 'unit_variable_cost_100mm', 'labor_cost_per_process', 'annual_product_capacity_per_unit',
+)
+# 項目名と ProcessCost の属性名が異なるもの
+_DETAIL_ATTRIBUTES = {'annual_labour_hours': 'annual_labor_hours'}
+
+def cost_details_from_batch(process_instances, size):
+    """
+    calculate_chain_batch の結果 (属性が配列の ProcessCost) を、要素ごとの
+    cost_details_by_process (calculate_total_cost_by_scenario と同じ形) のリスト (長さ size) にする
+    """
+    details = [{} for _ in range(size)]
+    for process_name, process in process_instances.items():
+        # 属性ごとに配列をまとめて Python の値のリストにしてから、要素ごとの辞書に振り分ける
+        columns = []
+        for key in COST_DETAIL_KEYS:
+            values = getattr(process, _DETAIL_ATTRIBUTES.get(key, key))
+            columns.append(np.broadcast_to(values, size).tolist() if np.ndim(values) else [values] * size)
+        for row, values in zip(details, zip(*columns)):
+            row[process_name] = dict(zip(COST_DETAIL_KEYS, values))
+    return details
+
+###################################################################################
+# パラメータ読み込み
+def read_parameters(file_obj):
+    """
+    file_obj: Streamlit の UploadedFile またはファイルパス(str)
+    現在は file_obj.name 等でファイル名が取れる想定
+    """
+
+    # もし文字列パスの場合 (古いパス指定) と、 UploadedFile の両対応にする
+    # Streamlitのファイルアップロードは 'UploadedFile' オブジェクト
+    # pd.ExcelFile は、ファイルパス(str) でも バイナリIO でも読み込める
+    xls = pd.ExcelFile(file_obj)
+
+    all_sheet_names = xls.sheet_names
+
+    parameters = OrderedDict()
+    metadata = {}
+
+    for sheet_name in all_sheet_names:
+        if not sheet_name.startswith('_'):
+            parameters[process_name_from_sheet(sheet_name)] = read_process_sheet(xls, sheet_name)
+        elif sheet_name == '__Metadata':
+            metadata = read_metadata_sheet(xls)
+
+    return metadata, parameters
+
+# 工程シート・メタデータシートのパラメータ表の位置 (従来のレイアウト想定)
+# 3行目が見出し (parameters, 標準, 最良, 最悪)、その下に工程シートは23行、メタデータは4行
+PROCESS_SHEET_ROWS = 23
+METADATA_SHEET_ROWS = 4
+SHEET_HEADER_ROW = 3
+
+def process_name_from_sheet(sheet_name):
+    return sheet_name.replace(" ", "_").lower()
+
+def read_process_sheet(xls, sheet_name):
+    """
+    xls: pd.ExcelFile
+    工程シート1枚のパラメータ表を {'standard': {...}, 'best': {...}, 'worst': {...}} にする
+    """
+    # skiprows=2, nrows=23 は従来のレイアウト想定のまま
+    df = pd.read_excel(xls, sheet_name=sheet_name, skiprows=SHEET_HEADER_ROW - 1, nrows=PROCESS_SHEET_ROWS)
+    df.columns = [col.strip() for col in df.columns]
+    process_data = {'standard': {}, 'best': {}, 'worst': {}}
+    for _, row in df.iterrows():
+        param_name = row['parameters']
+        process_data['standard'][param_name] = row['標準']
+        process_data['best'][param_name] = row['最良']
+        process_data['worst'][param_name] = row['最悪']
+    return process_data
+
+def read_metadata_sheet(xls):
+    """
+    xls: pd.ExcelFile
+    __Metadata シートの {'パラメータ名': 値} を返す
+    """
+    df = pd.read_excel(xls, sheet_name='__Metadata', skiprows=SHEET_HEADER_ROW - 1, nrows=METADATA_SHEET_ROWS)
+    return df.set_index('parameters')['値'].to_dict()
+
+###################################################################################
+# シナリオ別の計算結果からサマリー(key_results)を作成
+def _column_sum(cost_details_by_process, key):
+    # DataFrame.sum() と同じく欠損値は無視して合計
+    return np.nansum(np.array([details[key] for details in cost_details_by_process.values()], dtype=float))
+
+# サマリーの列 (シナリオ名 'senario' を除く)
+SUMMARY_COLUMNS = [
+    'wafer_cost',
+    'wafer_production',
+    'total_annual_cost_without_upstream_product_cost',
+    'unit_variable_cost_100mm',
+    'depr_per_wafer',
+    'depr_ratio',
+    'annual_depreciation_total',
+    'annual_labor_cost_total',
+    'annual_material_cost_total',
+    'annual_other_cost_total',
+]
+
+def summarize_scenario(final_cost, wafer_production, cost_details_by_process):
+    """
+    1シナリオ分の計算結果をサマリー1行分の辞書 {SUMMARY_COLUMNS の各列: 値} にまとめる
+    """
+    # 各工程の年間減価償却費を 100mm 品に配賦して合計
+    total_depr_100mm = sum(
+        details['annual_depreciation'] * details['cost_allocation_ratio_100mm'] / 100
+        for details in cost_details_by_process.values()
+    )
+    # 1枚あたり減価償却費
+    p = total_depr_100mm / wafer_production if wafer_production > 0 else 0
+    # 単価に占める割合(％)
+    r = p / final_cost * 100 if final_cost > 0 else 0
+
+    return {
+        'wafer_cost': final_cost,
+        'wafer_production': wafer_production,
+        'total_annual_cost_without_upstream_product_cost': _column_sum(
+            cost_details_by_process, 'total_annual_cost_without_upstream_product_cost'
+        ),
+        'unit_variable_cost_100mm': _column_sum(cost_details_by_process, 'unit_variable_cost_100mm'),
+        'depr_per_wafer': p,
+        'depr_ratio': r,
+        # 各シナリオごとの年間コスト項目を集計
+        'annual_depreciation_total': _column_sum(cost_details_by_process, 'annual_depreciation'),
+        'annual_labor_cost_total': _column_sum(cost_details_by_process, 'annual_labor_cost'),
+        'annual_material_cost_total': _column_sum(cost_details_by_process, 'annual_material_cost'),
+        # 「その他経費」は補助材料費＋水光熱費＋保守維持費＋消耗品費＋その他費用の合計
+        'annual_other_cost_total': (
+            _column_sum(cost_details_by_process, 'annual_auxiliary_material_cost') +
+            _column_sum(cost_details_by_process, 'annual_utility_cost') +
+            _column_sum(cost_details_by_process, 'annual_maintenance_cost') +
+            _column_sum(cost_details_by_process, 'annual_consumables_cost') +
+            _column_sum(cost_details_by_process, 'annual_other_cost')
+        ),
+    }
+
+def summary_frame(scenario_names, summary_rows):
+    """
+    scenario_names: シナリオ名のリスト
+    summary_rows: summarize_scenario の戻り値を同じ順に返すイテラブル
+    各列をシナリオ数分の配列として確保してから埋め、最後に1度だけ DataFrame を作る。
+    """
+    n = len(scenario_names)
+    columns = {col: np.empty(n) for col in SUMMARY_COLUMNS}
+    for i, row in enumerate(summary_rows):
+        for col in SUMMARY_COLUMNS:
+            columns[col][i] = row[col]
+
+    key_results = pd.DataFrame({'senario': list(scenario_names)})
+    for col in SUMMARY_COLUMNS:
+        key_results[col] = columns[col]
+    return key_results
+
+def build_key_results(scenario_results):
+    """
+    scenario_results: [
+        (シナリオ名, 100mmウエハ単価, 100mmウエハ生産数量, cost_details_by_process),
+        ...
+    ]
+    戻り値: シナリオごとのサマリー DataFrame (行の順序は scenario_results の順序)
+    """
+    return summary_frame(
+        [scenario_name for scenario_name, _, _, _ in scenario_results],
+        (summarize_scenario(final_cost, wafer_production, cost_details_by_process)
+         for _, final_cost, wafer_production, cost_details_by_process in scenario_results)
+    )
+
+###################################################################################
+# ワークブックの並列計算
+def evaluate_workbook(file_bytes, scenario='standard'):
+    """
+    ワークブック1ファイル分の読み込みとシナリオ計算をまとめて行う (ワーカープロセスで実行)
+    戻り値: (metadata, process_input, 100mmウエハ単価, 100mmウエハ生産数量, cost_details_by_process,
+             (読み込み時間[s], 計算時間[s]))
+    """
+    start = time.perf_counter()
+    metadata, process_input = read_parameters(io.BytesIO(file_bytes))
+    parsed = time.perf_counter()
+    final_cost, wafer_production, cost_details_by_process = calculate_total_cost_by_scenario(
+        process_input, metadata, scenario
+    )
+    finished = time.perf_counter()
+    return metadata, process_input, final_cost, wafer_production, cost_details_by_process, (parsed - start, finished - parsed)
+
+# プロセスプール (全セッションで共有し、初回利用時に作成する)
+# ワーカー数は環境変数 COST_SIMULATOR_MAX_WORKERS で指定できる。
+# 各ワーカーが pandas を読み込んだまま常駐するため、指定がなければ CPU数 と 4 の小さい方にする。
+_DEFAULT_MAX_WORKERS_CAP = 4
+
+def _max_workers_from_env():
+    cpu_count = os.cpu_count() or 1
+    value = os.environ.get('COST_SIMULATOR_MAX_WORKERS')
+    if value:
+        try:
+            return max(1, min(int(value), cpu_count))
+        except ValueError:
+            pass
+    return max(1, min(cpu_count, _DEFAULT_MAX_WORKERS_CAP))
+
+MAX_WORKERS = _max_workers_from_env()
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            # Streamlit サーバーはマルチスレッドのため fork ではなく spawn でワーカーを起動する
+            _worker_pool = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _worker_pool
+
+def _reset_worker_pool():
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is not None:
+            _worker_pool.shutdown(wait=False, cancel_futures=True)
+        _worker_pool = None
+
+def evaluate_workbooks(file_bytes_list, scenario='standard'):
+    """
+    複数ワークブックを並列に読み込み・計算し、アップロード順に結果を返す
+    (1ファイルのときはプールを使わずその場で計算する)
+    """
+    if len(file_bytes_list) <= 1 or MAX_WORKERS <= 1:
+        return [evaluate_workbook(file_bytes, scenario) for file_bytes in file_bytes_list]
+
+    try:
+        # map は投入順に結果を返すので、完了順に関係なく結果の並びは決定的
+        return list(get_worker_pool().map(evaluate_workbook, file_bytes_list, [scenario] * len(file_bytes_list)))
+    except BrokenProcessPool:
+        # ワーカーが異常終了した場合はプールを作り直し、今回は逐次計算する
+        _reset_worker_pool()
+        return [evaluate_workbook(file_bytes, scenario) for file_bytes in file_bytes_list]
+
+###################################################################################
+# 省メモリモード: ワークブックごとにサマリーまで縮約して順に返す
+def summarize_workbook(file_bytes, scenario='standard', keep_details=False):
+    """
+    ワークブック1ファイルを読み込み・計算し、サマリー1行分まで縮約する (ワーカープロセスで実行)
+    入力パラメータはここで破棄し、keep_details=True のときだけ工程別の計算結果を返す。
+    戻り値: (summarize_scenario の辞書, cost_details_by_process または None, (読み込み時間[s], 計算時間[s]))
+    """
+    metadata, process_input, final_cost, wafer_production, cost_details_by_process, elapsed = evaluate_workbook(
+        file_bytes, scenario
+    )
+    summary = summarize_scenario(final_cost, wafer_production, cost_details_by_process)
+    return summary, (cost_details_by_process if keep_details else None), elapsed
+
+def iter_summarize_workbooks(file_bytes_iter, scenario='standard', keep_details=False):
+    """
+    file_bytes_iter: ワークブックの内容(bytes)を順に返すイテラブル
+    summarize_workbook の結果を入力順に1件ずつ返す。
+    ワーカーに投入中のファイルは常に MAX_WORKERS の2倍までに抑え、全ファイル分の結果を同時に保持しない。
+    ワーカーが異常終了した場合は evaluate_workbooks と同様にプールを作り直し、残りは逐次計算する。
+    """
+    file_bytes_iter = iter(file_bytes_iter)
+    if MAX_WORKERS <= 1:
+        for file_bytes in file_bytes_iter:
+            yield summarize_workbook(file_bytes, scenario, keep_details)
+        return
+
+    # (ファイル内容, Future) を投入順に保持する (異常終了時に逐次計算し直すため内容も持つ)
+    pending = deque()
+    try:
+        pool = get_worker_pool()
+        for file_bytes in file_bytes_iter:
+            pending.append((file_bytes, pool.submit(summarize_workbook, file_bytes, scenario, keep_details)))
+            if len(pending) >= 2 * MAX_WORKERS:
+                yield pending[0][1].result()
+                pending.popleft()
+        while pending:
+            yield pending[0][1].result()
+            pending.popleft()
+    except BrokenProcessPool:
+        _reset_worker_pool()
+        for file_bytes, _ in pending:
+            yield summarize_workbook(file_bytes, scenario, keep_details)
+        for file_bytes in file_bytes_iter:
+            yield summarize_workbook(file_bytes, scenario, keep_details)
@@ -3,13 +3,37 @@
 
 # ライブラリのインポート
 import streamlit as st
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots 
 import numpy as np
 import pandas as pd
-from collections import OrderedDict
+# plotly はグラフを作る関数の中で import する (起動直後の画面表示を速くするため)
 import translation_mapping as tm # 日本語英語対応外部モジュール
+import result_store # 計算結果のSQLite保存
+import result_cache # セッション間で共有する計算結果キャッシュ
+import result_export # 計算結果のファイル出力
+import stage_timing as timing # 処理段階ごとの時間計測
+import goal_seek # 目標値からのパラメータ逆算
+import pareto # パレートフロンティア
+import capacity_planner # 需要からの装置台数計画
+import robust_capacity # 不確かさを考慮した装置台数の最適化
+import throughput_sim # 離散事象シミュレーション
+import job_queue # 長時間計算のバックグラウンドジョブ
+import uncertainty # 不確かさ評価 (準モンテカルロ)
+import parallel_mc # マルチコアのモンテカルロ
+import sensitivity # 大域的感度分析 (Sobol 指標)
+import scenario_watch # フォルダ監視による差分再計算
+import scenario_overrides # 差分シナリオファイル
+import parameter_map # 2パラメータのマップ
+import surrogate # サロゲートモデル
+from cost_engine import ( # コスト計算エンジン
+    calculate_chain_batch, read_parameters,
+    build_key_results, summary_frame, iter_summarize_workbooks, PROCESS_MEMO, INTEGER_PARAMETERS,
+)
 import logging
+import os
+import sqlite3
+import functools
+import sys
+import types
 from datetime import datetime
 
 st.set_page_config(
@@ -37,324 +61,6 @@ with st.sidebar:
                  label="Bモデルシミュレータ(エピ成長工程)")
 
 
-###################################################################################
-# コスト計算クラス
-class ProcessCost:
-    def __init__(self, product_split_count, batch_process_quantity, annual_process_capacity_per_unit, num_of_units, unit_cost, depreciation_period, yield_rate, material_cost_per_process, labor_cost_per_hour, labor_hours_per_process, auxiliary_material_cost_per_process, utility_cost_per_process, maintenance_cost_per_process, subcontract_cost_per_process, other_cost_per_process, upstream_total_annual_production, upstream_total_product_cost, cost_allocation_ratio_100mm, production_ratio_100mm, depreciation_allocation_ratio, maintenance_cost_allocation_ratio, consumables_cost_per_process, common_consumables_allocation_ratio, annual_depreciation_common_equipments, labor_cost_indirect_direct_ratio, annual_maintenance_common_equipment_cost, annual_common_consumables_cost):
-        # input 
-        self.product_split_count = product_split_count #製品分割数[pcs/pcs]
-        self.batch_process_quantity = batch_process_quantity #バッチ処理数量[pcs/run]
-        self.annual_process_capacity_per_unit = annual_process_capacity_per_unit #装置1台の年間工程キャパシティ[run/year]
-        self.num_of_units = num_of_units #装置台数[unit]
-        self.unit_cost = unit_cost #装置単価[yen/unit]
-        self.depreciation_period = depreciation_period #装置減価償却期間[year]
-        self.yield_rate = yield_rate #歩留まり[%]
-        self.material_cost_per_process = material_cost_per_process #1工程あたりの材料費[yen/run]
-        self.labor_cost_per_hour = labor_cost_per_hour #労務費単価[yen/h]
-        self.labor_hours_per_process = labor_hours_per_process #1工程あたりの人工数[h/run]
-        self.auxiliary_material_cost_per_process = auxiliary_material_cost_per_process #1工程あたりの補助材料費[yen/run]
-        self.utility_cost_per_process = utility_cost_per_process #1工程あたりの水光熱費[yen/run]
-        self.maintenance_cost_per_process = maintenance_cost_per_process #1工程あたりの保守維持費[yen/run]
-        self.subcontract_cost_per_process = subcontract_cost_per_process #1工程あたりの外注加工費[yen/run]
-        self.other_cost_per_process = other_cost_per_process #1工程あたりのその他費用[yen/run]
-        self.upstream_total_annual_production = upstream_total_annual_production #前工程の中間製品の総年間生産数量[pcs/year]
-        self.upstream_total_product_cost = upstream_total_product_cost #前工程の中間製品の総コスト[yen/pcs]
-        # 24/8/8追加input
-        self.production_ratio_100mm = production_ratio_100mm #100mm品製造比率[%]
-        self.cost_allocation_ratio_100mm = cost_allocation_ratio_100mm #100mm品製造コスト比率[%]
-        self.depreciation_allocation_ratio = depreciation_allocation_ratio #共通設備の減価償却費の配賦比率[%]
-        self.maintenance_cost_allocation_ratio = maintenance_cost_allocation_ratio #共通設備の保守維持費の配賦比率[%]
-        self.consumables_cost_per_process = consumables_cost_per_process #1工程あたりの消耗品費[yen/run]
-        self.common_consumables_allocation_ratio = common_consumables_allocation_ratio #共通消耗品費の配賦比率[%]
-
-        # metadata
-        self.annual_depreciation_common_equipments = annual_depreciation_common_equipments #共通設備の年間減価償却費[yen/year]
-        self.labor_cost_indirect_direct_ratio = labor_cost_indirect_direct_ratio #労務費間接費/直接費比率[-]
-        self.annual_maintenance_common_equipment_cost = annual_maintenance_common_equipment_cost #共通設備の年間保守維持費[yen/year]
-        self.annual_common_consumables_cost = annual_common_consumables_cost #年間共通消耗品費[yen/year]
-      
-    def calculate_cost_per_process(self):
-        # 1工程あたりの直接労務費[yen/run]
-        self.direct_labor_cost_per_process = self.labor_cost_per_hour * self.labor_hours_per_process
-        # 1工程あたりの労務費[yen/run]
-        self.labor_cost_per_process = self.direct_labor_cost_per_process * (1 + self.labor_cost_indirect_direct_ratio)
-        # 前工程に律速される総年間生産数量[pcs/year]
-        self.upstream_constrained_annual_production = self.upstream_total_annual_production * self.product_split_count
-        # 装置1台の年間生産キャパシティ[pcs/year/unit]
-        self.annual_product_capacity_per_unit = self.batch_process_quantity * self.annual_process_capacity_per_unit * self.product_split_count
-        # 総年間生産キャパシティ[pcs/year]
-        self.total_annual_capacity = self.annual_product_capacity_per_unit * self.num_of_units
-        # 装置1台の年間減価償却費[yen/year/unit]
-        self.annual_depreciation_per_unit = self.unit_cost / self.depreciation_period
-
-        # 2024/9/5修正
-        #総年間生産数量(歩留まり考慮)[pcs/year]
-        self.total_annual_production_with_yield = min(self.upstream_constrained_annual_production, self.total_annual_capacity) * self.yield_rate / 100
-
-        # 2024/9/5追加
-        # 100mm品総年間生産数量(歩留まり考慮)[pcs/year]
-        self.total_annual_production_with_yield_100mm = self.total_annual_production_with_yield * self.production_ratio_100mm / 100
-
-        # 総年間工程実施回数[run/year]
-        # self.total_annual_processes = self.total_annual_production_with_yield / self.batch_process_quantity
-        self.total_annual_processes = self.total_annual_production_with_yield / self.batch_process_quantity / self.product_split_count
-
-        # 2024/9/5追加
-        # 共通設備の年間装置減価償却費配賦後費用[yen/year]
-        self.allocated_annual_depreciation = self.annual_depreciation_common_equipments * self.depreciation_allocation_ratio / 100
-        # 年間装置減価償却費[yen/year]
-        self.annual_depreciation = self.annual_depreciation_per_unit * self.num_of_units + self.allocated_annual_depreciation
-        # 年間前工程製品費[yen/year]
-        self.annual_upstream_product_cost = self.upstream_total_product_cost * self.upstream_total_annual_production
-        # 年間材料費[yen/year]
-        self.annual_material_cost = self.material_cost_per_process * self.total_annual_processes
-        # 年間労務費[yen/year]
-        self.annual_labor_cost = self.labor_cost_per_process * self.total_annual_processes
-        # 年間労務時間[h/year]
-        self.annual_labor_hours = self.labor_hours_per_process * self.total_annual_processes
-        # 年間補助材料費[yen/year]
-        self.annual_auxiliary_material_cost = self.auxiliary_material_cost_per_process * self.total_annual_processes
-        # 年間水光熱費[yen/year]
-        self.annual_utility_cost = self.utility_cost_per_process * self.total_annual_processes
-        # 2024/9/5追加
-        # 共通設備の年間保守維持費配賦後費用[yen/year]
-        self.allocated_annual_maintenance_cost = self.annual_maintenance_common_equipment_cost * self.maintenance_cost_allocation_ratio / 100
-        # 年間保守維持費[yen/year]
-        self.annual_maintenance_cost = self.maintenance_cost_per_process * self.total_annual_processes + self.allocated_annual_maintenance_cost
-        # 年間その他費用[yen/year]
-        self.annual_other_cost = self.other_cost_per_process * self.total_annual_processes
-        # 2024/9/5追加
-        # 年間共通消耗品費配賦後費用[yen/year]
-        self.allocated_annual_consumables_cost = self.annual_common_consumables_cost * self.common_consumables_allocation_ratio / 100
-        # 年間消耗品費[yen/year]
-        self.annual_consumables_cost = self.consumables_cost_per_process * self.total_annual_processes + self.allocated_annual_consumables_cost
-
-        #年間総コスト[yen/year]
-        self.total_annual_cost = (
-            self.annual_upstream_product_cost +
-            self.annual_depreciation + 
-            self.annual_material_cost + 
-            self.annual_labor_cost + 
-            self.annual_auxiliary_material_cost + 
-            self.annual_utility_cost + 
-            self.annual_maintenance_cost + 
-            self.annual_other_cost +
-            self.annual_consumables_cost
-        )      
-
-        # 前工程の中間製品の総コストを除いた年間総コスト[yen/year]
-        self.total_annual_cost_without_upstream_product_cost = (
-            self.annual_depreciation + 
-            self.annual_material_cost + 
-            self.annual_labor_cost + 
-            self.annual_auxiliary_material_cost + 
-            self.annual_utility_cost + 
-            self.annual_maintenance_cost + 
-            self.annual_other_cost +
-            self.annual_consumables_cost
-        )
-
-        # 前工程の中間製品の総コストを除いた年間総コストのうち、100mm相当分[yen/year]
-        self.total_annual_cost_without_upstream_product_cost_100mm = (
-            self.annual_depreciation + 
-            self.annual_material_cost + 
-            self.annual_labor_cost + 
-            self.annual_auxiliary_material_cost + 
-            self.annual_utility_cost + 
-            self.annual_maintenance_cost + 
-            self.annual_other_cost +
-            self.annual_consumables_cost
-        ) * self.cost_allocation_ratio_100mm / 100
-
-        # 生産能力利用率[%]
-        self.production_capacity_utilization_rate = min(self.upstream_constrained_annual_production, self.total_annual_capacity) / self.total_annual_capacity * 100
-
-        # 中間製品あたりの変動費[yen/pcs] 精度要確認、モンテカルロシミュレーションの下限値と異なる
-        self.unit_variable_cost = ((
-            self.material_cost_per_process +
-            self.labor_cost_per_process +
-            self.auxiliary_material_cost_per_process +
-            self.utility_cost_per_process + 
-            self.other_cost_per_process +
-            self.consumables_cost_per_process + 
-            self.maintenance_cost_per_process + 
-            self.annual_depreciation_per_unit / self.annual_process_capacity_per_unit
-        ) / self.batch_process_quantity / self.product_split_count) / (self.yield_rate / 100)
-
-        # 100mm品中間製品あたりの変動費[yen/pcs]
-        self.unit_variable_cost_100mm = self.unit_variable_cost * self.cost_allocation_ratio_100mm / 100
-        # print('temp_unit_variable_cost',round(self.unit_variable_cost))
-
-        #中間製品あたりの総コスト[yen/pcs]
-        self.unit_product_cost = self.total_annual_cost / self.total_annual_production_with_yield
-        # print('temp_unit_product_cost',self.unit_product_cost)
-
-        # 100mm品中間製品あたりの総コスト[yen/pcs]
-        self.unit_product_cost_100mm = (self.total_annual_cost * self.cost_allocation_ratio_100mm / 100) / self.total_annual_production_with_yield_100mm
-    
-    def update_parameter_and_calculate_cost(self, parameter_name, new_value):
-        setattr(self, parameter_name, new_value)
-        self.calculate_cost_per_process()
-        return self.unit_product_cost
-
-###################################################################################
-# シナリオ別のコスト計算関数
-def calculate_total_cost_by_scenario(processes_input, metadata, scenario):
-    process_instances = {}
-    cost_details_by_process = {}  # 新しい辞書を追加して、各工程のコスト詳細を保存
-
-    # 各工程のインスタンスを作成し、指定されたシナリオに基づくパラメータを使用
-    for process_name, scenarios in processes_input.items():
-        params = scenarios[scenario]  # シナリオに応じたパラメータを取得
-        params.update(metadata)  # メタデータを追加
-        process = ProcessCost(**params)
-        process_instances[process_name] = process
-    
-    # 最初の工程のコストを計算
-    process_names = list(process_instances.keys())
-    process_instances[process_names[0]].calculate_cost_per_process()
-    
-    # 最初の工程のコスト詳細を保存
-    cost_details_by_process[process_names[0]] = {
-        # input
-        'product_split_count' : process_instances[process_names[0]].product_split_count,
-        'batch_process_quantity' : process_instances[process_names[0]].batch_process_quantity,
-        'annual_process_capacity_per_unit' : process_instances[process_names[0]].annual_process_capacity_per_unit,
-        'num_of_units' : process_instances[process_names[0]].num_of_units,
-        'unit_cost' : process_instances[process_names[0]].unit_cost,
-        'depreciation_period' : process_instances[process_names[0]].depreciation_period,
-        'yield_rate' : process_instances[process_names[0]].yield_rate,
-        'material_cost_per_process' : process_instances[process_names[0]].material_cost_per_process,
-        'labor_cost_per_hour' : process_instances[process_names[0]].labor_cost_per_hour,
-        'labor_hours_per_process' : process_instances[process_names[0]].labor_hours_per_process,
-        'auxiliary_material_cost_per_process' : process_instances[process_names[0]].auxiliary_material_cost_per_process,
-        'utility_cost_per_process' : process_instances[process_names[0]].utility_cost_per_process,
-        'maintenance_cost_per_process' : process_instances[process_names[0]].maintenance_cost_per_process,
-        'other_cost_per_process' : process_instances[process_names[0]].other_cost_per_process,
-        'production_ratio_100mm' : process_instances[process_names[0]].production_ratio_100mm,
-        'cost_allocation_ratio_100mm' : process_instances[process_names[0]].cost_allocation_ratio_100mm,
-        'depreciation_allocation_ratio' : process_instances[process_names[0]].depreciation_allocation_ratio,
-        'maintenance_cost_allocation_ratio' : process_instances[process_names[0]].maintenance_cost_allocation_ratio,
-        'consumables_cost_per_process' : process_instances[process_names[0]].consumables_cost_per_process,
-        'common_consumables_allocation_ratio' : process_instances[process_names[0]].common_consumables_allocation_ratio,
-        
-        # output
-        'total_annual_processes': process_instances[process_names[0]].total_annual_processes,
-        'upstream_total_product_cost': process_instances[process_names[0]].upstream_total_product_cost,
-        'annual_upstream_product_cost': process_instances[process_names[0]].annual_upstream_product_cost,
-        # 2024/9/5追加
-        'allocated_annual_depreciation': process_instances[process_names[0]].allocated_annual_depreciation,
-        'annual_depreciation': process_instances[process_names[0]].annual_depreciation,
-        'annual_material_cost': process_instances[process_names[0]].annual_material_cost,
-        'annual_labor_cost': process_instances[process_names[0]].annual_labor_cost,
-        'annual_labour_hours': process_instances[process_names[0]].annual_labor_hours,
-        'annual_auxiliary_material_cost': process_instances[process_names[0]].annual_auxiliary_material_cost,
-        'annual_utility_cost': process_instances[process_names[0]].annual_utility_cost,
-        # 2024/9/5追加
-        'allocated_annual_maintenance_cost': process_instances[process_names[0]].allocated_annual_maintenance_cost,
-        'annual_maintenance_cost': process_instances[process_names[0]].annual_maintenance_cost,
-        'annual_other_cost': process_instances[process_names[0]].annual_other_cost,
-        # 2024/9/5追加
-        'allocated_annual_consumables_cost': process_instances[process_names[0]].allocated_annual_consumables_cost,
-        'annual_consumables_cost': process_instances[process_names[0]].annual_consumables_cost,
-        'production_capacity_utilization_rate' : process_instances[process_names[0]].production_capacity_utilization_rate,
-        'upstream_constrained_annual_production' : process_instances[process_names[0]].upstream_constrained_annual_production,
-        'total_annual_capacity' : process_instances[process_names[0]].total_annual_capacity,
-        'total_annual_production_with_yield' : process_instances[process_names[0]].total_annual_production_with_yield,
-        'total_annual_production_with_yield_100mm' : process_instances[process_names[0]].total_annual_production_with_yield_100mm,
-        'total_annual_cost' : process_instances[process_names[0]].total_annual_cost,
-        'unit_product_cost' : process_instances[process_names[0]].unit_product_cost,
-        'unit_product_cost_100mm' : process_instances[process_names[0]].unit_product_cost_100mm,
-        # 2024/9/19追加
-        'total_annual_cost_without_upstream_product_cost' : process_instances[process_names[0]].total_annual_cost_without_upstream_product_cost,
-        'total_annual_cost_without_upstream_product_cost_100mm' : process_instances[process_names[0]].total_annual_cost_without_upstream_product_cost_100mm,
-        # 2024/10/1追加
-        'unit_variable_cost' : process_instances[process_names[0]].unit_variable_cost,
-        'unit_variable_cost_100mm' : process_instances[process_names[0]].unit_variable_cost_100mm,
-        # 2024/11/27追加
-        'labor_cost_per_process' : process_instances[process_names[0]].labor_cost_per_process,
-        'annual_product_capacity_per_unit' : process_instances[process_names[0]].annual_product_capacity_per_unit,
-    }
-
-    # 連続した工程のコストを計算し、各工程の出力を次の工程の入力として使用
-    for i in range(1, len(process_names)):
-        previous_process = process_instances[process_names[i-1]]
-        current_process = process_instances[process_names[i]]
-        # 前工程の出力を次工程の入力として設定
-        current_process.upstream_total_annual_production = previous_process.total_annual_production_with_yield
-        current_process.upstream_total_product_cost = previous_process.unit_product_cost
-        current_process.calculate_cost_per_process()
-
-        # 各工程のコスト詳細を保存
-        cost_details_by_process[process_names[i]] = {
-            # input
-            'product_split_count' : current_process.product_split_count,
-            'batch_process_quantity' : current_process.batch_process_quantity,
-            'annual_process_capacity_per_unit' : current_process.annual_process_capacity_per_unit,
-            'num_of_units' : current_process.num_of_units,
-            'unit_cost' : current_process.unit_cost,
-            'depreciation_period' : current_process.depreciation_period,
-            'yield_rate' : current_process.yield_rate,
-            'material_cost_per_process' : current_process.material_cost_per_process,
-            'labor_cost_per_hour' : current_process.labor_cost_per_hour,
-            'labor_hours_per_process' : current_process.labor_hours_per_process,
-            'auxiliary_material_cost_per_process' : current_process.auxiliary_material_cost_per_process,
-            'utility_cost_per_process' : current_process.utility_cost_per_process,
-            'maintenance_cost_per_process' : current_process.maintenance_cost_per_process,
-            'other_cost_per_process' : current_process.other_cost_per_process,
-            'production_ratio_100mm' : current_process.production_ratio_100mm,
-            'cost_allocation_ratio_100mm' : current_process.cost_allocation_ratio_100mm,
-            'depreciation_allocation_ratio' : current_process.depreciation_allocation_ratio,
-            'maintenance_cost_allocation_ratio' : current_process.maintenance_cost_allocation_ratio,
-            'consumables_cost_per_process' : current_process.consumables_cost_per_process,
-            'common_consumables_allocation_ratio' : current_process.common_consumables_allocation_ratio,
-
-            # output
-            'total_annual_processes': current_process.total_annual_processes,
-            'upstream_total_product_cost': current_process.upstream_total_product_cost,
-            'annual_upstream_product_cost': current_process.annual_upstream_product_cost,
-            # 2024/9/5追加
-            'allocated_annual_depreciation': current_process.allocated_annual_depreciation,
-            'annual_depreciation': current_process.annual_depreciation,
-            'annual_material_cost': current_process.annual_material_cost,
-            'annual_labor_cost': current_process.annual_labor_cost,
-            'annual_labour_hours': current_process.annual_labor_hours,
-            'annual_auxiliary_material_cost': current_process.annual_auxiliary_material_cost,
-            'annual_utility_cost': current_process.annual_utility_cost,
-            # 2024/9/5追加
-            'allocated_annual_maintenance_cost': current_process.allocated_annual_maintenance_cost,
-            'annual_maintenance_cost': current_process.annual_maintenance_cost,
-            'annual_other_cost': current_process.annual_other_cost,
-            # 2024/9/5追加
-            'allocated_annual_consumables_cost': current_process.allocated_annual_consumables_cost,
-            'annual_consumables_cost': current_process.annual_consumables_cost,
-            'production_capacity_utilization_rate' : current_process.production_capacity_utilization_rate,
-            'upstream_constrained_annual_production' : current_process.upstream_constrained_annual_production,
-            'total_annual_capacity' : current_process.total_annual_capacity,
-            'total_annual_production_with_yield' : current_process.total_annual_production_with_yield,
-            'total_annual_production_with_yield_100mm' : current_process.total_annual_production_with_yield_100mm,
-            'total_annual_cost' : current_process.total_annual_cost,
-            'unit_product_cost' : current_process.unit_product_cost,
-            'unit_product_cost_100mm' : current_process.unit_product_cost_100mm,
-            # 2024/9/19追加
-            'total_annual_cost_without_upstream_product_cost' : current_process.total_annual_cost_without_upstream_product_cost,
-            'total_annual_cost_without_upstream_product_cost_100mm' : current_process.total_annual_cost_without_upstream_product_cost_100mm,
-            # 2024/10/1追加
-            'unit_variable_cost' : current_process.unit_variable_cost,
-            'unit_variable_cost_100mm' : current_process.unit_variable_cost_100mm,
-            # 2024/11/27追加
-            'labor_cost_per_process' : current_process.labor_cost_per_process,
-            'annual_product_capacity_per_unit' : current_process.annual_product_capacity_per_unit,
-        }
-    
-    # 返す値を変更: 最後の工程の単位製品コストと各工程のコスト詳細
-    final_process = process_instances[process_names[-1]]
-    # final_unit_cost = final_process.unit_product_cost
-    final_unit_cost = final_process.unit_product_cost_100mm
-    # wafer_production = final_process.total_annual_production_with_yield
-    wafer_production = final_process.total_annual_production_with_yield_100mm
-    return final_unit_cost,wafer_production, cost_details_by_process
-
 ###################################################################################
 # 日本語工程名を取得
 def prepare_cost_data(costs_by_process, cost_categories):
@@ -363,9 +69,20 @@ def prepare_cost_data(costs_by_process, cost_categories):
                  for category in cost_categories}
     return labels, cost_data
 
+###################################################################################
+# グラフのキャッシュ
+def cached_figures(name, cache_key, product_choice, build):
+    """
+    build() が返すグラフのリストを、(グラフ名, cache_key, 品種, 計算エンジンのバージョン) をキーにキャッシュする。
+    cache_key が None のときはキャッシュしない
+    """
+    if cache_key is None:
+        return build()
+    return result_cache.get_cache().get_or_compute(result_cache.make_key(name, cache_key, product_choice), build)
+
 ###################################################################################
 # 年間総コストのプロット関数
-def plot_annual_costs_per_process(data_dict, product_choice):
+def build_annual_costs_per_process_figures(data_dict, product_choice):
     """
     data_dict: {
        'シナリオ名': {
@@ -380,6 +97,8 @@ def plot_annual_costs_per_process(data_dict, product_choice):
        '別のシナリオ名': {...}
     }
     """
+    import plotly.graph_objects as go
+    figures = []  # [(Figure, st.plotly_chart のキーワード引数), ...]
 
     # 英語キー -> 日本語ラベル の対応表
     cost_category_labels = {
@@ -452,13 +171,27 @@ def plot_annual_costs_per_process(data_dict, product_choice):
         fig.update_xaxes(showgrid=True, gridcolor='#ccc')
         fig.update_yaxes(showgrid=True, gridcolor='#eee')
 
-        # Streamlit で表示
-        st.plotly_chart(fig, use_container_width=False)
+        # 表示するグラフに追加
+        figures.append((fig, {'use_container_width': False}))
+
+    return figures
+
+@timing.timed
+def plot_annual_costs_per_process(data_dict, product_choice, cache_key=None):
+    """
+    build_annual_costs_per_process_figures で作ったグラフを表示する。
+    cache_key を渡したときは作成済みのグラフをセッション間で共有する (キャッシュのキーに品種を含める)
+    """
+    figures = cached_figures(
+        'plot_annual_costs_per_process', cache_key, product_choice, lambda: build_annual_costs_per_process_figures(data_dict, product_choice)
+    )
+    for fig, chart_kwargs in figures:
+        st.plotly_chart(fig, **chart_kwargs)
 
 
 ###################################################################################
 # 年間製造キャパシティ・稼働率・100mm総年間生産数量のプロット関数
-def plot_capacity_per_process(data_dict, product_choice):
+def build_capacity_per_process_figures(data_dict, product_choice):
     """
     Plot capacities and utilization rates for multiple processes side by side using Plotly.
 
@@ -478,6 +211,8 @@ def plot_capacity_per_process(data_dict, product_choice):
 
     product_choice: "基板" or "エピ" （工程名を日本語変換するため）
     """
+    import plotly.graph_objects as go
+    figures = []  # [(Figure, st.plotly_chart のキーワード引数), ...]
 
     # 1) 工程の英名一覧を集める
     all_processes = []
@@ -522,7 +257,7 @@ def plot_capacity_per_process(data_dict, product_choice):
     fig1.update_xaxes(showgrid=True, gridcolor='#ccc')
     fig1.update_yaxes(showgrid=True, gridcolor='#eee')
 
-    st.plotly_chart(fig1, use_container_width=False)
+    figures.append((fig1, {'use_container_width': False}))
 
     # ---------- グラフ2: 稼働率 ----------
     fig2 = go.Figure()
@@ -550,7 +285,7 @@ def plot_capacity_per_process(data_dict, product_choice):
     fig2.update_xaxes(showgrid=True, gridcolor='#ccc')
     fig2.update_yaxes(showgrid=True, gridcolor='#eee')
 
-    st.plotly_chart(fig2, use_container_width=False)
+    figures.append((fig2, {'use_container_width': False}))
 
     # ---------- グラフ3: 100mm総年間生産数量(歩留まり考慮) ----------
     fig3 = go.Figure()
@@ -578,7 +313,7 @@ def plot_capacity_per_process(data_dict, product_choice):
     fig3.update_xaxes(showgrid=True, gridcolor='#ccc')
     fig3.update_yaxes(showgrid=True, gridcolor='#eee')
 
-    st.plotly_chart(fig3, use_container_width=False)
+    figures.append((fig3, {'use_container_width': False}))
 
     # ---------- グラフ4: 年間生産数量(歩留まり考慮) ----------
     fig4 = go.Figure()
@@ -606,11 +341,26 @@ def plot_capacity_per_process(data_dict, product_choice):
     fig4.update_xaxes(showgrid=True, gridcolor='#ccc')
     fig4.update_yaxes(showgrid=True, gridcolor='#eee')
 
-    st.plotly_chart(fig4, use_container_width=False)
+    figures.append((fig4, {'use_container_width': False}))
+
+    return figures
+
+@timing.timed
+def plot_capacity_per_process(data_dict, product_choice, cache_key=None):
+    """
+    build_capacity_per_process_figures で作ったグラフを表示する。
+    cache_key を渡したときは作成済みのグラフをセッション間で共有する (キャッシュのキーに品種を含める)
+    """
+    figures = cached_figures(
+        'plot_capacity_per_process', cache_key, product_choice, lambda: build_capacity_per_process_figures(data_dict, product_choice)
+    )
+    for fig, chart_kwargs in figures:
+        st.plotly_chart(fig, **chart_kwargs)
+
 
 ###################################################################################
 # 中間製品コスト・中間製品変動費のプロット関数
-def plot_unit_product_cost_per_process(data_dict, product_choice):
+def build_unit_product_cost_per_process_figures(data_dict, product_choice):
     """
     data_dict: {
         'シナリオ名': {
@@ -626,6 +376,8 @@ def plot_unit_product_cost_per_process(data_dict, product_choice):
     }
     product_choice: "基板" または "エピ"
     """
+    import plotly.graph_objects as go
+    figures = []  # [(Figure, st.plotly_chart のキーワード引数), ...]
 
     # 1) すべての工程名を一意に取得（元コードと同様）
     all_processes = []
@@ -679,9 +431,8 @@ def plot_unit_product_cost_per_process(data_dict, product_choice):
     # x 軸に「xxx,xxx」形式を適用
     fig_unit.update_xaxes(tickformat=",.0f")
 
-    st.plotly_chart(fig_unit)
+    figures.append((fig_unit, {}))
 
-    st.markdown('---')
 
     # -----------------------------------------------------------------------
     # 続いて「変動費 (unit_variable_cost)」のバーを
@@ -717,13 +468,32 @@ def plot_unit_product_cost_per_process(data_dict, product_choice):
     # こちらも x 軸を「xxx,xxx」形式に
     fig_var.update_xaxes(tickformat=",.0f")
 
-    st.plotly_chart(fig_var)
+    figures.append((fig_var, {}))
+
+    return figures
+
+@timing.timed
+def plot_unit_product_cost_per_process(data_dict, product_choice, cache_key=None):
+    """
+    build_unit_product_cost_per_process_figures で作ったグラフを表示する。
+    cache_key を渡したときは作成済みのグラフをセッション間で共有する (キャッシュのキーに品種を含める)
+    """
+    figures = cached_figures(
+        'plot_unit_product_cost_per_process', cache_key, product_choice, lambda: build_unit_product_cost_per_process_figures(data_dict, product_choice)
+    )
+    for i, (fig, chart_kwargs) in enumerate(figures):
+        if i > 0:
+            st.markdown('---')
+        st.plotly_chart(fig, **chart_kwargs)
+
 
 ###################################################################################
 # シナリオ別の生産数量とウエハー単価のプロット関数
+@timing.timed
 def plot_scenario_scatter(key_results,
                           substrate_point=None,
-                          epi_point=None):
+                          epi_point=None,
+                          frontier=None):
     """
     key_results: pd.DataFrame
        - 列名に 'wafer_production', 'wafer_cost', 'senario' が含まれることを想定
@@ -736,7 +506,12 @@ def plot_scenario_scatter(key_results,
     epi_point: tuple or None
        - エピ実績 (x, y, label, color) を渡す
        - Noneの場合は描画しない
+
+    frontier: pd.DataFrame or None
+       - パレートフロンティア (列 wafer_production, wafer_cost) を線で重ねて描画する
+       - Noneの場合は描画しない
     """
+    import plotly.graph_objects as go
 
     # 1) 軸の最大値を計算 (データの最大値を基に少し余裕をもたせる)
     #    key_results 内の wafer_production と wafer_cost の最大値を取得
@@ -774,6 +549,16 @@ def plot_scenario_scatter(key_results,
         name='シナリオ'
     ))
 
+    # (A') パレートフロンティア (単価が低く生産数量が多い側の境界)
+    if frontier is not None and len(frontier) > 0:
+        fig.add_trace(go.Scatter(
+            x=frontier['wafer_production'],
+            y=frontier['wafer_cost'],
+            mode='lines',
+            line=dict(color='red', dash='dash'),
+            name='パレートフロンティア'
+        ))
+
     # (B) 基板実績を追加
     if substrate_point is not None:
         sx, sy, s_label, s_color = substrate_point
@@ -835,9 +620,67 @@ def plot_scenario_scatter(key_results,
     # 5) Streamlit で表示
     st.plotly_chart(fig)
 
+###################################################################################
+# スイープ結果のパレートフロンティアのプロット関数
+@timing.timed
+def plot_pareto_frontier(frontier, background, key_results=None):
+    """
+    frontier: pareto.sweep_frontier の非劣解 (列 wafer_cost, wafer_production, capex)
+    background: 表示用に間引いたスイープ結果 (同じ列)
+    key_results: 元のシナリオの点を重ねる場合はサマリー DataFrame
+
+    スイープの全点は描画せず、間引いた点を背景に、非劣解を総設備投資額で色分けして重ねる
+    """
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(
+        x=background['wafer_production'],
+        y=background['wafer_cost'],
+        mode='markers',
+        marker=dict(size=3, color='lightgray'),
+        name=f'スイープ結果 (表示 {len(background):,} 点)',
+        hoverinfo='skip'
+    ))
+    fig.add_trace(go.Scattergl(
+        x=frontier['wafer_production'],
+        y=frontier['wafer_cost'],
+        mode='markers',
+        marker=dict(
+            size=6,
+            color=frontier['capex'] / 1e8,
+            colorscale='Viridis',
+            colorbar=dict(title='総設備投資額<br>[億円]')
+        ),
+        customdata=frontier['capex'] / 1e8,
+        hovertemplate='生産数量: %{x:,.0f}<br>単価: %{y:,.0f}<br>総設備投資額: %{customdata:,.1f}億円<extra></extra>',
+        name=f'パレートフロンティア ({len(frontier):,} 点)'
+    ))
+    if key_results is not None:
+        fig.add_trace(go.Scatter(
+            x=key_results['wafer_production'],
+            y=key_results['wafer_cost'],
+            mode='markers+text',
+            text=key_results['senario'],
+            textposition='top center',
+            marker=dict(symbol='circle', size=8, color='blue'),
+            name='シナリオ'
+        ))
+
+    fig.update_layout(
+        title='スイープ結果のパレートフロンティア (単価・生産数量・総設備投資額)',
+        xaxis_title='100mmウエハ生産数量[pcs/year]',
+        yaxis_title='100mmウエハ単価[yen/pcs]',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02),
+        width=800,
+        height=800
+    )
+    fig.update_xaxes(showline=True, linecolor='black', gridcolor='#ccc', showgrid=True)
+    fig.update_yaxes(showline=True, linecolor='black', gridcolor='#ccc', tickformat=",.0f", showgrid=True)
+    st.plotly_chart(fig)
+
 ###################################################################################
 # 製品種ごとの工程ごとの生産比率とコスト配賦比率のプロット関数
-def plot_product_ratio(data_dict, product_choice):
+def build_product_ratio_figures(data_dict, product_choice):
     """
     各シナリオごとに、工程ごとの production_ratio_100mm と cost_allocation_ratio_100mm を
     分かりやすく表示するグラフを作成します。
@@ -859,6 +702,8 @@ def plot_product_ratio(data_dict, product_choice):
         }
     - product_choice: "基板" または "エピ" （工程名を日本語変換するため）
     """
+    import plotly.graph_objects as go
+    figures = []  # [(Figure, st.plotly_chart のキーワード引数), ...]
     
     import plotly.express as px  # カラーパレットのために再インポート
     # 製品種に応じた工程名辞書を選択
@@ -927,8 +772,8 @@ def plot_product_ratio(data_dict, product_choice):
     # データラベルのフォントサイズを調整
     fig_production.update_traces(textfont_size=12)
 
-    # Streamlit で表示
-    st.plotly_chart(fig_production, use_container_width=True)
+    # 表示するグラフに追加
+    figures.append((fig_production, {'use_container_width': True}))
 
     # -----------------------
     # グラフ2: コスト配賦比率 100mm (%)
@@ -978,18 +823,34 @@ def plot_product_ratio(data_dict, product_choice):
     # データラベルのフォントサイズを調整
     fig_cost_allocation.update_traces(textfont_size=12)
 
-    # Streamlit で表示
-    st.plotly_chart(fig_cost_allocation, use_container_width=True)
+    # 表示するグラフに追加
+    figures.append((fig_cost_allocation, {'use_container_width': True}))
+
+    return figures
+
+@timing.timed
+def plot_product_ratio(data_dict, product_choice, cache_key=None):
+    """
+    build_product_ratio_figures で作ったグラフを表示する。
+    cache_key を渡したときは作成済みのグラフをセッション間で共有する (キャッシュのキーに品種を含める)
+    """
+    figures = cached_figures(
+        'plot_product_ratio', cache_key, product_choice, lambda: build_product_ratio_figures(data_dict, product_choice)
+    )
+    for fig, chart_kwargs in figures:
+        st.plotly_chart(fig, **chart_kwargs)
 
 
 ###################################################################################
 # ウエハ1枚あたり費目構成の可視化
-def plot_cost_composition_per_wafer(data_dict, product_choice):
+def build_cost_composition_per_wafer_figures(data_dict, product_choice):
     """
     各シナリオについて、
       (各工程の費目年間コスト合計) / (最終的な100mmウエハ年間生産枚数)
     を計算し、その費目内訳を積み上げバーで可視化する。
     """
+    import plotly.graph_objects as go
+    figures = []  # [(Figure, st.plotly_chart のキーワード引数), ...]
     # 英語キーから日本語ラベルへの対応辞書を作成
     cost_category_labels = {
         'annual_depreciation': '減価償却費',
@@ -1060,10 +921,26 @@ def plot_cost_composition_per_wafer(data_dict, product_choice):
         height=600
     )
     fig.update_yaxes(tickformat=",.0f", showgrid=True, gridcolor='#ccc')
-    st.plotly_chart(fig, use_container_width=False)
+    figures.append((fig, {'use_container_width': False}))
+
+    return figures
+
+@timing.timed
+def plot_cost_composition_per_wafer(data_dict, product_choice, cache_key=None):
+    """
+    build_cost_composition_per_wafer_figures で作ったグラフを表示する。
+    cache_key を渡したときは作成済みのグラフをセッション間で共有する (キャッシュのキーに品種を含める)
+    """
+    figures = cached_figures(
+        'plot_cost_composition_per_wafer', cache_key, product_choice, lambda: build_cost_composition_per_wafer_figures(data_dict, product_choice)
+    )
+    for fig, chart_kwargs in figures:
+        st.plotly_chart(fig, **chart_kwargs)
+
 
 ################################################################################
 # 装置台数のテーブル表示
+@timing.timed
 def show_equipment_units_table(data_dict, product_choice):
     """
     data_dict: {
@@ -1112,6 +989,7 @@ def show_equipment_units_table(data_dict, product_choice):
 
 ###################################################################################
 # 入力パラメータ表示
+@timing.timed
 def show_input_parameters(all_process_inputs):
     """
     all_process_inputs: {
@@ -1170,6 +1048,7 @@ def show_input_parameters(all_process_inputs):
 
 ###################################################################################
 # 出力結果表示
+@timing.timed
 def show_output_results(full_results):
     """
     full_results: {
@@ -1198,151 +1077,84 @@ def show_output_results(full_results):
         st.dataframe(scenario_df.style.format(precision=2))
 
 ###################################################################################
-# パラメータ読み込み
-def read_parameters(file_obj):
-    """
-    file_obj: Streamlit の UploadedFile またはファイルパス(str)
-    現在は file_obj.name 等でファイル名が取れる想定
-    """
-
-    # もし文字列パスの場合 (古いパス指定) と、 UploadedFile の両対応にする
-    # Streamlitのファイルアップロードは 'UploadedFile' オブジェクト
-    # pd.ExcelFile は、ファイルパス(str) でも バイナリIO でも読み込める
-    xls = pd.ExcelFile(file_obj)
-
-    all_sheet_names = xls.sheet_names
-
-    def process_sheet_data(df):
-        df.columns = [col.strip() for col in df.columns]
-        process_data = {'standard': {}, 'best': {}, 'worst': {}}
-        for _, row in df.iterrows():
-            param_name = row['parameters']
-            process_data['standard'][param_name] = row['標準']
-            process_data['best'][param_name] = row['最良']
-            process_data['worst'][param_name] = row['最悪']
-        return process_data
-
-    parameters = OrderedDict()
-    metadata = {}
-
-    for sheet_name in all_sheet_names:
-        if not sheet_name.startswith('_'):
-            # skiprows=2, nrows=23 は従来のレイアウト想定のまま
-            df = pd.read_excel(xls, sheet_name=sheet_name, skiprows=2, nrows=23)
-            processed_data = process_sheet_data(df)
-            processed_sheet_name = sheet_name.replace(" ", "_").lower()
-            parameters[processed_sheet_name] = processed_data
-        elif sheet_name == '__Metadata':
-            # df = pd.read_excel(xls, sheet_name=sheet_name, skiprows=2)
-            df = pd.read_excel(xls, sheet_name=sheet_name, skiprows=2, nrows=4)
-            metadata = df.set_index('parameters')['値'].to_dict()
-
-    return metadata, parameters
+# ファイル名からシナリオ名を取得
+def scenario_name_from_file(file_name):
+    file_name_no_ext = file_name.rsplit('.', 1)[0]  # 拡張子除去
+    return file_name_no_ext[25:] if len(file_name_no_ext) > 25 else file_name_no_ext
 
 ###################################################################################
 # シミュレーション実行
-def run_simulation(file_objs, product_choice):
+def run_simulation(file_objs, product_choice, export_format='xlsx', pareto_sweep=None):
     """
     file_objs: List of uploaded Excel files
     product_choice: "基板" or "エピ"
+    export_format: 計算結果ダウンロードの形式 ('xlsx', 'csv' or 'parquet')
+    pareto_sweep: パレート分析のスイープ設定 {'param_names': [...], 'n_samples': int, 'spread': float}
+                  None のときはスイープしない
     """
     full_results = {}
-    full_results_df = {}
-    key_results = pd.DataFrame(columns=[
-        'senario',
-        'wafer_cost',
-        'wafer_production',
-        'total_annual_cost_without_upstream_product_cost',
-        'unit_variable_cost_100mm'
-    ])
+    scenario_results = []
 
     all_process_inputs = {}  # 追加: 全シナリオの入力パラメータを保存
+    all_metadata = {}  # DB保存用: シナリオごとのメタデータ
+    file_info = {}  # DB保存用: シナリオごとの (ファイル名, ハッシュ)
 
     # Logging
     logging.info("start simulation")
 
-    for file_obj in file_objs:
+    # 全ファイルの読み込みとシナリオ計算をワーカープロセスで並列に実行 (結果はアップロード順)
+    file_bytes_list = [file_obj.getvalue() for file_obj in file_objs]
+    # 同じワークブックの計算結果はセッション間で共有する
+    with timing.stage('evaluate_workbooks', scenarios=len(file_objs), payload_bytes=sum(map(len, file_bytes_list))) as info:
+        evaluated, info['cache_hits'] = result_cache.evaluate_workbooks_cached(file_bytes_list, 'standard')
+
+    for file_obj, file_bytes, result in zip(file_objs, file_bytes_list, evaluated):
+        metadata, process_input, final_cost, wafer_production, cost_details_by_process, (parse_s, calc_s) = result
+
         # ファイル名からシナリオ名を取得
-        file_name_no_ext = file_obj.name.rsplit('.', 1)[0]  # 拡張子除去
-        scenario_name = file_name_no_ext[25:] if len(file_name_no_ext) > 25 else file_name_no_ext
+        scenario_name = scenario_name_from_file(file_obj.name)
 
-        # パラメータの読み込み (UploadedFile をそのまま渡す)
-        metadata, process_input = read_parameters(file_obj)
-        final_cost, wafer_production, cost_details_by_process = calculate_total_cost_by_scenario(
-            process_input, metadata, 'standard'
-        )
+        # ワーカー内で計測した時間を記録
+        timing.record('read_parameters', parse_s, scenario=scenario_name, payload_bytes=len(file_bytes),
+                      processes=len(process_input))
+        timing.record('calculate_total_cost_by_scenario', calc_s, scenario=scenario_name,
+                      processes=len(process_input))
 
         # 結果を保存
         full_results[scenario_name] = cost_details_by_process
-        senario_result_df = pd.DataFrame.from_dict(cost_details_by_process).T
-        full_results_df[scenario_name] = senario_result_df
-
-        new_row = pd.DataFrame({
-            'senario': [scenario_name],
-            'wafer_cost': [final_cost],
-            'wafer_production': [wafer_production],
-            'total_annual_cost_without_upstream_product_cost': [
-                senario_result_df['total_annual_cost_without_upstream_product_cost'].sum()
-            ],
-            'unit_variable_cost_100mm': [
-                senario_result_df['unit_variable_cost_100mm'].sum()
-            ]
-        })
-        key_results = pd.concat([key_results, new_row], ignore_index=True)
+        scenario_results.append((scenario_name, final_cost, wafer_production, cost_details_by_process))
 
         # 追加: 全シナリオの入力パラメータを保存
         all_process_inputs[scenario_name] = process_input
+        all_metadata[scenario_name] = metadata
+        file_info[scenario_name] = (file_obj.name, result_store.workbook_hash(file_bytes))
+
+    # サマリーの集計
+    with timing.stage('aggregate_results', scenarios=len(scenario_results)):
+        key_results = build_key_results(scenario_results)
+        full_results_df = {
+            scenario_name: pd.DataFrame.from_dict(cost_details_by_process).T
+            for scenario_name, cost_details_by_process in full_results.items()
+        }
 
-    depr_per_wafer = []
-    depr_ratio = []
-    for scenario in full_results:
-        # 各工程の年間減価償却費を 100mm 品に配賦して合計
-        total_depr_100mm = sum(
-            details['annual_depreciation'] * details['cost_allocation_ratio_100mm'] / 100
-            for details in full_results[scenario].values()
-        )
-        # 100mm 年間生産枚数
-        wafer_prod = key_results.loc[key_results['senario'] == scenario, 'wafer_production'].iat[0]
-        # 100mm 単価
-        wafer_cost = key_results.loc[key_results['senario'] == scenario, 'wafer_cost'].iat[0]
-
-        # 1枚あたり減価償却費
-        p = total_depr_100mm / wafer_prod if wafer_prod > 0 else 0
-        depr_per_wafer.append(p)
-        # 単価に占める割合(％)
-        r = p / wafer_cost * 100 if wafer_cost > 0 else 0
-        depr_ratio.append(r)
-
-    # key_results に新しくカラムを追加
-    key_results['depr_per_wafer'] = depr_per_wafer
-    key_results['depr_ratio']      = depr_ratio
-
-    # ──────────────── 追加ここから ────────────────
-    # 各シナリオごとの年間コスト項目を集計
-    annual_depr_list     = []
-    annual_labor_list    = []
-    annual_material_list = []
-    annual_other_list    = []
-    for scenario, df in full_results_df.items():
-        # full_results_df[scenario] は各工程の cost_details を行＝工程列＝コスト項目で持つ DataFrame
-        annual_depr_list.append(    df['annual_depreciation'].sum()    )
-        annual_labor_list.append(   df['annual_labor_cost'].sum()       )
-        annual_material_list.append(df['annual_material_cost'].sum()    )
-        # 「その他経費」は補助材料費＋水光熱費＋保守維持費＋消耗品費＋その他費用の合計  
-        annual_other_list.append(
-            df['annual_auxiliary_material_cost'].sum() +
-            df['annual_utility_cost'].sum() +
-            df['annual_maintenance_cost'].sum() +
-            df['annual_consumables_cost'].sum() +
-            df['annual_other_cost'].sum()
-        )
-
-    # key_results に新しい列として追加
-    key_results['annual_depreciation_total'] = annual_depr_list
-    key_results['annual_labor_cost_total']   = annual_labor_list
-    key_results['annual_material_cost_total']= annual_material_list
-    key_results['annual_other_cost_total']   = annual_other_list
-
+    # 計算結果をDBに保存 (保存に失敗しても画面表示は続ける)
+    try:
+        with timing.stage('save_run', scenarios=len(full_results)):
+            result_store.save_run(product_choice, [
+                {
+                    'scenario': row['senario'],
+                    'file_name': file_info[row['senario']][0],
+                    'workbook_hash': file_info[row['senario']][1],
+                    'summary': row,
+                    'metadata': all_metadata[row['senario']],
+                    'process_input': all_process_inputs[row['senario']],
+                    'cost_details_by_process': full_results[row['senario']],
+                }
+                for row in key_results.to_dict('records')
+            ])
+    except sqlite3.Error:
+        logging.exception("failed to save results")
+        st.warning("計算結果の保存に失敗しました。")
 
     # summary 用にコピーして列名を日本語化
     formatted_key_results = key_results.copy()
@@ -1394,8 +1206,17 @@ def run_simulation(file_objs, product_choice):
     st.markdown('### サマリー')
     st.dataframe(formatted_key_results, hide_index=True)
 
+    # 計算結果のダウンロード
+    show_download_button(
+        "計算結果をダウンロード",
+        key_results, full_results, all_process_inputs, all_metadata, product_choice, export_format
+    )
+
     st.markdown("---")
 
+    # シナリオ間のパレートフロンティア (単価 × 生産数量)
+    scenario_frontier = pareto.pareto_frame(key_results, use_capex=False)
+
     # ------------------------
     # 散布図で「基板 or エピ」の実績点を切り替える
     # ------------------------
@@ -1404,36 +1225,45 @@ def run_simulation(file_objs, product_choice):
         plot_scenario_scatter(
             key_results,
             substrate_point=(573, 197886, "2024年100mm基板実績", "blue"),
-            epi_point=None
+            epi_point=None,
+            frontier=scenario_frontier
         )
     else:
         # エピ実績を表示したい場合
         plot_scenario_scatter(
             key_results,
             substrate_point=None,
-            epi_point=(223, 359308, "2024年100mmエピ実績", "green")
+            epi_point=(223, 359308, "2024年100mmエピ実績", "green"),
+            frontier=scenario_frontier
         )
 
+    # パラメータを振ったスイープのパレートフロンティア
+    if pareto_sweep:
+        show_pareto_sweep(all_process_inputs, all_metadata, key_results, product_choice, **pareto_sweep)
+
     st.markdown("---")
 
+    # グラフのキャッシュのキー: シナリオ名とワークブックの内容の組 (シナリオ名は凡例に使われる)
+    figure_key = tuple((scenario_name, workbook) for scenario_name, (_, workbook) in file_info.items())
+
     # 工程別コスト可視化
     with st.expander("各工程の中間製品コストと変動費"):
-        plot_unit_product_cost_per_process(full_results, product_choice)
+        plot_unit_product_cost_per_process(full_results, product_choice, cache_key=figure_key)
 
     # 年間総コストのプロット
     with st.expander("各工程の費目ごとの年間総コスト"):
-        plot_annual_costs_per_process(full_results, product_choice)
+        plot_annual_costs_per_process(full_results, product_choice, cache_key=figure_key)
 
     # 年間製造キャパシティ・稼働率・100mm総年間生産数量のプロット
     with st.expander("年間製造キャパシティ・稼働率・100mm総年間生産数量"):
-        plot_capacity_per_process(full_results, product_choice)
+        plot_capacity_per_process(full_results, product_choice, cache_key=figure_key)
 
     # 工程ごとの生産比率とコスト配賦比率の比較
     with st.expander("工程ごとの生産比率とコスト配賦比率"):
-        plot_product_ratio(full_results, product_choice)
+        plot_product_ratio(full_results, product_choice, cache_key=figure_key)
 
     with st.expander("ウエハ1枚の費目構成"):
-        plot_cost_composition_per_wafer(full_results, product_choice)
+        plot_cost_composition_per_wafer(full_results, product_choice, cache_key=figure_key)
 
     with st.expander("工程ごとの装置台数"):
         show_equipment_units_table(full_results, product_choice)
@@ -1446,8 +1276,1094 @@ def run_simulation(file_objs, product_choice):
     with st.expander("計算結果"):
         show_output_results(full_results)
 
+    result_cache.log_stats('run_simulation')
+
     return full_results_df, key_results
 
+###################################################################################
+# サマリー表示 (数値のまま表示形式だけを指定する)
+def show_summary_table(key_results):
+    money_format = st.column_config.NumberColumn(format="localized")
+    column_config = {
+        tm.jpn_eng_dict_summary[col]: money_format
+        for col in tm.jpn_eng_dict_summary if col not in ('senario', 'depr_ratio')
+    }
+    column_config[tm.jpn_eng_dict_summary['depr_ratio']] = st.column_config.NumberColumn(format="%.1f%%")
+    st.dataframe(
+        key_results[list(tm.jpn_eng_dict_summary)].round(1).rename(columns=tm.jpn_eng_dict_summary),
+        column_config=column_config,
+        hide_index=True
+    )
+
+###################################################################################
+# シミュレーション実行 (省メモリモード)
+def run_simulation_bounded(file_objs, product_choice, export_format='xlsx', store_details=False):
+    """
+    大量シナリオ向けの省メモリモード。
+    各ワークブックをワーカーで計算した時点でサマリー1行に縮約し、入力パラメータは保持しない。
+    工程別の明細は store_details=True のときだけ、計算しながらDBに書き出す(メモリには残さない)。
+    そのため表示はサマリー・散布図とダウンロードのみ。
+
+    file_objs: List of uploaded Excel files
+    product_choice: "基板" or "エピ"
+    export_format: 計算結果ダウンロードの形式 ('xlsx', 'csv' or 'parquet')
+    store_details: 工程別の計算結果をDBに保存するかどうか
+    """
+    logging.info("start simulation (bounded memory)")
+
+    scenario_names = []
+    summary_rows = []
+    progress = st.progress(0.0, text="計算中")
+
+    def scenario_records():
+        # ファイル内容は1件ずつ取り出し、ワーカーに投入中の分だけがメモリに載るようにする
+        file_bytes_iter = (file_obj.getvalue() for file_obj in file_objs)
+        results = iter_summarize_workbooks(file_bytes_iter, 'standard', keep_details=store_details)
+        for i, (file_obj, result) in enumerate(zip(file_objs, results)):
+            summary, cost_details_by_process, (parse_s, calc_s) = result
+            scenario_name = scenario_name_from_file(file_obj.name)
+            timing.record('read_parameters', parse_s, scenario=scenario_name, payload_bytes=file_obj.size)
+            timing.record('calculate_total_cost_by_scenario', calc_s, scenario=scenario_name)
+
+            scenario_names.append(scenario_name)
+            summary_rows.append(summary)
+            progress.progress((i + 1) / len(file_objs), text=f"計算中 {i + 1}/{len(file_objs)}")
+            yield {
+                'scenario': scenario_name,
+                'file_name': file_obj.name,
+                'workbook_hash': result_store.workbook_hash(file_obj),
+                'summary': summary,
+                'cost_details_by_process': cost_details_by_process,
+            }
+
+    records = scenario_records()
+    with timing.stage('evaluate_workbooks', scenarios=len(file_objs), bounded=True):
+        try:
+            # 計算しながら100シナリオごとにDBへコミットする
+            result_store.save_run(product_choice, records, commit_every=100)
+        except sqlite3.Error:
+            logging.exception("failed to save results")
+            st.warning("計算結果の保存に失敗しました。")
+            # 保存できなかった場合も残りのシナリオの計算は続ける
+            for _ in records:
+                pass
+    progress.empty()
+
+    with timing.stage('aggregate_results', scenarios=len(scenario_names)):
+        key_results = summary_frame(scenario_names, summary_rows)
+
+    st.markdown("---")
+    st.markdown('### サマリー')
+    show_summary_table(key_results)
+    if store_details:
+        st.caption("工程別の計算結果はDBに保存しました（「過去の計算結果」から参照できます）。")
+
+    show_download_button("サマリーをダウンロード", key_results, {}, {}, {}, product_choice, export_format)
+
+    st.markdown("---")
+    scenario_frontier = pareto.pareto_frame(key_results, use_capex=False)
+    if product_choice == "基板":
+        plot_scenario_scatter(key_results, substrate_point=(573, 197886, "2024年100mm基板実績", "blue"),
+                              frontier=scenario_frontier)
+    else:
+        plot_scenario_scatter(key_results, epi_point=(223, 359308, "2024年100mmエピ実績", "green"),
+                              frontier=scenario_frontier)
+
+    return key_results
+
+###################################################################################
+# スイープのパレートフロンティア表示
+def show_pareto_sweep(all_process_inputs, all_metadata, key_results, product_choice, param_names, n_samples, spread):
+    """
+    各シナリオの全工程の param_names を現在値 ±spread で振ったスイープを行い、
+    全シナリオを合わせた (単価, 生産数量, 総設備投資額) の非劣解を表示する。
+    スイープ点数 n_samples はシナリオ数で等分する。
+    """
+    samples_per_scenario = max(1, n_samples // max(len(all_process_inputs), 1))
+    frontiers = []
+    backgrounds = []
+    with timing.stage('pareto_sweep', scenarios=len(all_process_inputs), samples=n_samples) as info:
+        for i, (scenario_name, process_input) in enumerate(all_process_inputs.items()):
+            frontier, background = pareto.sweep_frontier(
+                process_input, all_metadata[scenario_name], param_names, samples_per_scenario,
+                spread=spread, seed=i,
+                background_size=max(1, pareto.BACKGROUND_SIZE // len(all_process_inputs))
+            )
+            frontier = frontier[['wafer_cost', 'wafer_production', 'capex']].assign(senario=scenario_name)
+            frontiers.append(frontier)
+            backgrounds.append(background)
+        frontier = pareto.pareto_frame(pd.concat(frontiers, ignore_index=True))
+        background = pd.concat(backgrounds, ignore_index=True)
+        info['frontier_points'] = len(frontier)
+
+    st.markdown('### パレートフロンティア（スイープ）')
+    st.write(f"{samples_per_scenario * len(all_process_inputs):,} 点のうち非劣解 {len(frontier):,} 点")
+    plot_pareto_frontier(frontier, background, key_results)
+    with st.expander("非劣解の一覧"):
+        st.dataframe(
+            frontier.rename(columns={
+                'senario': 'シナリオ',
+                'wafer_cost': '100mmウエハ単価[yen/pcs]',
+                'wafer_production': '100mm年間生産数量[pcs/year]',
+                'capex': '総設備投資額[yen]',
+            }),
+            hide_index=True
+        )
+
+###################################################################################
+# 計算結果のダウンロードボタン
+def show_download_button(label, key_results, full_results, all_process_inputs, all_metadata, product_choice, export_format):
+    """
+    ダウンロードボタンを表示する。
+    出力ファイルはボタンが押されたときに初めて作る (ダウンロードしない実行ではファイルを作らない)
+    """
+    if not result_export.export_available(export_format):
+        st.warning("Parquet出力には pyarrow が必要です。")
+        return
+    export_name, export_mime = result_export.export_file_name(export_format)
+
+    def build_export_file():
+        with timing.stage('export_results', export_format=export_format) as info:
+            export_file = result_export.export_results(
+                key_results, full_results, all_process_inputs, all_metadata, product_choice, export_format
+            )
+            info['payload_bytes'] = os.fstat(export_file.fileno()).st_size
+        return export_file
+
+    st.download_button(
+        label,
+        data=build_export_file,
+        file_name=export_name,
+        mime=export_mime,
+        on_click="ignore"
+    )
+
+###################################################################################
+# 目標値からのパラメータ逆算
+def show_goal_seek_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つを選び、100mmウエハ単価 or 100mm年間生産数量の目標値に
+    届くパラメータ値を、候補パラメータごとに逆算して表示する
+    """
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="goal_seek_file"
+    )
+    target = st.radio(
+        "目標とする指標", list(goal_seek.TARGETS), format_func=goal_seek.TARGETS.get,
+        horizontal=True, key="goal_seek_target"
+    )
+    target_value = st.number_input("目標値", min_value=0.0, value=0.0, step=1000.0, key="goal_seek_value")
+    param_names = st.multiselect(
+        "逆算するパラメータ", list(goal_seek.GOAL_SEEK_PARAMETERS),
+        default=['yield_rate', 'num_of_units', 'unit_cost', 'labor_hours_per_process'],
+        format_func=lambda name: tm.jpn_eng_dict.get(name, name), key="goal_seek_params"
+    )
+
+    if not st.button("逆算実行", key="goal_seek_run"):
+        return
+    if target_value <= 0 or not param_names:
+        st.warning("目標値と逆算するパラメータを指定してください。")
+        return
+
+    with timing.stage('goal_seek', target=target) as info:
+        metadata, process_input = read_parameters(uploaded_files[file_index])
+        current_cost, current_production, _ = calculate_chain_batch(process_input, metadata)
+        candidates = [(process_name, name) for process_name in process_input for name in param_names]
+        result = goal_seek.goal_seek(process_input, metadata, target, target_value, candidates)
+        info['processes'] = len(process_input)
+        info['candidates'] = len(candidates)
+
+    current = current_cost if target == 'wafer_cost' else current_production
+    st.write(f"現在値: {float(current):,.0f} → 目標値: {target_value:,.0f} ({goal_seek.TARGETS[target]})")
+
+    if product_choice == "基板":
+        dict_for_label = tm.jpn_eng_dict_subs_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    result['process'] = result['process'].map(lambda proc: dict_for_label.get(proc, proc))
+    result['parameter'] = result['parameter'].map(lambda name: tm.jpn_eng_dict.get(name, name))
+
+    feasible = result[result['feasible']].drop(columns=['feasible', 'note'])
+    st.write(f"#### 目標に届くパラメータ ({len(feasible)}/{len(result)} 件)")
+    st.dataframe(
+        feasible.rename(columns={
+            'process': '工程', 'parameter': 'パラメータ', 'current_value': '現在値',
+            'solution': '逆算値', 'achieved': '逆算値での指標', 'change_ratio': '現在値に対する倍率',
+        }).style.format(precision=2),
+        hide_index=True
+    )
+    with st.expander("目標に届かないパラメータ"):
+        st.dataframe(
+            result[~result['feasible']][['process', 'parameter', 'current_value', 'note']].rename(columns={
+                'process': '工程', 'parameter': 'パラメータ', 'current_value': '現在値', 'note': '理由',
+            }),
+            hide_index=True
+        )
+
+###################################################################################
+# 差分シナリオファイル
+def show_override_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つをベースに選び、差分ファイル (YAML / JSON / CSV) ごとの
+    シナリオを一括計算してサマリーを表示する
+    """
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "ベースのワークブック", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="override_base"
+    )
+    override_files = st.file_uploader(
+        "差分ファイル (工程名.パラメータ名 = 値 を YAML / JSON / CSV で記述、複数可)",
+        type=scenario_overrides.OVERRIDE_FILE_TYPES, accept_multiple_files=True, key="override_files"
+    )
+    if not override_files or not st.button("差分シナリオを計算", key="override_run"):
+        return
+
+    with timing.stage('override_scenarios', files=len(override_files)) as info:
+        metadata, process_input = read_parameters(uploaded_files[file_index])
+        named_overrides = [(scenario_name_from_file(file_names[file_index]), {})]
+        for file_obj in override_files:
+            try:
+                overrides = scenario_overrides.read_override_file(file_obj.name, file_obj.getvalue(), metadata, process_input)
+            except scenario_overrides.OverrideFileError as e:
+                st.error(f"{file_obj.name}: {e}")
+                continue
+            named_overrides.append((os.path.splitext(file_obj.name)[0], overrides))
+        key_results, _ = scenario_overrides.evaluate_override_scenarios(metadata, process_input, named_overrides)
+        info['scenarios'] = len(named_overrides)
+        info['overrides'] = sum(len(overrides) for _, overrides in named_overrides)
+
+    st.caption(f"1行目はベースのワークブック、2行目以降は差分ファイルを適用したシナリオ ({len(named_overrides) - 1} 件)")
+    show_summary_table(key_results)
+
+###################################################################################
+# 需要からの装置台数計画
+def show_capacity_plan_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つを選び、100mmウエハ年間需要の範囲を指定して、
+    需要水準ごとに必要最小限の装置台数とそのときの単価・総設備投資額を表示する
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="capacity_plan_file"
+    )
+    col1, col2, col3 = st.columns(3)
+    demand_min = col1.number_input("需要の下限[pcs/year]", min_value=1.0, value=1000.0, step=1000.0, key="capacity_plan_min")
+    demand_max = col2.number_input("需要の上限[pcs/year]", min_value=1.0, value=50000.0, step=1000.0, key="capacity_plan_max")
+    levels = int(col3.number_input("需要水準の数", min_value=2, max_value=2000, value=200, step=10, key="capacity_plan_levels"))
+
+    if not st.button("台数計画を計算", key="capacity_plan_run"):
+        return
+    if demand_max <= demand_min:
+        st.warning("需要の上限は下限より大きくしてください。")
+        return
+
+    with timing.stage('capacity_plan', levels=levels) as info:
+        metadata, process_input = read_parameters(uploaded_files[file_index])
+        summary, units = capacity_planner.plan_capacity(
+            process_input, metadata, np.linspace(demand_min, demand_max, levels)
+        )
+        info['processes'] = len(process_input)
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Scatter(x=summary['demand'], y=summary['wafer_cost'], mode='lines', name='100mmウエハ単価[yen/pcs]'))
+    fig.add_trace(
+        go.Scatter(x=summary['demand'], y=summary['capex'] / 1e8, mode='lines', line=dict(dash='dash'), name='総設備投資額[億円]'),
+        secondary_y=True
+    )
+    fig.update_layout(title='需要水準ごとの単価と総設備投資額 (必要最小限の装置台数)', width=900, height=500)
+    fig.update_xaxes(title_text='100mmウエハ年間需要[pcs/year]', tickformat=",.0f")
+    fig.update_yaxes(title_text='100mmウエハ単価[yen/pcs]', tickformat=",.0f", secondary_y=False)
+    fig.update_yaxes(title_text='総設備投資額[億円]', secondary_y=True)
+    st.plotly_chart(fig)
+
+    if product_choice == "基板":
+        dict_for_label = tm.jpn_eng_dict_subs_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    with st.expander("需要水準ごとの必要装置台数"):
+        units = units.rename(columns=lambda proc: dict_for_label.get(proc, proc))
+        units.index = units.index.map(lambda demand: f"{demand:,.0f}")
+        st.dataframe(units)
+
+###################################################################################
+# 不確かさを考慮した装置台数の最適化
+def show_robust_capacity_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つを選び、best / standard / worst の範囲で振った共通の引きの上で
+    100mmウエハ単価の期待値 または P90 が最小になる工程ごとの装置台数を探索し、ワークブックの台数と比べる
+    """
+    import plotly.graph_objects as go
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="robust_file"
+    )
+    col1, col2, col3, col4 = st.columns(4)
+    objective = col1.radio(
+        "最小化する指標", list(robust_capacity.OBJECTIVES), format_func=robust_capacity.OBJECTIVES.get,
+        horizontal=True, key="robust_objective"
+    )
+    n_draws = int(col2.number_input("引きの数", min_value=16, max_value=4096, value=256, step=64, key="robust_draws"))
+    beam_width = int(col3.number_input("ビーム幅", min_value=1, max_value=20, value=3, key="robust_beam"))
+    max_iterations = int(col4.number_input("最大反復回数", min_value=1, max_value=500, value=100, key="robust_iterations"))
+
+    if not st.button("装置台数を最適化", key="robust_run"):
+        return
+
+    with timing.stage('robust_capacity', objective=objective, draws=n_draws) as info:
+        metadata, process_input = result_cache.read_parameters_cached(uploaded_files[file_index].getvalue())
+        result = robust_capacity.optimize_units(
+            process_input, metadata, objective, n_draws=n_draws, beam_width=beam_width, max_iterations=max_iterations
+        )
+        info.update(plans=result['plans_evaluated'], evaluations=result['evaluations'])
+        comparison = robust_capacity.compare_plans(
+            process_input, metadata, {'ワークブックの台数': result['initial_plan'], '最適化後の台数': result['plan']}
+        )
+
+    name = robust_capacity.OBJECTIVES[objective]
+    st.write(
+        f"{name}: {result['initial_objective']:,.0f} → {result['objective']:,.0f} [yen/pcs] "
+        f"(計画 {result['plans_evaluated']:,} 件 × 引き {result['draws']:,} 個 = {result['evaluations']:,} 回のチェーン評価、"
+        f"振ったパラメータ {result['parameters']:,} 個)"
+    )
+
+    if product_choice == "基板":
+        dict_for_label = tm.jpn_eng_dict_subs_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    changes = pd.DataFrame({
+        '工程': [dict_for_label.get(process_name, process_name) for process_name in result['plan']],
+        'ワークブックの台数': list(result['initial_plan'].values()),
+        '最適化後の台数': list(result['plan'].values()),
+    })
+    changes = changes[changes['ワークブックの台数'] != changes['最適化後の台数']]
+    st.write(f"#### 台数を変えた工程 ({len(changes)} 工程)")
+    st.dataframe(changes, hide_index=True)
+
+    st.write("#### 各列 (best / standard / worst) での100mmウエハ単価")
+    st.dataframe(comparison.style.format("{:,.0f}"))
+
+    fig = go.Figure()
+    for costs, label in [(result['initial_costs'], 'ワークブックの台数'), (result['costs'], '最適化後の台数')]:
+        fig.add_trace(go.Histogram(x=costs[np.isfinite(costs)], name=label, opacity=0.6, nbinsx=60))
+    fig.update_layout(
+        title='共通の引きでの100mmウエハ単価の分布', barmode='overlay',
+        xaxis_title='100mmウエハ単価[yen/pcs]', yaxis_title='引きの数', width=900, height=450
+    )
+    fig.update_xaxes(tickformat=",.0f")
+    st.plotly_chart(fig)
+
+    with st.expander("探索の経過"):
+        st.dataframe(
+            result['history'].rename(columns={
+                'iteration': '反復', 'candidates': '評価した候補', 'pruned': '枝刈りした候補', 'best_objective': name,
+            }).style.format({name: "{:,.0f}"}),
+            hide_index=True
+        )
+
+###################################################################################
+# 離散事象シミュレーション
+def show_throughput_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つを選び、1年分のロットを工程チェーンに流す離散事象シミュレーションで
+    待ち行列・バッチ待ち・装置の停止を含めた生産数量・仕掛品・稼働率を求め、それを反映した単価を表示する
+    """
+    import plotly.graph_objects as go
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="throughput_file"
+    )
+    col1, col2, col3, col4 = st.columns(4)
+    run_time_cv = col1.number_input(
+        "処理時間の変動係数", min_value=0.0, max_value=2.0, value=0.25, step=0.05, key="throughput_cv"
+    )
+    availability = col2.number_input(
+        "装置の稼働率の上限[%]", min_value=50.0, max_value=100.0, value=100.0, step=1.0, key="throughput_availability"
+    ) / 100
+    mttr_hours = col3.number_input("平均修理時間[h]", min_value=1.0, max_value=1000.0, value=24.0, key="throughput_mttr")
+    warmup = col4.number_input(
+        "助走期間[year]", min_value=0.0, max_value=2.0, value=0.25, step=0.05, key="throughput_warmup"
+    )
+
+    if not st.button("シミュレーションを実行", key="throughput_run"):
+        return
+
+    with timing.stage('throughput_sim') as info:
+        metadata, process_input = result_cache.read_parameters_cached(uploaded_files[file_index].getvalue())
+        simulation = throughput_sim.simulate_year(
+            process_input, run_time_cv=run_time_cv, availability=availability, mttr_hours=mttr_hours, warmup=warmup
+        )
+        cost = throughput_sim.simulated_cost(process_input, metadata, simulation)
+        info['events'] = simulation['events']
+
+    col1, col2 = st.columns(2)
+    col1.metric(
+        "100mmウエハ単価[yen/pcs] (シミュレーション反映)", f"{cost['wafer_cost']:,.0f}",
+        f"{cost['wafer_cost'] - cost['analytic_wafer_cost']:+,.0f} (年間キャパシティでの計算との差)", delta_color="inverse"
+    )
+    col2.metric(
+        "100mm年間生産数量[pcs] (シミュレーション反映)", f"{cost['wafer_production']:,.0f}",
+        f"{cost['wafer_production'] - cost['analytic_wafer_production']:+,.0f} (年間キャパシティでの計算との差)"
+    )
+    st.caption(
+        f"事象 {simulation['events']:,} 件。最終工程の良品数からの100mm年間生産数量: {simulation['wafer_production']:,.0f} [pcs]。"
+        f"年間処理回数が {throughput_sim.MAX_DISCRETE_RUNS:,} 回を超える見込みの "
+        f"{int(simulation['processes']['fluid'].sum())} 工程は流体近似で計算しました。"
+    )
+
+    if product_choice == "基板":
+        dict_for_label = tm.jpn_eng_dict_subs_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    frame = simulation['processes']
+    labels = [dict_for_label.get(process_name, process_name) for process_name in frame.index]
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=labels, y=frame['utilization'] * 100, name='処理中', marker_color='steelblue'))
+    fig.add_trace(go.Bar(x=labels, y=frame['down'] * 100, name='修理中', marker_color='indianred'))
+    fig.update_layout(
+        title='工程ごとの装置の稼働状況', barmode='stack', yaxis_title='装置の時間の割合[%]', width=1000, height=450
+    )
+    st.plotly_chart(fig)
+
+    st.dataframe(
+        frame.rename(index=lambda proc: dict_for_label.get(proc, proc)).rename(columns={
+            'runs': '年間処理回数', 'input': '年間投入数', 'output': '年間良品数', 'utilization': '処理中の割合',
+            'down': '修理中の割合', 'wip': '平均仕掛品数', 'queue': '平均待ち数', 'cycle_time_days': '平均滞在日数',
+            'fluid': '流体近似',
+        }).style.format({
+            '年間処理回数': "{:,.0f}", '年間投入数': "{:,.0f}", '年間良品数': "{:,.0f}", '処理中の割合': "{:.1%}",
+            '修理中の割合': "{:.1%}", '平均仕掛品数': "{:,.1f}", '平均待ち数': "{:,.1f}", '平均滞在日数': "{:,.2f}",
+        })
+    )
+
+###################################################################################
+# 不確かさ評価 (準モンテカルロ)
+def show_uncertainty_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つを選び、各工程のパラメータを (best, standard, worst) の
+    三角分布で振って100mmウエハ単価の分布を求める。点数を倍々に増やし、分位点が安定したら打ち切る。
+    """
+    import plotly.graph_objects as go
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="uncertainty_file"
+    )
+    param_names = st.multiselect(
+        "振るパラメータ (全工程)", pareto.SWEEP_PARAMETERS,
+        default=['num_of_units', 'unit_cost', 'yield_rate'], key="uncertainty_params"
+    )
+    col1, col2, col3 = st.columns(3)
+    method = col1.selectbox(
+        "点列", list(uncertainty.SAMPLING_METHODS), format_func=uncertainty.SAMPLING_METHODS.get,
+        key="uncertainty_method"
+    )
+    max_samples = int(col2.number_input(
+        "最大点数", min_value=1024, max_value=1 << 24, value=1 << 20, step=1 << 16, key="uncertainty_max"
+    ))
+    rtol = col3.number_input(
+        "打ち切りの相対変化[%]", min_value=0.001, max_value=5.0, value=0.1, step=0.01, format="%.3f",
+        key="uncertainty_rtol"
+    ) / 100
+    parallel = st.checkbox(
+        f"全コアで並列計算する (擬似乱数で最大点数を一括計算、ワーカー {parallel_mc.MC_MAX_WORKERS})",
+        key="uncertainty_parallel"
+    )
+    if method == 'sobol' and not uncertainty.sobol_available() and not parallel:
+        st.caption("scipy がないため Sobol の代わりに Halton 列を使います。")
+
+    if not st.button("分布を計算", key="uncertainty_run"):
+        return
+
+    if parallel:
+        with timing.stage('uncertainty_parallel', samples=max_samples) as info:
+            metadata, process_input = read_parameters(uploaded_files[file_index])
+            result = parallel_mc.run_parallel(process_input, metadata, param_names, max_samples)
+            info.update(workers=result['workers'], chunks=result['chunks'])
+        wafer_cost = result['wafer_cost'][np.isfinite(result['wafer_cost'])]
+        st.success(
+            f"{max_samples:,} 点を {result['workers']} ワーカー・{result['chunks']} チャンクで計算しました "
+            f"({result['elapsed']:.2f} s)。結果は乱数の種とチャンクの大きさだけで決まり、ワーカー数によりません。"
+        )
+        quantiles = np.quantile(wafer_cost, [0.05, 0.5, 0.95]) if len(wafer_cost) else np.full(3, np.nan)
+        st.dataframe(
+            pd.DataFrame([{'点数': len(wafer_cost), '平均': wafer_cost.mean() if len(wafer_cost) else np.nan,
+                           'P5': quantiles[0], 'P50': quantiles[1], 'P95': quantiles[2]}])
+            .style.format({'点数': "{:,}", '平均': "{:,.0f}", 'P5': "{:,.0f}", 'P50': "{:,.0f}", 'P95': "{:,.0f}"}),
+            hide_index=True
+        )
+        show_wafer_cost_histogram(wafer_cost, scenario_name_from_file(file_names[file_index]))
+        return
+
+    with timing.stage('uncertainty', method=method) as info:
+        metadata, process_input = read_parameters(uploaded_files[file_index])
+        result = uncertainty.run_until_stable(
+            process_input, metadata, param_names, method=method, max_samples=max_samples, rtol=rtol
+        )
+        info['samples'] = result['samples']
+        info['converged'] = result['converged']
+
+    history = result['history']
+    if result['converged']:
+        st.success(f"{result['samples']:,} 点で分位点が安定しました ({uncertainty.SAMPLING_METHODS[result['method']]})。")
+    else:
+        st.warning(f"最大点数 {result['samples']:,} 点までに分位点が安定しませんでした。")
+
+    fig = go.Figure()
+    for column, name in [('p5', 'P5'), ('p50', 'P50'), ('p95', 'P95')]:
+        fig.add_trace(go.Scatter(x=history['samples'], y=history[column], mode='lines+markers', name=name))
+    fig.update_layout(
+        title='点数ごとの100mmウエハ単価の分位点', xaxis_title='点数', yaxis_title='100mmウエハ単価[yen/pcs]',
+        width=900, height=450
+    )
+    fig.update_xaxes(type='log')
+    fig.update_yaxes(tickformat=",.0f")
+    st.plotly_chart(fig)
+
+    st.dataframe(
+        history.rename(columns={
+            'samples': '点数', 'mean': '平均', 'p5': 'P5', 'p50': 'P50', 'p95': 'P95', 'max_rel_change': '最大相対変化',
+        }).style.format({'点数': "{:,}", '平均': "{:,.0f}", 'P5': "{:,.0f}", 'P50': "{:,.0f}", 'P95': "{:,.0f}",
+                         '最大相対変化': "{:.5f}"}),
+        hide_index=True
+    )
+
+    show_wafer_cost_histogram(
+        result['wafer_cost'][np.isfinite(result['wafer_cost'])], scenario_name_from_file(file_names[file_index])
+    )
+
+def show_wafer_cost_histogram(wafer_cost, scenario_name):
+    """
+    100mmウエハ単価の分布のヒストグラム。
+    点数が多いので、ブラウザには全点ではなく集計済みのビンを送る
+    """
+    import plotly.graph_objects as go
+    counts, edges = np.histogram(wafer_cost, bins=100)
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, marker_color='steelblue'))
+    fig.update_layout(
+        title=f'100mmウエハ単価の分布 | {scenario_name}',
+        xaxis_title='100mmウエハ単価[yen/pcs]', yaxis_title='点数', bargap=0, width=900, height=450
+    )
+    fig.update_xaxes(tickformat=",.0f")
+    st.plotly_chart(fig)
+
+###################################################################################
+# 大域的感度分析 (Sobol 指標)
+def show_sensitivity_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つを選び、best / standard / worst で値が異なる全パラメータについて
+    100mmウエハ単価に対する一次の Sobol 指標 S1 と全効果指標 ST を表示する
+    """
+    import plotly.graph_objects as go
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="sensitivity_file"
+    )
+    param_names = st.multiselect(
+        "対象パラメータ (未選択なら全パラメータ)", pareto.SWEEP_PARAMETERS, key="sensitivity_params"
+    )
+    col1, col2, col3 = st.columns(3)
+    n_base = int(col1.number_input(
+        "基本点数 N", min_value=128, max_value=1 << 16, value=1024, step=128, key="sensitivity_n"
+    ))
+    n_bootstrap = int(col2.number_input(
+        "ブートストラップ回数", min_value=10, max_value=2000, value=200, step=10, key="sensitivity_bootstrap"
+    ))
+    top = int(col3.number_input("表示するパラメータ数", min_value=5, max_value=200, value=20, key="sensitivity_top"))
+
+    if not st.button("感度を計算", key="sensitivity_run"):
+        return
+
+    with timing.stage('sensitivity', n_base=n_base) as info:
+        metadata, process_input = read_parameters(uploaded_files[file_index])
+        indices, result_info = sensitivity.sobol_indices(
+            process_input, metadata, param_names or None, n_base=n_base, n_bootstrap=n_bootstrap
+        )
+        info.update(evaluations=result_info['evaluations'], parameters=len(indices))
+    if indices.empty:
+        st.info("best / standard / worst で値が異なるパラメータがありません。")
+        return
+    st.write(f"パラメータ {len(indices):,} 個、チェーン評価 {result_info['evaluations']:,} 回 (95%信頼区間はブートストラップ)")
+
+    if product_choice == "基板":
+        dict_for_label = tm.jpn_eng_dict_subs_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    shown = indices.head(top).iloc[::-1]
+    labels = [f"{dict_for_label.get(process_name, process_name)} / {param_name}"
+              for process_name, param_name in zip(shown['process'], shown['parameter'])]
+    fig = go.Figure()
+    for column, name, color in [('S1', '一次の指標 S1', 'steelblue'), ('ST', '全効果指標 ST', 'indianred')]:
+        fig.add_trace(go.Bar(
+            y=labels, x=shown[column], orientation='h', name=name, marker_color=color,
+            error_x=dict(type='data', symmetric=False,
+                         array=shown[f'{column}_high'] - shown[column], arrayminus=shown[column] - shown[f'{column}_low'])
+        ))
+    fig.update_layout(
+        title='100mmウエハ単価に対する Sobol 指標 (全効果の大きい順)', barmode='group',
+        xaxis_title='分散への寄与率', width=1000, height=max(400, 28 * len(shown))
+    )
+    st.plotly_chart(fig)
+
+    with st.expander("全パラメータの指標"):
+        st.dataframe(
+            indices.assign(process=indices['process'].map(lambda proc: dict_for_label.get(proc, proc)))
+            .rename(columns={'process': '工程', 'parameter': 'パラメータ'})
+            .style.format(precision=4),
+            hide_index=True
+        )
+
+###################################################################################
+# 2パラメータのマップ
+def show_parameter_map_view(uploaded_files, product_choice):
+    """
+    アップロード済みのワークブックから1つを選び、任意の2つのパラメータを格子状に振って
+    100mmウエハ単価と100mm年間生産数量のヒートマップ (または等高線) を表示する
+    """
+    import plotly.graph_objects as go
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="map_file"
+    )
+    # 読み込み済みのワークブックはキャッシュから使う (軸の選択を変えるたびに読み直さない)
+    metadata, process_input = result_cache.read_parameters_cached(uploaded_files[file_index].getvalue())
+    process_names = list(process_input)
+    if not process_names:
+        st.info("工程のシートがありません。")
+        return
+
+    if product_choice == "基板":
+        dict_for_label = dict(tm.jpn_eng_dict_subs_process)
+    else:
+        dict_for_label = dict(tm.jpn_eng_dict_epi_process)
+    dict_for_label[parameter_map.METADATA] = 'メタデータ (全工程共通)'
+    axes = []
+    for column, axis, default_process, default_param in zip(
+        st.columns(2), ('x', 'y'), (0, len(process_names) - 1), ('yield_rate', 'num_of_units')
+    ):
+        with column:
+            process_name = st.selectbox(
+                f"{'横軸' if axis == 'x' else '縦軸'}の工程", process_names + [parameter_map.METADATA],
+                index=default_process,
+                format_func=lambda proc: dict_for_label.get(proc, proc), key=f"map_{axis}_process"
+            )
+            param_names = parameter_map.parameter_names(process_input, metadata, process_name)
+            if not param_names:
+                st.info("数値のパラメータがありません。")
+                return
+            param_name = st.selectbox(
+                "パラメータ", param_names,
+                index=param_names.index(default_param) if default_param in param_names else 0,
+                format_func=lambda name: tm.jpn_eng_dict.get(name, name), key=f"map_{axis}_param"
+            )
+            # 範囲の初期値は選んだパラメータの best / worst から決める (パラメータごとに別のキー)
+            lower, upper = parameter_map.default_range(process_input, (process_name, param_name), metadata)
+            col1, col2 = st.columns(2)
+            lower = col1.number_input("下限", value=lower, key=f"map_{axis}_lower_{process_name}_{param_name}")
+            upper = col2.number_input("上限", value=upper, key=f"map_{axis}_upper_{process_name}_{param_name}")
+            axes.append(((process_name, param_name), lower, upper))
+    col1, col2 = st.columns(2)
+    resolution = int(col1.number_input(
+        "分割数 (各軸)", min_value=10, max_value=1000, value=parameter_map.DEFAULT_RESOLUTION, step=10,
+        key="map_resolution"
+    ))
+    style = col2.radio("表示", ['ヒートマップ', '等高線'], horizontal=True, key="map_style")
+
+    (key_x, lower_x, upper_x), (key_y, lower_y, upper_y) = axes
+    if key_x == key_y:
+        st.warning("横軸と縦軸には別のパラメータを選んでください。")
+        return
+    if lower_x >= upper_x or lower_y >= upper_y:
+        st.warning("上限は下限より大きくしてください。")
+        return
+    if not st.button("マップを計算", key="map_run"):
+        return
+
+    with timing.stage('parameter_map', resolution=resolution) as info:
+        result = parameter_map.evaluate_grid(
+            process_input, metadata,
+            key_x, parameter_map.axis_values(key_x[1], lower_x, upper_x, resolution),
+            key_y, parameter_map.axis_values(key_y[1], lower_y, upper_y, resolution),
+        )
+        info['evaluations'] = result['evaluations']
+    st.caption(f"{len(result['x'])} × {len(result['y'])} = {result['evaluations']:,} 点で工程チェーン全体を計算しました。")
+
+    def axis_title(key):
+        process_name, param_name = key
+        return f"{dict_for_label.get(process_name, process_name)} / {tm.jpn_eng_dict.get(param_name, param_name)}"
+
+    trace_type = go.Heatmap if style == 'ヒートマップ' else go.Contour
+    current_x = parameter_map.current_value(process_input, metadata, key_x)
+    current_y = parameter_map.current_value(process_input, metadata, key_y)
+    for column, (values, title, colorscale) in zip(st.columns(2), [
+        (result['wafer_cost'], '100mmウエハ単価[yen/pcs]', 'Viridis'),
+        (result['wafer_production'], '100mm年間生産数量[pcs]', 'Cividis'),
+    ]):
+        # 計算できなかった格子点 (0除算など) は空白にする
+        fig = go.Figure(trace_type(
+            x=result['x'], y=result['y'], z=np.where(np.isfinite(values), values, np.nan),
+            colorscale=colorscale, colorbar=dict(title=title, tickformat=",.0f"),
+            hovertemplate='x=%{x:,.4g}<br>y=%{y:,.4g}<br>%{z:,.0f}<extra></extra>'
+        ))
+        # 現在値 (standard) の位置
+        fig.add_trace(go.Scatter(
+            x=[current_x], y=[current_y], mode='markers', name='standard',
+            marker=dict(symbol='x', size=12, color='red'), showlegend=False
+        ))
+        fig.update_layout(
+            title=title, xaxis_title=axis_title(key_x), yaxis_title=axis_title(key_y), width=600, height=550
+        )
+        column.plotly_chart(fig)
+
+###################################################################################
+# バックグラウンドジョブ
+def show_job_queue_view(uploaded_files, product_choice):
+    """
+    モンテカルロ・大規模スイープをバックグラウンドジョブとして投入し、進捗の確認・キャンセル・結果表示を行う。
+    ジョブはブラウザを閉じても続き、後からジョブIDで結果を取り出せる。
+    """
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    file_index = st.selectbox(
+        "対象シナリオ", range(len(file_names)),
+        format_func=lambda i: scenario_name_from_file(file_names[i]), key="job_file"
+    )
+    kind = st.radio(
+        "計算の種類", list(job_queue.JOB_KINDS), format_func=job_queue.JOB_KINDS.get, key="job_kind", horizontal=True
+    )
+    param_names = st.multiselect(
+        "振るパラメータ (全工程)", pareto.SWEEP_PARAMETERS,
+        default=['num_of_units', 'unit_cost', 'yield_rate'], key="job_params"
+    )
+    col1, col2 = st.columns(2)
+    n_samples = int(col1.number_input("計算点数", min_value=1000, max_value=50_000_000, value=1_000_000, step=100_000, key="job_samples"))
+    spread = col2.slider("変動幅[%]", 1, 90, 20, key="job_spread", disabled=(kind != 'sweep')) / 100
+    sampling = st.selectbox(
+        "点列", list(uncertainty.SAMPLING_METHODS), index=2, format_func=uncertainty.SAMPLING_METHODS.get,
+        key="job_sampling", disabled=(kind != 'monte_carlo')
+    )
+    keep_samples = st.checkbox(
+        "全点のパラメータ値と結果を保存する (保存しない場合は統計量と分布だけを保存)",
+        value=(kind == 'sweep'), key="job_keep_samples"
+    )
+
+    if st.button("ジョブを投入", key="job_submit"):
+        metadata, process_input = read_parameters(uploaded_files[file_index])
+        job_id = job_queue.submit_job(
+            kind, process_input, metadata, param_names, n_samples, spread=spread, keep_samples=keep_samples,
+            sampling=sampling,
+            label=scenario_name_from_file(file_names[file_index]), product=product_choice
+        )
+        logging.info(f"submitted job {job_id} ({kind}, {n_samples} samples)")
+        st.success(f"ジョブ {job_id} を投入しました。")
+
+    jobs = job_queue.list_jobs()
+    active = any(job['status'] not in job_queue.FINISHED_STATUSES for job in jobs)
+
+    # 実行中のジョブがあるときだけ、一覧を定期的に再描画する
+    @st.fragment(run_every="2s" if active else None)
+    def show_job_table():
+        jobs = job_queue.list_jobs()
+        if not jobs:
+            st.info("投入されたジョブはありません。")
+            return
+        st.dataframe(
+            pd.DataFrame(jobs)[['job_id', 'label', 'kind', 'status', 'progress', 'samples_done', 'samples_total',
+                                'created_at', 'finished_at', 'error']],
+            column_config={
+                'job_id': 'ジョブID', 'label': 'シナリオ', 'kind': '種類', 'status': '状態',
+                'progress': st.column_config.ProgressColumn('進捗', min_value=0.0, max_value=1.0),
+                'samples_done': st.column_config.NumberColumn('完了点数', format="localized"),
+                'samples_total': st.column_config.NumberColumn('計算点数', format="localized"),
+                'created_at': '投入日時', 'finished_at': '終了日時', 'error': 'エラー',
+            },
+            hide_index=True
+        )
+
+    show_job_table()
+    if not jobs:
+        return
+
+    col1, col2, col3 = st.columns(3)
+    job_id = col1.selectbox("ジョブID", [job['job_id'] for job in jobs], key="job_selected")
+    if col2.button("キャンセル", key="job_cancel"):
+        if job_queue.cancel_job(job_id):
+            st.info(f"ジョブ {job_id} のキャンセルを要求しました。")
+        else:
+            st.warning(f"ジョブ {job_id} は既に終了しています。")
+    if col3.button("結果を表示", key="job_show"):
+        show_job_result(job_id)
+
+@timing.timed
+def show_job_result(job_id):
+    """
+    ジョブの集計 (実行中ならその時点までの集計) の統計量と、100mmウエハ単価の分布を表示する
+    """
+    import plotly.graph_objects as go
+    job = job_queue.get_job(job_id)
+    stats = job_queue.load_stats(job_id)
+    if stats is None:
+        st.info("まだ結果がありません。")
+        return
+    st.write(f"ジョブ {job_id} ({job['status']}): {stats.count:,} / {job['samples_total']:,} 点")
+
+    if job['product'] == "エピ":
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_subs_process
+    summary = stats.summary()
+    summary.index = ['100mmウエハ単価[yen/pcs]', '100mm年間生産数量[pcs/year]'] + [
+        f"{dict_for_label.get(process_name, process_name)} 単価[yen/pcs]" for process_name in summary.index[2:]
+    ]
+    st.dataframe(summary.style.format("{:,.1f}"))
+
+    histogram = stats.metrics['wafer_cost'].histogram
+    if histogram is not None:
+        centers = (histogram.edges[:-1] + histogram.edges[1:]) / 2
+        fig = go.Figure(go.Bar(x=centers, y=histogram.counts, marker_color='steelblue'))
+        fig.update_layout(
+            title=f'100mmウエハ単価の分布 | ジョブ {job_id} ({job["label"]})',
+            xaxis_title='100mmウエハ単価[yen/pcs]', yaxis_title='点数', bargap=0, width=900, height=450
+        )
+        fig.update_xaxes(tickformat=",.0f")
+        st.plotly_chart(fig)
+        if histogram.underflow or histogram.overflow:
+            st.caption(f"表示範囲外: 下側 {histogram.underflow:,} 点, 上側 {histogram.overflow:,} 点")
+
+###################################################################################
+# サロゲートモデルによる即時プレビュー
+def show_surrogate_view(uploaded_files, product_choice):
+    """
+    全点の結果を保存したバックグラウンドジョブのスイープ結果にサロゲートモデルを当てはめ、
+    複数のパラメータを動かしたときの100mmウエハ単価・100mm年間生産数量を近似式で即座に予測する。
+    スライダーを離すたびに、予測と一緒に工程チェーンの厳密計算の結果も表示して誤差を確認できる。
+    """
+    jobs = [job for job in job_queue.list_jobs() if job['samples_done']]
+    if not jobs:
+        st.info("スイープ結果を保存したジョブがありません (バックグラウンド計算で「全点のパラメータ値と結果を保存する」を選んで投入してください)。")
+        return
+    col1, col2 = st.columns(2)
+    job = col1.selectbox(
+        "スイープ結果 (ジョブ)", jobs, key="surrogate_job",
+        format_func=lambda job: f"ジョブ {job['job_id']} ({job['label']}, {job['samples_done']:,} 点, {job['status']})"
+    )
+    degree = col2.selectbox("多項式の次数", surrogate.DEGREES, index=1, key="surrogate_degree")
+
+    # 当てはめたモデルはセッション間で共有する (同じジョブ・点数・次数なら当てはめ直さない)
+    cache = result_cache.get_cache()
+    cache_key = result_cache.make_key('surrogate', job['job_id'], job['samples_done'], degree)
+    model = cache.get(cache_key)
+    if model is None:
+        if not st.button("モデルを当てはめる", key="surrogate_fit"):
+            return
+        with timing.stage('surrogate_fit', job_id=job['job_id'], degree=degree) as info:
+            try:
+                model = surrogate.fit_from_job(job['job_id'], degree)
+            except ValueError as e:
+                st.warning(str(e))
+                return
+            info.update(samples=model.metrics['train_samples'], terms=model.metrics['terms'])
+        cache.put(cache_key, model)
+
+    metrics = model.metrics
+    st.caption(
+        f"当てはめ {metrics['train_samples']:,} 点 / 検証 {metrics['validation_samples']:,} 点 / 項数 {metrics['terms']:,}。"
+        f" 検証点での相対誤差 (RMSE / 95%点): 単価 {metrics['rmse']['wafer_cost']:.2%} / {metrics['p95']['wafer_cost']:.2%},"
+        f" 生産数量 {metrics['rmse']['wafer_production']:.2%} / {metrics['p95']['wafer_production']:.2%}"
+    )
+
+    # 厳密計算に使うワークブック (ジョブと同じシナリオ名のものを既定にする)
+    file_names = [file_obj.name for file_obj in uploaded_files]
+    scenario_names = [scenario_name_from_file(name) for name in file_names]
+    file_index = st.selectbox(
+        "厳密計算に使うワークブック", range(len(file_names)),
+        index=scenario_names.index(job['label']) if job['label'] in scenario_names else 0,
+        format_func=lambda i: scenario_names[i], key="surrogate_file"
+    )
+    metadata, process_input = result_cache.read_parameters_cached(uploaded_files[file_index].getvalue())
+    missing = [key for key in model.keys if key[0] not in process_input or key[1] not in process_input[key[0]]['standard']]
+    if missing:
+        st.warning(f"選んだワークブックにジョブのパラメータがありません: {missing[:5]}")
+        return
+
+    if job['product'] == "エピ":
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_subs_process
+
+    def key_label(key):
+        return f"{dict_for_label.get(key[0], key[0])} / {tm.jpn_eng_dict.get(key[1], key[1])}"
+
+    selected = st.multiselect(
+        "動かすパラメータ (他は standard の値)", range(len(model.keys)), default=list(range(min(6, len(model.keys)))),
+        format_func=lambda j: key_label(model.keys[j]), key=f"surrogate_keys_{job['job_id']}"
+    )
+    values = np.array([float(process_input[process_name]['standard'][param_name])
+                       for process_name, param_name in model.keys])
+    columns = st.columns(3)
+    for n, j in enumerate(selected):
+        process_name, param_name = model.keys[j]
+        lower, upper = float(model.lower[j]), float(model.upper[j])
+        if lower >= upper:
+            continue
+        integer = param_name in INTEGER_PARAMETERS
+        values[j] = columns[n % 3].slider(
+            key_label(model.keys[j]), lower, upper, float(np.clip(values[j], lower, upper)),
+            step=1.0 if integer else None, key=f"surrogate_{job['job_id']}_{process_name}_{param_name}"
+        )
+
+    with timing.stage('surrogate_predict'):
+        prediction, error, outside = model.predict(values)
+    col1, col2 = st.columns(2)
+    col1.metric("100mmウエハ単価[yen/pcs] (予測)", f"{prediction[0, 0]:,.0f}", f"±{error[0, 0]:.1%}", delta_color="off")
+    col2.metric("100mm年間生産数量[pcs] (予測)", f"{prediction[0, 1]:,.0f}", f"±{error[0, 1]:.1%}", delta_color="off")
+    if outside[0]:
+        st.warning("スイープの範囲外の値を含むため、予測は外挿です (誤差の目安を大きくしています)。")
+
+    if st.checkbox("スライダーを離したら厳密計算で確認する", value=True, key="surrogate_confirm"):
+        with timing.stage('surrogate_confirm'):
+            overrides = {key: values[j] for j, key in enumerate(model.keys)}
+            wafer_cost, wafer_production, _ = calculate_chain_batch(process_input, metadata, 'standard', overrides)
+        wafer_cost, wafer_production = float(wafer_cost), float(wafer_production)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost_error = prediction[0, 0] / wafer_cost - 1
+            production_error = prediction[0, 1] / wafer_production - 1
+        col1.metric("100mmウエハ単価[yen/pcs] (厳密)", f"{wafer_cost:,.0f}", f"予測の誤差 {cost_error:+.2%}", delta_color="off")
+        col2.metric("100mm年間生産数量[pcs] (厳密)", f"{wafer_production:,.0f}", f"予測の誤差 {production_error:+.2%}", delta_color="off")
+
+###################################################################################
+# フォルダ監視モード
+def show_watch_view(product_choice):
+    """
+    共有フォルダのワークブックを監視し、変更があったシート・工程だけを計算し直したサマリーを表示する。
+    監視の状態はセッション間で共有され、表示は数秒ごとに更新される。
+    """
+    directory = st.text_input(
+        "監視するフォルダ", value=os.environ.get(scenario_watch.WATCH_DIR_ENV, ""), key="watch_dir"
+    )
+    enabled = st.checkbox("監視する", value=False, key="watch_enabled")
+    if not enabled:
+        return
+    if not directory or not os.path.isdir(directory):
+        st.warning("フォルダが見つかりません。")
+        return
+    watcher = scenario_watch.get_watcher(directory)
+
+    @st.fragment(run_every="5s")
+    def show_watched_results():
+        if watcher.refresh():
+            logging.info(f"watched folder updated: {directory} (version {watcher.version})")
+        key_results = watcher.key_results(scenario_name_from_file)
+        if key_results is None:
+            st.info("計算できるワークブックがありません。")
+        else:
+            show_summary_table(key_results)
+        status = watcher.status()
+        st.dataframe(status, hide_index=True)
+        for row in status.dropna(subset=['error']).to_dict('records'):
+            st.warning(f"{row['file']} を読み込めませんでした (前回の結果を表示しています): {row['error']}")
+        stats = watcher.stats
+        st.caption(
+            f"走査 {stats['refreshes']} 回 / 更新ファイル {stats['files_updated']} 件 / "
+            f"読み直したシート {stats['sheets_reparsed']} 枚 / 計算し直した工程 {stats['processes_recomputed']} 件"
+        )
+
+    show_watched_results()
+
+###################################################################################
+# 過去の計算結果表示
+@timing.timed
+def show_result_history(product_choice):
+    """
+    DBに保存された過去の計算結果から、シナリオごとの100mmウエハ単価の推移を表示する
+    """
+    import plotly.graph_objects as go
+    scenario_names = result_store.list_scenarios(product_choice)
+    if not scenario_names:
+        st.info("保存された計算結果はありません。")
+        return
+
+    scenario = st.selectbox("シナリオ", scenario_names, key="history_scenario")
+    trend = result_store.query_wafer_cost_trend(scenario, product_choice)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=trend['created_at'],
+        y=trend['wafer_cost'],
+        mode='lines+markers',
+        name='100mmウエハ単価',
+        hovertemplate='%{x}<br>%{y:,.0f} yen/pcs<extra></extra>'
+    ))
+    fig.update_layout(
+        title=f'100mmウエハ単価の推移 | {scenario}',
+        xaxis_title='計算日時',
+        yaxis_title='100mmウエハ単価[yen/pcs]',
+        width=1000,
+        height=500
+    )
+    fig.update_yaxes(tickformat=",.0f", showgrid=True, gridcolor='#ccc')
+    st.plotly_chart(fig, use_container_width=False)
+
+    st.dataframe(
+        trend[['created_at', 'file_name', 'wafer_cost', 'wafer_production', 'depr_per_wafer', 'workbook_hash']],
+        hide_index=True
+    )
+
+###################################################################################
+# 開発者パネル
+# 起動時には読み込まず、使うときに import するモジュール
+LAZY_MODULES = ['plotly', 'openpyxl', 'scipy', 'yaml']
+
+def show_developer_panel(timing_records, profile_text=None):
+    """
+    timing_records: stage_timing で計測した結果のリスト
+    profile_text: cProfile の統計テキスト (計測していない場合は None)
+    """
+    st.markdown("---")
+    st.markdown("### 開発者パネル")
+
+    st.write("#### 処理段階ごとの所要時間")
+    st.dataframe(pd.DataFrame(timing.summarize(timing_records)), hide_index=True)
+
+    with st.expander("計測ログ (JSON Lines)"):
+        st.dataframe(pd.DataFrame(timing_records), hide_index=True)
+
+    st.write("#### 計算結果キャッシュ (全セッション共有)")
+    st.dataframe(pd.DataFrame([result_cache.get_cache().stats()]), hide_index=True)
+
+    st.write("#### 工程ごとの計算結果メモ (このプロセス内。ワーカープロセスの分は含まない)")
+    st.dataframe(pd.DataFrame([PROCESS_MEMO.stats()]), hide_index=True)
+
+    st.write("#### 起動時の import 時間")
+    st.caption(
+        "必要になったときに読み込むモジュール (このプロセスで読み込み済みか): " +
+        ", ".join(f"{name}={'済' if name in sys.modules else '未'}" for name in LAZY_MODULES)
+    )
+    if st.button("import 時間を計測 (新しいプロセスで python -X importtime)", key="dev_importtime"):
+        # このモジュールが起動時に import するモジュールを、同じ順に新しいプロセスで import する
+        modules = [value.__name__ for value in globals().values() if isinstance(value, types.ModuleType)]
+        elapsed_ms, rows = timing.import_time_report(modules, cwd=os.path.dirname(os.path.abspath(__file__)))
+        report = pd.DataFrame(rows)
+        st.write(f"合計 {elapsed_ms:,.0f} ms (Python の起動を含む)")
+        st.dataframe(
+            report[report['depth'] == 0].sort_values('cumulative_ms', ascending=False),
+            hide_index=True
+        )
+        with st.expander("モジュール単体の時間 (self_ms) の上位"):
+            st.dataframe(report.sort_values('self_ms', ascending=False).head(30), hide_index=True)
+
+    if profile_text is not None:
+        with st.expander("cProfile 結果", expanded=True):
+            st.code(profile_text)
+
 ###################################################################################
 # メイン関数
 def main():
@@ -1479,6 +2395,39 @@ def main():
         index=default_index
     )
 
+    export_format = st.selectbox(
+        "計算結果の出力形式",
+        list(result_export.EXPORT_FORMATS.keys()),
+        format_func=result_export.EXPORT_FORMATS.get
+    )
+
+    # 開発者パネル (URLに ?dev=1 を付けたときのみ表示)
+    dev_mode = query_params.get("dev", "0") == "1"
+    use_profiler = False
+    if dev_mode:
+        use_profiler = st.checkbox("cProfile で計測する", value=False)
+
+    # 大量シナリオ向けの省メモリモード
+    bounded_mode = st.checkbox("省メモリモード（大量シナリオ向け: サマリーと散布図のみ表示）", value=False)
+    store_details = False
+    if bounded_mode:
+        store_details = st.checkbox("工程別の計算結果をDBに保存する", value=False)
+
+    # パレート分析 (パラメータを振ったスイープ)
+    pareto_sweep = None
+    if not bounded_mode and st.checkbox("パレート分析（パラメータを振ったスイープ）を行う", value=False):
+        pareto_sweep = {
+            'param_names': st.multiselect(
+                "振るパラメータ", pareto.SWEEP_PARAMETERS,
+                default=['num_of_units', 'unit_cost', 'yield_rate'],
+                format_func=lambda name: tm.jpn_eng_dict.get(name, name)
+            ),
+            'n_samples': int(st.number_input("スイープ点数", min_value=1000, max_value=5000000, value=200000, step=10000)),
+            'spread': st.slider("現在値からの変動幅[%]", min_value=1, max_value=100, value=20) / 100,
+        }
+        if not pareto_sweep['param_names']:
+            pareto_sweep = None
+
     # 1) ファイルアップロード
     uploaded_files = st.file_uploader(
         "Excelファイルを選択（複数可）",
@@ -1492,11 +2441,54 @@ def main():
             # スピナー表示（処理中ダイアログ）
             with st.spinner("計算中です...しばらくお待ちください。"):
                 # 実行
-                run_simulation(uploaded_files, product_choice)
+                timing_records = timing.start_request()
+                profile_text = None
+                if bounded_mode:
+                    simulate = functools.partial(run_simulation_bounded, store_details=store_details)
+                else:
+                    simulate = functools.partial(run_simulation, pareto_sweep=pareto_sweep)
+                if use_profiler:
+                    _, profile_text = timing.profile_call(simulate, uploaded_files, product_choice, export_format)
+                else:
+                    simulate(uploaded_files, product_choice, export_format)
+
+            if dev_mode:
+                show_developer_panel(timing_records, profile_text)
 
     else:
         st.info("Excelファイルをアップロードしてください。")
 
+    # 分析ツール (アップロード済みのワークブックを使う)
+    if uploaded_files:
+        with st.expander("目標値からのパラメータ逆算"):
+            show_goal_seek_view(uploaded_files, product_choice)
+        with st.expander("差分シナリオ (ベースのワークブック + 差分ファイル)"):
+            show_override_view(uploaded_files, product_choice)
+        with st.expander("需要からの装置台数計画"):
+            show_capacity_plan_view(uploaded_files, product_choice)
+        with st.expander("不確かさを考慮した装置台数の最適化"):
+            show_robust_capacity_view(uploaded_files, product_choice)
+        with st.expander("離散事象シミュレーション (待ち行列・バッチ待ち・装置停止)"):
+            show_throughput_view(uploaded_files, product_choice)
+        with st.expander("不確かさ評価 (best / standard / worst の範囲の分布)"):
+            show_uncertainty_view(uploaded_files, product_choice)
+        with st.expander("大域的感度分析 (Sobol 指標)"):
+            show_sensitivity_view(uploaded_files, product_choice)
+        with st.expander("2パラメータのマップ (単価・生産数量の等高線)"):
+            show_parameter_map_view(uploaded_files, product_choice)
+        with st.expander("バックグラウンド計算 (モンテカルロ・大規模スイープ)"):
+            show_job_queue_view(uploaded_files, product_choice)
+        with st.expander("サロゲートモデルによる即時プレビュー"):
+            show_surrogate_view(uploaded_files, product_choice)
+
+    # 共有フォルダの監視 (アップロードなしで使える)
+    with st.expander("フォルダ監視モード"):
+        show_watch_view(product_choice)
+
+    # 過去の計算結果
+    with st.expander("過去の計算結果"):
+        show_result_history(product_choice)
+
 
 if __name__ == "__main__":
     main()
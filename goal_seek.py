@@ -0,0 +1,199 @@
+# 目標値からのパラメータ逆算 (ゴールシーク)
+# 2026/10/19
+#
+# 100mmウエハ単価 または 100mmウエハ年間生産数量 の目標値に対し、
+# 候補パラメータ(工程×パラメータ)ごとに「他の入力を固定したまま、そのパラメータだけを変えて目標に届く値」を求める。
+# 全候補を1つの配列にまとめ、calculate_chain_batch で一括計算しながら
+#   1) 探索範囲を対数刻みで走査して、現在値に最も近い符号変化区間を見つけ
+#   2) その区間を二分法で絞り込む
+# 目標に届かない候補は feasible=False とする。
+
+import numpy as np
+import pandas as pd
+
+from cost_engine import INTEGER_PARAMETERS, calculate_chain_batch
+
+# 逆算対象の指標
+TARGETS = {
+    'wafer_cost': '100mmウエハ単価[yen/pcs]',
+    'wafer_production': '100mm年間生産数量[pcs/year]',
+}
+
+# 逆算候補のパラメータと探索範囲 (下限, 上限) ※None は現在値からの倍率で決める
+GOAL_SEEK_PARAMETERS = {
+    'yield_rate': (0.1, 100.0),
+    'num_of_units': (1.0, None),
+    'unit_cost': (0.0, None),
+    'labor_hours_per_process': (0.0, None),
+    'material_cost_per_process': (0.0, None),
+    'annual_process_capacity_per_unit': (None, None),
+    'batch_process_quantity': (1.0, None),
+}
+
+# 現在値からの探索倍率
+_SCALE_RANGE = 1000.0
+# 符号変化区間を探すための走査点数
+_SCAN_POINTS = 65
+# 二分法の反復回数
+_BISECTION_STEPS = 60
+# 1回の一括計算で扱う 工程数 × 候補数 × 評価点数 の上限 (工程ごとの中間配列のメモリを抑える)
+_CHUNK_ELEMENTS = 1 << 18
+
+###################################################################################
+# 探索範囲
+def _search_bounds(param_name, current):
+    lower, upper = GOAL_SEEK_PARAMETERS.get(param_name, (0.0, None))
+    scale = abs(current) if current else 1.0
+    if lower is None:
+        lower = scale / _SCALE_RANGE
+    if upper is None:
+        upper = scale * _SCALE_RANGE
+    return float(lower), float(upper)
+
+def _scan_grid(lower, upper, current):
+    """
+    探索範囲 [lower, upper] の走査点。現在値の周辺を細かく見るため、
+    下限が正なら対数刻み、0 を含むなら 0 と対数刻みを組み合わせる
+    """
+    if lower > 0:
+        grid = np.geomspace(lower, upper, _SCAN_POINTS)
+    else:
+        positive = max(upper / _SCALE_RANGE ** 2, 1e-12)
+        grid = np.concatenate([[lower], np.geomspace(positive, upper, _SCAN_POINTS - 1)])
+    return np.unique(np.append(grid, current))
+
+###################################################################################
+# 候補ごとの一括評価
+def _evaluate(processes_input, metadata, candidates, values, target, scenario):
+    """
+    candidates: [('工程名', 'パラメータ名'), ...] (K 個)
+    values: 形状 (K, M) の配列。values[k] を候補 k のパラメータに入れたときの目標指標を (K, M) で返す
+    候補を数個ずつに分けて計算し、上書き配列・中間配列の大きさを候補数によらず一定に抑える。
+    """
+    values = np.asarray(values, dtype=float)
+    K, M = values.shape
+    chunk = max(1, min(K, _CHUNK_ELEMENTS // (max(len(processes_input), 1) * M)))
+    result = np.empty((K, M))
+    for start in range(0, K, chunk):
+        block = values[start:start + chunk]
+        overrides = {}
+        for i, key in enumerate(candidates[start:start + chunk]):
+            if key not in overrides:
+                current = processes_input[key[0]][scenario][key[1]]
+                overrides[key] = np.full(block.shape, current, dtype=float)
+            overrides[key][i] = block[i]
+
+        wafer_cost, wafer_production, _ = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+        result[start:start + chunk] = wafer_cost if target == 'wafer_cost' else wafer_production
+    return result
+
+###################################################################################
+# 逆算
+def goal_seek(processes_input, metadata, target, target_value, candidates=None, scenario='standard'):
+    """
+    processes_input, metadata: read_parameters の戻り値
+    target: 'wafer_cost' (100mmウエハ単価) or 'wafer_production' (100mm年間生産数量)
+    target_value: 目標値
+    candidates: [('工程名', 'パラメータ名'), ...]
+                 None のときは全工程 × GOAL_SEEK_PARAMETERS
+    戻り値: 候補ごとの結果 DataFrame
+      列: process, parameter, current_value, solution, achieved, change_ratio, feasible, note
+    """
+    if candidates is None:
+        candidates = [
+            (process_name, param_name)
+            for process_name in processes_input
+            for param_name in GOAL_SEEK_PARAMETERS
+        ]
+    candidates = list(candidates)
+    if not candidates:
+        return pd.DataFrame(columns=['process', 'parameter', 'current_value', 'solution', 'achieved',
+                                     'change_ratio', 'feasible', 'note'])
+
+    K = len(candidates)
+    current = np.array([float(processes_input[p][scenario][name]) for p, name in candidates])
+    bounds = [_search_bounds(name, current[k]) for k, (_, name) in enumerate(candidates)]
+
+    # 1) 走査: 候補ごとに走査点の数が異なるので、最大長に揃えて最後の点で埋める
+    grids = [_scan_grid(lower, upper, current[k]) for k, (lower, upper) in enumerate(bounds)]
+    width = max(len(g) for g in grids)
+    scan = np.array([np.pad(g, (0, width - len(g)), mode='edge') for g in grids])
+    residual = _evaluate(processes_input, metadata, candidates, scan, target, scenario) - target_value
+
+    lo = np.full(K, np.nan)
+    hi = np.full(K, np.nan)
+    exact = np.full(K, np.nan)
+    notes = [''] * K
+    for k in range(K):
+        r = residual[k]
+        finite = np.isfinite(r)
+        hits = np.flatnonzero(finite & (r == 0))
+        # 隣り合う走査点で符号が変わる区間
+        crossing = np.flatnonzero(finite[:-1] & finite[1:] & (np.sign(r[:-1]) * np.sign(r[1:]) < 0))
+        if len(hits) == 0 and len(crossing) == 0:
+            if not finite.any():
+                notes[k] = '計算不能'
+            elif np.nanmin(r) > 0:
+                notes[k] = '探索範囲内で目標を下回れない'
+            else:
+                notes[k] = '探索範囲内で目標を上回れない'
+            continue
+        # 現在値に最も近い解(区間)を採用する
+        candidates_x = [scan[k, i] for i in hits] + [0.5 * (scan[k, i] + scan[k, i + 1]) for i in crossing]
+        best = int(np.argmin(np.abs(np.array(candidates_x) - current[k])))
+        if best < len(hits):
+            exact[k] = scan[k, hits[best]]
+        else:
+            i = crossing[best - len(hits)]
+            lo[k], hi[k] = scan[k, i], scan[k, i + 1]
+
+    # 2) 二分法: 区間が見つかった候補をまとめて絞り込む
+    active = np.isfinite(lo)
+    if active.any():
+        r_lo = _evaluate(processes_input, metadata, candidates, np.where(active, lo, current)[:, None], target, scenario)[:, 0] - target_value
+        for _ in range(_BISECTION_STEPS):
+            mid = np.where(active, 0.5 * (lo + hi), current)
+            r_mid = _evaluate(processes_input, metadata, candidates, mid[:, None], target, scenario)[:, 0] - target_value
+            same_side = np.sign(r_mid) == np.sign(r_lo)
+            lo = np.where(active & same_side, mid, lo)
+            r_lo = np.where(active & same_side, r_mid, r_lo)
+            hi = np.where(active & ~same_side, mid, hi)
+
+    solution = np.where(np.isfinite(exact), exact, 0.5 * (lo + hi))
+
+    # 整数パラメータは、現在値から見て目標の側(区間の遠い側)へ整数に丸める
+    integer = np.array([name in INTEGER_PARAMETERS for _, name in candidates]) & np.isfinite(solution)
+    if integer.any():
+        rounded = np.where(solution > current, np.ceil(solution - 1e-9), np.floor(solution + 1e-9))
+        lower = np.array([lower for lower, _ in bounds])
+        solution = np.where(integer, np.maximum(rounded, lower), solution)
+
+    feasible = np.isfinite(solution)
+    achieved = np.full(K, np.nan)
+    if feasible.any():
+        achieved = _evaluate(processes_input, metadata, candidates, np.where(feasible, solution, current)[:, None], target, scenario)[:, 0]
+        achieved = np.where(feasible, achieved, np.nan)
+
+    # 丸めた整数値で、現在値の側から目標を越えられたかを確認する
+    if integer.any():
+        current_cost, current_production, _ = calculate_chain_batch(processes_input, metadata, scenario)
+        current_residual = float(current_cost if target == 'wafer_cost' else current_production) - target_value
+        residual = achieved - target_value
+        reached = np.isfinite(residual) & ((residual == 0) | (np.sign(residual) != np.sign(current_residual)))
+        for k in np.flatnonzero(integer & ~reached):
+            feasible[k] = False
+            notes[k] = '整数値では目標に届かない'
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_ratio = np.where(current != 0, solution / current, np.nan)
+
+    return pd.DataFrame({
+        'process': [p for p, _ in candidates],
+        'parameter': [name for _, name in candidates],
+        'current_value': current,
+        'solution': solution,
+        'achieved': achieved,
+        'change_ratio': change_ratio,
+        'feasible': feasible,
+        'note': notes,
+    })
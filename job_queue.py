@@ -0,0 +1,413 @@
+# 長時間計算のバックグラウンドジョブ
+# 2026/10/19
+#
+# モンテカルロ・大規模スイープなどを Streamlit のスクリプトスレッドから切り離し、専用のプロセスプールで実行する。
+# ジョブの状態と進捗は SQLite のジョブテーブルに記録するので、ブラウザのタブを閉じても計算は続き、
+# 後からジョブIDで進捗・結果を取り出せる。
+#   - 結果はチャンクごとに集計 (streaming_stats.ChainAccumulator) を更新して書き出す。
+#     全点の結果 (npz) は keep_samples=True のときだけ保存する (途中経過もその時点までの結果として読める)
+#   - キャンセルはジョブテーブルの状態で伝え、ワーカーはチャンクの区切りで確認して止まる
+#   - 対話的な計算 (cost_engine のワーカープール) と別のプールで、ワーカー数を絞り優先度を下げて動かす
+#
+# ジョブの種類
+#   sweep      : 全工程の指定パラメータを現在値 ±spread の一様乱数で振る
+#   monte_carlo: 全工程の指定パラメータを (best, standard, worst) の三角分布で振る
+#                (点列は uncertainty の Sobol / Halton / 擬似乱数から選ぶ)
+
+import json
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import numpy as np
+
+from cost_engine import calculate_chain_batch
+from pareto import sample_values, total_capex
+from streaming_stats import ChainAccumulator
+import uncertainty
+
+# ジョブテーブルのDBファイルと、結果ファイルの保存先 (カレントディレクトリに作成)
+JOB_DB_PATH = 'simulation_jobs.db'
+JOB_DIR = 'simulation_jobs'
+
+JOB_KINDS = {
+    'sweep': 'スイープ (現在値 ±変動幅の一様分布)',
+    'monte_carlo': 'モンテカルロ (best / standard / worst の三角分布)',
+}
+# 結果の目的変数の列
+RESULT_COLUMNS = ['wafer_cost', 'wafer_production', 'capex']
+# 終了済みの状態
+FINISHED_STATUSES = ('done', 'cancelled', 'failed', 'interrupted')
+
+# 1チャンクで計算する点数の上限 (進捗の更新・キャンセル確認の間隔)
+_CHUNK_ELEMENTS = 1 << 18
+# ワーカーの優先度 (nice 値)。対話的な計算より後回しにする
+_WORKER_NICENESS = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind           TEXT NOT NULL,
+    label          TEXT,
+    product        TEXT,
+    status         TEXT NOT NULL,
+    created_at     TEXT NOT NULL,
+    started_at     TEXT,
+    finished_at    TEXT,
+    samples_total  INTEGER NOT NULL,
+    samples_done   INTEGER NOT NULL DEFAULT 0,
+    chunks_total   INTEGER NOT NULL,
+    chunks_done    INTEGER NOT NULL DEFAULT 0,
+    options        TEXT,
+    columns        TEXT,
+    server_pid     INTEGER,
+    error          TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+"""
+
+###################################################################################
+# ジョブテーブル
+def connect(db_path=JOB_DB_PATH):
+    """
+    ジョブテーブルのDBに接続する (result_store.connect と同じく WAL モード)
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(_SCHEMA)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+def _update(db_path, job_id, where_status=None, **values):
+    """
+    ジョブの列を更新する。where_status を指定すると、その状態のときだけ更新する。
+    戻り値: 更新できたら True
+    """
+    conn = connect(db_path)
+    try:
+        sql = f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in values)} WHERE job_id = ?"
+        params = [*values.values(), job_id]
+        if where_status is not None:
+            sql += f" AND status IN ({', '.join(['?'] * len(where_status))})"
+            params += list(where_status)
+        updated = conn.execute(sql, params).rowcount
+        conn.commit()
+        return updated > 0
+    finally:
+        conn.close()
+
+def _result_dir(job_dir, job_id):
+    return os.path.join(job_dir, f'job_{job_id:06d}')
+
+def _write_atomic(path, write):
+    # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+    with open(path + '.tmp', 'wb') as f:
+        write(f)
+    os.replace(path + '.tmp', path)
+
+###################################################################################
+# ワーカーでの実行
+class _ChunkSampler:
+    """
+    1チャンク分のパラメータ値 (size, len(keys)) を順に作る
+      sweep      : 現在値 ±spread の一様乱数
+      monte_carlo: (best, standard, worst) の三角分布 (options['sampling'] の点列を逆累積分布関数で変換)
+    """
+    def __init__(self, kind, processes_input, keys, options):
+        self.kind = kind
+        self.keys = keys
+        self.options = options
+        if kind == 'sweep':
+            self.rng = np.random.default_rng(options['seed'])
+            self.current = [float(processes_input[process_name][options['scenario']][param_name])
+                            for process_name, param_name in keys]
+        else:
+            self.bounds = uncertainty.triangular_bounds(processes_input, keys)
+            self.sampler, _ = uncertainty.make_sampler(options['sampling'], len(keys), options['seed'])
+            self.dimension_order = uncertainty.dimension_order_by_width(self.bounds)
+
+    def sample(self, size):
+        if not self.keys:
+            return np.empty((size, 0))
+        if self.kind == 'sweep':
+            return np.column_stack([
+                sample_values(self.rng, current, param_name, self.options['spread'], size)
+                for current, (_, param_name) in zip(self.current, self.keys)
+            ])
+        u = self.sampler.random(size)[:, self.dimension_order]
+        return uncertainty.parameter_values(u, self.bounds, self.keys)
+
+def _init_worker():
+    # 対話的な計算を妨げないよう、ジョブのワーカーは優先度を下げて動かす
+    if hasattr(os, 'nice'):
+        try:
+            os.nice(_WORKER_NICENESS)
+        except OSError:
+            pass
+
+def run_job(job_id, kind, processes_input, metadata, options, db_path=JOB_DB_PATH, job_dir=JOB_DIR):
+    """
+    ジョブを実行する (ジョブ用のワーカープロセスで実行)。
+    チャンクごとに集計 (stats.pkl) を更新し、keep_samples のときは全点の結果を
+    npz (X: パラメータ値, Y: wafer_cost, wafer_production, capex) に書き出して、進捗を更新する。
+    チャンクの区切りでキャンセル要求を確認する。
+    """
+    # 開始前にキャンセルされたジョブは実行しない
+    if not _update(db_path, job_id, where_status=('queued',), status='running', started_at=_now()):
+        _update(db_path, job_id, where_status=('cancelling',), status='cancelled', finished_at=_now())
+        return
+
+    try:
+        scenario = options['scenario']
+        keys = [tuple(key) for key in options['keys']]
+        sampler = _ChunkSampler(kind, processes_input, keys, options)
+        result_dir = _result_dir(job_dir, job_id)
+        os.makedirs(result_dir, exist_ok=True)
+        accumulator = ChainAccumulator(list(processes_input))
+
+        n_samples = options['n_samples']
+        chunk_size = options['chunk_size']
+        for chunk_index, start in enumerate(range(0, n_samples, chunk_size)):
+            conn = connect(db_path)
+            try:
+                status = conn.execute('SELECT status FROM jobs WHERE job_id = ?', (job_id,)).fetchone()['status']
+            finally:
+                conn.close()
+            if status == 'cancelling':
+                _update(db_path, job_id, status='cancelled', finished_at=_now())
+                return
+
+            size = min(chunk_size, n_samples - start)
+            values = sampler.sample(size)
+            overrides = {key: values[:, j] for j, key in enumerate(keys)}
+            wafer_cost, wafer_production, instances = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+            objectives = np.column_stack([
+                np.broadcast_to(wafer_cost, size),
+                np.broadcast_to(wafer_production, size),
+                np.broadcast_to(total_capex(instances), size),
+            ])
+
+            accumulator.update(wafer_cost, wafer_production, instances, size)
+            _write_atomic(os.path.join(result_dir, 'stats.pkl'), lambda f: pickle.dump(accumulator, f))
+            if options['keep_samples']:
+                _write_atomic(
+                    os.path.join(result_dir, f'part_{chunk_index:05d}.npz'),
+                    lambda f: np.savez(f, X=values, Y=objectives)
+                )
+            _update(db_path, job_id, samples_done=start + size, chunks_done=chunk_index + 1)
+
+        _update(db_path, job_id, status='done', finished_at=_now())
+    except Exception as e:
+        _update(db_path, job_id, status='failed', finished_at=_now(), error=repr(e))
+        raise
+
+###################################################################################
+# ジョブ用のプロセスプール
+# ワーカー数は環境変数 COST_SIMULATOR_JOB_WORKERS で指定できる (既定は1)。
+# 対話的な計算のプール (cost_engine.MAX_WORKERS) とは別に持ち、重いジョブが同時に何本あっても
+# ここで順番待ちになる。
+def _job_workers_from_env():
+    value = os.environ.get('COST_SIMULATOR_JOB_WORKERS')
+    if value:
+        try:
+            return max(1, min(int(value), os.cpu_count() or 1))
+        except ValueError:
+            pass
+    return 1
+
+JOB_MAX_WORKERS = _job_workers_from_env()
+_job_pool = None
+_job_pool_lock = threading.Lock()
+_futures = {}  # job_id -> Future (このサーバープロセスで投入したジョブ)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+def _mark_interrupted(db_path=JOB_DB_PATH):
+    """
+    投入したサーバープロセスが既に終了している未完了のジョブを interrupted にする
+    (サーバーの再起動で失われたジョブ)
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT job_id, server_pid FROM jobs WHERE status IN ('queued', 'running', 'cancelling')"
+        ).fetchall()
+        stale = [
+            (_now(), row['job_id']) for row in rows
+            if row['server_pid'] != os.getpid() and not (row['server_pid'] and _pid_alive(row['server_pid']))
+        ]
+        conn.executemany("UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE job_id = ?", stale)
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_job_pool():
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            _mark_interrupted()
+            _job_pool = ProcessPoolExecutor(
+                max_workers=JOB_MAX_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        return _job_pool
+
+def _reset_job_pool():
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is not None:
+            _job_pool.shutdown(wait=False, cancel_futures=True)
+        _job_pool = None
+
+def _on_job_finished(job_id, db_path, future):
+    _futures.pop(job_id, None)
+    if future.cancelled():
+        _update(db_path, job_id, where_status=('queued', 'cancelling'), status='cancelled', finished_at=_now())
+        return
+    error = future.exception()
+    if isinstance(error, BrokenProcessPool):
+        # ワーカーが異常終了した (メモリ不足など)。プールを作り直し、このジョブは失敗とする
+        _reset_job_pool()
+        _update(db_path, job_id, where_status=('queued', 'running', 'cancelling'),
+                status='failed', finished_at=_now(), error=repr(error))
+
+###################################################################################
+# ジョブの投入・照会・キャンセル・結果取得
+def submit_job(kind, processes_input, metadata, param_names, n_samples, spread=0.2, seed=0,
+               scenario='standard', keep_samples=True, sampling='random', label=None, product=None,
+               db_path=JOB_DB_PATH, job_dir=JOB_DIR):
+    """
+    ジョブを投入し、ジョブIDを返す (計算はバックグラウンドで進む)
+    kind: 'sweep' または 'monte_carlo'
+    param_names: 振るパラメータ名のリスト (全工程に適用)
+    spread: sweep のときの変動幅 (0.2 なら ±20%)
+    keep_samples: 全点のパラメータ値と結果を保存するか (False なら集計だけを保存し、ディスク使用量は点数によらない)
+    sampling: monte_carlo の点列 ('sobol', 'halton', 'random')
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f'unknown job kind: {kind}')
+    n_samples = int(n_samples)
+    keys = [(process_name, param_name) for process_name in processes_input for param_name in param_names]
+    chunk_size = max(1000, _CHUNK_ELEMENTS // max(len(processes_input), 1))
+    if kind == 'monte_carlo' and sampling == 'sobol':
+        # Sobol 列は2のべき乗の点数ずつ取り出す
+        chunk_size = 1 << int(np.log2(chunk_size))
+    options = {
+        'keys': keys, 'n_samples': n_samples, 'spread': spread, 'seed': seed, 'sampling': sampling,
+        'scenario': scenario, 'chunk_size': chunk_size, 'keep_samples': bool(keep_samples),
+    }
+
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            'INSERT INTO jobs (kind, label, product, status, created_at, samples_total, chunks_total, '
+            'options, columns, server_pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (kind, label, product, 'queued', _now(), n_samples, -(-n_samples // chunk_size),
+             json.dumps({k: v for k, v in options.items() if k != 'keys'}), json.dumps(keys), os.getpid())
+        )
+        job_id = cur.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+
+    future = get_job_pool().submit(run_job, job_id, kind, processes_input, metadata, options, db_path, job_dir)
+    _futures[job_id] = future
+    future.add_done_callback(lambda f: _on_job_finished(job_id, db_path, f))
+    return job_id
+
+def get_job(job_id, db_path=JOB_DB_PATH):
+    """
+    ジョブ1件の状態を辞書で返す (存在しなければ None)
+    progress: 完了したチャンクの割合 (0〜1)
+    """
+    conn = connect(db_path)
+    try:
+        row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job['progress'] = job['chunks_done'] / job['chunks_total'] if job['chunks_total'] else 1.0
+    return job
+
+def list_jobs(limit=50, db_path=JOB_DB_PATH):
+    """
+    新しい順にジョブの一覧を返す (DataFrame にしやすい辞書のリスト)
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            'SELECT job_id, kind, label, product, status, created_at, started_at, finished_at, '
+            'samples_total, samples_done, chunks_total, chunks_done, error FROM jobs ORDER BY job_id DESC LIMIT ?',
+            (limit,)
+        ).fetchall()
+    finally:
+        conn.close()
+    jobs = [dict(row) for row in rows]
+    for job in jobs:
+        job['progress'] = job['chunks_done'] / job['chunks_total'] if job['chunks_total'] else 1.0
+    return jobs
+
+def cancel_job(job_id, db_path=JOB_DB_PATH):
+    """
+    ジョブのキャンセルを要求する。実行中のジョブは次のチャンクの区切りで止まる。
+    戻り値: 要求を受け付けたら True (既に終了済みなら False)
+    """
+    if not _update(db_path, job_id, where_status=('queued', 'running'), status='cancelling'):
+        return False
+    future = _futures.get(job_id)
+    if future is not None and future.cancel():
+        # まだワーカーに渡っていなかった
+        _update(db_path, job_id, status='cancelled', finished_at=_now())
+    return True
+
+def load_result(job_id, db_path=JOB_DB_PATH, job_dir=JOB_DIR):
+    """
+    ジョブの結果を読み込む。実行中のジョブは、その時点までに完了したチャンクの結果を返す。
+    戻り値: (keys, X, Y)
+      keys: X の列の [('工程名', 'パラメータ名'), ...]
+      X: パラメータ値 (N, len(keys))
+      Y: (N, 3) の目的変数 (列の並びは RESULT_COLUMNS)
+    """
+    job = get_job(job_id, db_path)
+    if job is None:
+        raise KeyError(job_id)
+    keys = [tuple(key) for key in json.loads(job['columns'])]
+    result_dir = _result_dir(job_dir, job_id)
+    parts = sorted(name for name in os.listdir(result_dir) if name.endswith('.npz')) if os.path.isdir(result_dir) else []
+    X = [np.empty((0, len(keys)))]
+    Y = [np.empty((0, len(RESULT_COLUMNS)))]
+    for name in parts:
+        with np.load(os.path.join(result_dir, name)) as part:
+            X.append(part['X'])
+            Y.append(part['Y'])
+    return keys, np.vstack(X), np.vstack(Y)
+
+def load_stats(job_id, job_dir=JOB_DIR):
+    """
+    ジョブの集計 (streaming_stats.ChainAccumulator) を読み込む。実行中ならその時点までの集計。
+    まだ1チャンクも終わっていなければ None
+    """
+    path = os.path.join(_result_dir(job_dir, job_id), 'stats.pkl')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,188 @@
+# マルチコアのモンテカルロ (共有メモリ・再現可能な乱数)
+# 2026/10/19
+#
+# 各工程のパラメータを (best, standard, worst) の三角分布で振るモンテカルロを、全コアで分担して計算する。
+#   - 乱数: np.random.SeedSequence(seed).spawn(チャンク数) でチャンクごとに独立した乱数列を作る。
+#           チャンクの分け方は点数と chunk_size だけで決まり、どのワーカーが計算しても同じ乱数列を使うので、
+#           結果はワーカー数によらずビット単位で一致する
+#   - 入力: read_parameters の全パラメータを (工程数, パラメータ数, 3 (best, standard, worst)) の配列にして
+#           共有メモリに1回だけ置き、ワーカーは読み取り専用の配列として参照する (チャンクごとに pickle しない)
+#   - 出力: 100mmウエハ単価・生産数量の (2, 点数) の共有メモリに、ワーカーが自分のチャンクの範囲を直接書き込む
+#           (ワーカーから返すのはチャンク番号だけ)
+# チャンクは点数順に投入するが、どのワーカーがどの順に終えても書き込む場所は決まっている。
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import uncertainty
+from cost_engine import calculate_chain_batch
+
+CASES = ('best', 'standard', 'worst')
+# 1チャンクの点数の既定値 (結果の再現性はこの値で決まる。ワーカー数を変えても同じ値を使うこと)
+DEFAULT_CHUNK_SIZE = 1 << 14
+
+###################################################################################
+# 入力パラメータの配列
+def parameter_tensor(processes_input):
+    """
+    戻り値: (工程名のリスト, パラメータ名のリスト, (工程数, パラメータ数, 3) の配列 (最後の軸は CASES の順))
+    パラメータ名は最初の工程の standard の並び (工程によってないパラメータは nan)
+    """
+    process_names = list(processes_input)
+    param_names = list(processes_input[process_names[0]]['standard']) if process_names else []
+    tensor = np.full((len(process_names), len(param_names), len(CASES)), np.nan)
+    for p, process_name in enumerate(process_names):
+        for c, case in enumerate(CASES):
+            values = processes_input[process_name][case]
+            for q, param_name in enumerate(param_names):
+                if param_name in values:
+                    tensor[p, q, c] = float(values[param_name])
+    return process_names, param_names, tensor
+
+def _processes_from_tensor(process_names, param_names, tensor, scenario):
+    # calculate_chain_batch に渡す processes_input (scenario のケースだけ)
+    c = CASES.index(scenario)
+    return {
+        process_name: {scenario: dict(zip(param_names, tensor[p, :, c].tolist()))}
+        for p, process_name in enumerate(process_names)
+    }
+
+###################################################################################
+# ワーカーでの実行
+def _attach(name, shape):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+def _run_chunk(task):
+    """
+    1チャンク分の点を計算し、結果を共有メモリに書き込む (ワーカープロセスで実行)
+    戻り値: チャンク番号
+    """
+    (chunk_index, start, stop, seed_sequence, base_name, base_shape, out_name, n_samples,
+     process_names, param_names, key_indices, metadata, scenario) = task
+    base_shm, base = _attach(base_name, base_shape)
+    out_shm, out = _attach(out_name, (2, n_samples))
+    try:
+        base.flags.writeable = False
+        keys = [(process_names[p], param_names[q]) for p, q in key_indices]
+        processes_input = _processes_from_tensor(process_names, param_names, base, scenario)
+        size = stop - start
+        if keys:
+            # 三角分布の (下限, 最頻値, 上限)。最頻値は standard、下限・上限は best / worst の小さい方・大きい方
+            cases = np.array([base[p, q] for p, q in key_indices])
+            bounds = np.column_stack([cases.min(axis=1), cases[:, CASES.index('standard')], cases.max(axis=1)])
+            u = np.random.default_rng(seed_sequence).random((size, len(keys)))
+            values = uncertainty.parameter_values(u, bounds, keys)
+            overrides = {key: values[:, j] for j, key in enumerate(keys)}
+        else:
+            overrides = {}
+        wafer_cost, wafer_production, _ = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+        out[0, start:stop] = np.broadcast_to(wafer_cost, size)
+        out[1, start:stop] = np.broadcast_to(wafer_production, size)
+    finally:
+        del base, out
+        base_shm.close()
+        out_shm.close()
+    return chunk_index
+
+###################################################################################
+# モンテカルロ用のプロセスプール
+# ワーカー数は環境変数 COST_SIMULATOR_MC_WORKERS で指定できる (既定は CPU数)。
+# 対話的な計算のプール (cost_engine) ・ジョブのプール (job_queue) とは別に持つ。
+def _mc_workers_from_env():
+    value = os.environ.get('COST_SIMULATOR_MC_WORKERS')
+    if value:
+        try:
+            return max(1, int(value))
+        except ValueError:
+            pass
+    return os.cpu_count() or 1
+
+MC_MAX_WORKERS = _mc_workers_from_env()
+_mc_pools = {}
+_mc_pool_lock = threading.Lock()
+
+def get_mc_pool(workers):
+    with _mc_pool_lock:
+        if workers not in _mc_pools:
+            # Streamlit サーバーはマルチスレッドのため fork ではなく spawn でワーカーを起動する
+            _mc_pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _mc_pools[workers]
+
+def _reset_mc_pool(workers):
+    with _mc_pool_lock:
+        pool = _mc_pools.pop(workers, None)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+###################################################################################
+# 並列実行
+def run_parallel(processes_input, metadata, param_names, n_samples, seed=0, workers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, scenario='standard'):
+    """
+    全工程の param_names を三角分布で振り、n_samples 点の100mmウエハ単価・生産数量を計算する。
+    workers: ワーカー数 (None のときは MC_MAX_WORKERS。1 のときはプールを使わずその場で計算する)
+    結果は seed と chunk_size が同じならワーカー数によらず同じになる。
+
+    戻り値: {
+        'wafer_cost': (n_samples,) の配列, 'wafer_production': (n_samples,) の配列,
+        'keys': 振ったパラメータの [('工程名', 'パラメータ名'), ...],
+        'chunks': チャンク数, 'workers': 使ったワーカー数, 'elapsed': 所要時間[s],
+    }
+    """
+    started = time.perf_counter()
+    workers = max(1, int(workers or MC_MAX_WORKERS))
+    n_samples = int(n_samples)
+    process_names, all_params, tensor = parameter_tensor(processes_input)
+    key_indices = [(p, all_params.index(param_name))
+                   for p, process_name in enumerate(process_names)
+                   for param_name in param_names if param_name in all_params]
+    starts = list(range(0, n_samples, chunk_size))
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(starts))
+
+    base_shm = shared_memory.SharedMemory(create=True, size=max(tensor.nbytes, 1))
+    out_shm = shared_memory.SharedMemory(create=True, size=max(2 * n_samples * 8, 1))
+    try:
+        np.ndarray(tensor.shape, dtype=np.float64, buffer=base_shm.buf)[...] = tensor
+        tasks = [
+            (i, start, min(start + chunk_size, n_samples), seed_sequences[i], base_shm.name, tensor.shape,
+             out_shm.name, n_samples, process_names, all_params, key_indices, metadata, scenario)
+            for i, start in enumerate(starts)
+        ]
+        if workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                _run_chunk(task)
+        else:
+            try:
+                list(get_mc_pool(workers).map(_run_chunk, tasks))
+            except BrokenProcessPool:
+                # ワーカーが異常終了した場合はプールを作り直し、今回はその場で計算する
+                _reset_mc_pool(workers)
+                for task in tasks:
+                    _run_chunk(task)
+        out = np.ndarray((2, n_samples), dtype=np.float64, buffer=out_shm.buf)
+        wafer_cost, wafer_production = out[0].copy(), out[1].copy()
+        del out
+    finally:
+        base_shm.close()
+        base_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+
+    return {
+        'wafer_cost': wafer_cost,
+        'wafer_production': wafer_production,
+        'keys': [(process_names[p], all_params[q]) for p, q in key_indices],
+        'chunks': len(starts),
+        'workers': workers,
+        'elapsed': time.perf_counter() - started,
+    }
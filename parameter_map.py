@@ -0,0 +1,132 @@
+# 2パラメータのマップ (100mmウエハ単価・100mm年間生産数量の等高線)
+# 2026/10/19
+#
+# 任意の2つのパラメータ (例: efg_growth の yield_rate と polishing_cmp の num_of_units、
+# または __Metadata の共通設備の年間減価償却費) を格子状に振り、各格子点で工程チェーン全体を計算する。
+# 横軸の値は (1, nx)、縦軸の値は (ny, 1) の配列として calculate_chain_batch に渡し、
+# ブロードキャストで ny × nx 点を一括計算する (格子の値の配列を ny × nx に展開しない)。
+# 工程ごとの中間配列のメモリを抑えるため、行数が多い場合は縦軸を数行ずつに分けて計算する。
+
+import inspect
+import math
+
+import numpy as np
+
+from cost_engine import INTEGER_PARAMETERS, ProcessCost, calculate_chain_batch
+
+# メタデータ (全工程共通) の軸の工程名
+METADATA = '__Metadata'
+# 格子の分割数の既定値
+DEFAULT_RESOLUTION = 200
+# 1回の一括計算で扱う 工程数 × 点数 の上限
+_CHUNK_ELEMENTS = 1 << 20
+# 前工程の出力で上書きされる入力 (最初の工程以外では振っても結果が変わらない)
+_UPSTREAM_PARAMETERS = {'upstream_total_annual_production', 'upstream_total_product_cost'}
+
+###################################################################################
+# 軸のパラメータ
+def _is_number(value):
+    try:
+        return not isinstance(value, bool) and math.isfinite(float(value))
+    except (TypeError, ValueError):
+        return False
+
+def parameter_names(processes_input, metadata, process_name):
+    """
+    軸に選べるパラメータ名のリスト。
+    process_name が METADATA のときはメタデータのうち数値の項目。
+    工程のときは ProcessCost の入力のうち数値の項目 (ProcessCost の引数順)。メタデータの項目と、
+    最初の工程以外では前工程から渡される upstream_total_annual_production / upstream_total_product_cost を除く
+    """
+    if process_name == METADATA:
+        return [name for name, value in metadata.items() if _is_number(value)]
+    standard = processes_input[process_name]['standard']
+    first = process_name == next(iter(processes_input))
+    return [
+        name for name in inspect.signature(ProcessCost).parameters
+        if name in standard and name not in metadata and _is_number(standard[name])
+        and (first or name not in _UPSTREAM_PARAMETERS)
+    ]
+
+def current_value(processes_input, metadata, key, scenario='standard'):
+    """
+    key: ('工程名' または METADATA, 'パラメータ名') のワークブックの値
+    """
+    process_name, param_name = key
+    if process_name == METADATA:
+        return float(metadata[param_name])
+    return float(processes_input[process_name][scenario][param_name])
+
+###################################################################################
+# 軸の値
+def default_range(processes_input, key, metadata=None):
+    """
+    key: ('工程名' または METADATA, 'パラメータ名')
+    戻り値: (下限, 上限)。best / standard / worst の最小・最大 (3つとも同じ値のときは standard の ±50%)。
+            メタデータはケースごとの値がないので、ワークブックの値の ±50%。
+            整数パラメータは 1 以上の整数にそろえ、少なくとも standard の半分から2倍までを含める
+    """
+    process_name, param_name = key
+    if process_name == METADATA:
+        values = [current_value(processes_input, metadata, key)] * 3
+    else:
+        values = [float(processes_input[process_name][case][param_name]) for case in ('best', 'standard', 'worst')]
+    lower, upper = min(values), max(values)
+    if param_name in INTEGER_PARAMETERS:
+        lower = max(1.0, min(np.floor(lower), np.floor(values[1] / 2)))
+        upper = max(np.ceil(upper), np.ceil(values[1] * 2), lower + 1.0)
+        return float(lower), float(upper)
+    if lower == upper:
+        lower, upper = values[1] * 0.5, values[1] * 1.5
+        if lower == upper:
+            upper = lower + 1.0
+    return min(lower, upper), max(lower, upper)
+
+def axis_values(param_name, lower, upper, resolution=DEFAULT_RESOLUTION):
+    """
+    [lower, upper] を resolution 点に等分した値。
+    整数パラメータは 1 以上の整数に丸めて重複を除く (範囲内の整数が resolution より少なければ点数が減る)
+    """
+    values = np.linspace(lower, upper, max(int(resolution), 2))
+    if param_name in INTEGER_PARAMETERS:
+        values = np.unique(np.maximum(1.0, np.round(values)))
+    return values
+
+###################################################################################
+# 格子点の一括計算
+def evaluate_grid(processes_input, metadata, key_x, values_x, key_y, values_y, scenario='standard'):
+    """
+    key_x, key_y: 横軸・縦軸の ('工程名' または METADATA, 'パラメータ名')
+    values_x, values_y: 軸の値の配列
+
+    戻り値: {
+        'x': 横軸の値 (nx,),
+        'y': 縦軸の値 (ny,),
+        'wafer_cost': 100mmウエハ単価 (ny, nx),
+        'wafer_production': 100mm年間生産数量 (ny, nx),
+        'evaluations': チェーンの評価回数 (ny × nx),
+    }
+    """
+    if key_x == key_y:
+        raise ValueError('the two axes must be different parameters')
+    values_x = np.asarray(values_x, dtype=float)
+    values_y = np.asarray(values_y, dtype=float)
+    nx, ny = len(values_x), len(values_y)
+    wafer_cost = np.empty((ny, nx))
+    wafer_production = np.empty((ny, nx))
+
+    rows = max(1, _CHUNK_ELEMENTS // max(nx * len(processes_input), 1))
+    for start in range(0, ny, rows):
+        stop = min(start + rows, ny)
+        overrides = {key_x: values_x[None, :], key_y: values_y[start:stop, None]}
+        cost, production, _ = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+        wafer_cost[start:stop] = np.broadcast_to(cost, (stop - start, nx))
+        wafer_production[start:stop] = np.broadcast_to(production, (stop - start, nx))
+
+    return {
+        'x': values_x,
+        'y': values_y,
+        'wafer_cost': wafer_cost,
+        'wafer_production': wafer_production,
+        'evaluations': nx * ny,
+    }
@@ -0,0 +1,231 @@
+# パレートフロンティア (100mmウエハ単価 × 100mmウエハ年間生産数量 × 総設備投資額)
+# 2026/10/19
+#
+# 大量のスイープ結果から、他のどの点にも劣らない点(非劣解)だけを取り出す。
+#   100mmウエハ単価   : 小さいほど良い
+#   100mm年間生産数量 : 大きいほど良い
+#   総設備投資額      : 小さいほど良い (Σ 装置単価 × 装置台数)
+# 2目的は「ソートして1回走査」、3目的は「分割統治」(Kung のアルゴリズム) で求める。
+# 非劣解の集合は「部分集合ごとの非劣解の和集合の非劣解」と等しいので、
+# スイープはチャンクごとに計算して非劣解だけを残しながら進める (全点をメモリに持たない)。
+
+import numpy as np
+import pandas as pd
+
+from cost_engine import INTEGER_PARAMETERS, calculate_chain_batch
+
+# スイープ対象のパラメータ
+SWEEP_PARAMETERS = [
+    'num_of_units',
+    'unit_cost',
+    'yield_rate',
+    'annual_process_capacity_per_unit',
+    'batch_process_quantity',
+    'labor_hours_per_process',
+    'material_cost_per_process',
+]
+
+# 分割統治で総当たり比較に切り替える点数
+_LEAF_SIZE = 64
+# 事前の間引きの基準点を選ぶための抽出点数
+_PREFILTER_SAMPLE = 4096
+# 事前の間引きに使う基準点の最大数
+_PREFILTER_ANCHORS = 64
+# 表示用に残すスイープ結果の点数
+BACKGROUND_SIZE = 5000
+# 1回の一括計算で扱う 工程数 × 点数 の上限 (工程ごとの中間配列のメモリを抑える)
+_CHUNK_ELEMENTS = 1 << 18
+
+###################################################################################
+# 総設備投資額
+def total_capex(process_instances):
+    """
+    process_instances: calculate_chain_batch の戻り値の {'工程名': ProcessCost, ...}
+    戻り値: Σ 装置単価 × 装置台数 [yen] (配列の場合は要素ごと)
+    """
+    return sum(process.unit_cost * process.num_of_units for process in process_instances.values())
+
+###################################################################################
+# 非劣解の判定
+def _minimization_points(cost, production, capex=None):
+    # すべての目的を「小さいほど良い」にそろえた (N, 目的数) の配列
+    columns = [np.asarray(cost, dtype=float).ravel(), -np.asarray(production, dtype=float).ravel()]
+    if capex is not None:
+        columns.append(np.asarray(capex, dtype=float).ravel())
+    return np.column_stack(columns)
+
+def _front_2d(points):
+    """
+    points: 重複がなく、辞書式順にソート済みの (N, 2) の配列。非劣解なら True のマスクを返す。
+    ある点を支配しうるのは前にある点だけなので、それまでの2列目の最小値と比べるだけで判定できる。
+    """
+    second = points[:, 1]
+    mask = np.ones(len(points), dtype=bool)
+    mask[1:] = np.minimum.accumulate(second)[:-1] > second[1:]
+    return mask
+
+def _dominated_2d(targets, front):
+    """
+    targets, front: (N, 2) の配列
+    front の中に「両方の列で targets の点以下」の点があれば True。
+    front を1列目の昇順に並べて2列目の累積最小値を作り、二分探索で調べる。
+    """
+    if len(front) == 0:
+        return np.zeros(len(targets), dtype=bool)
+    order = np.argsort(front[:, 0], kind='stable')
+    first = front[order, 0]
+    prefix_min = np.minimum.accumulate(front[order, 1])
+    position = np.searchsorted(first, targets[:, 0], side='right')
+    dominated = position > 0
+    dominated[dominated] = prefix_min[position[dominated] - 1] <= targets[dominated, 1]
+    return dominated
+
+def _front_3d(points):
+    """
+    points: 重複がなく、辞書式順にソート済みの (N, 3) の配列。非劣解なら True のマスクを返す。
+    前にある点は1列目が同じか小さいので、前の点が後の点を支配するかは残り2列の比較だけで決まる。
+    前半・後半をそれぞれ解いたあと、後半の非劣解のうち前半の非劣解に支配されるものを除く。
+    """
+    n = len(points)
+    if n <= _LEAF_SIZE:
+        rest = points[:, 1:]
+        no_worse = (rest[None, :, :] <= rest[:, None, :]).all(axis=2)
+        earlier = np.arange(n)[None, :] < np.arange(n)[:, None]
+        return ~(no_worse & earlier).any(axis=1)
+    mid = n // 2
+    left = _front_3d(points[:mid])
+    right = _front_3d(points[mid:])
+    candidates = np.flatnonzero(right)
+    right[candidates[_dominated_2d(points[mid:][candidates, 1:], points[:mid][left, 1:])]] = False
+    return np.concatenate([left, right])
+
+def _prefilter(points):
+    """
+    分割統治の前に、明らかに支配される点を間引く。
+    points: 重複がなく、辞書式順にソート済みの (N, 3) の配列
+    戻り値: 残った点のインデックス (非劣解は必ず残る)
+    一部の点だけで求めた非劣解を基準点とし、基準点に支配される点を除く。
+    スイープ結果の大半はここで落ち、以降の判定は残った点だけで済む。
+    """
+    remaining = np.arange(len(points))
+    if len(points) <= _PREFILTER_SAMPLE:
+        return remaining
+    sample = np.sort(np.random.default_rng(0).choice(len(points), _PREFILTER_SAMPLE, replace=False))
+    anchors = sample[_front_3d(points[sample])]
+    # 多くの点を支配しそうな (正規化した目的の和が小さい) 基準点から順に使う
+    low = points.min(axis=0)
+    scale = points.max(axis=0) - low
+    scale[scale == 0] = 1.0
+    anchors = anchors[np.argsort(((points[anchors] - low) / scale).sum(axis=1))][:_PREFILTER_ANCHORS]
+
+    for anchor in anchors:
+        # 重複点はまとめてあるので、すべての列で以下なら(自分自身を除いて)支配されている
+        dominated = (points[anchor] <= points[remaining]).all(axis=1) & (remaining != anchor)
+        remaining = remaining[~dominated]
+    return remaining
+
+def pareto_mask(cost, production, capex=None):
+    """
+    cost: 100mmウエハ単価の配列 (小さいほど良い)
+    production: 100mmウエハ年間生産数量の配列 (大きいほど良い)
+    capex: 総設備投資額の配列 (小さいほど良い)。None のときは2目的で判定する
+    戻り値: 非劣解なら True のマスク。NaN・無限大を含む点は False。
+            まったく同じ値の点が複数ある場合はすべて True とする。
+    """
+    points = _minimization_points(cost, production, capex)
+    mask = np.zeros(len(points), dtype=bool)
+    finite = np.flatnonzero(np.isfinite(points).all(axis=1))
+    if len(finite) == 0:
+        return mask
+
+    # 辞書式順に並べ、重複点を1つにまとめてから判定し、結果を元の点に戻す
+    order = finite[np.lexsort(points[finite].T[::-1])]
+    sorted_points = points[order]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (sorted_points[1:] != sorted_points[:-1]).any(axis=1)
+    unique_points = sorted_points[new_group]
+    if unique_points.shape[1] == 2:
+        unique_mask = _front_2d(unique_points)
+    else:
+        unique_mask = np.zeros(len(unique_points), dtype=bool)
+        survivors = _prefilter(unique_points)
+        unique_mask[survivors] = _front_3d(unique_points[survivors])
+    mask[order] = unique_mask[np.cumsum(new_group) - 1]
+    return mask
+
+def pareto_frame(frame, use_capex=True):
+    """
+    frame: 列 wafer_cost, wafer_production (, capex) を持つ DataFrame
+    戻り値: 非劣解の行だけを 100mmウエハ年間生産数量の昇順に並べた DataFrame
+    """
+    capex = frame['capex'] if use_capex and 'capex' in frame else None
+    mask = pareto_mask(frame['wafer_cost'], frame['wafer_production'], capex)
+    return frame[mask].sort_values('wafer_production')
+
+###################################################################################
+# ランダムスイープ
+def sample_values(rng, current, param_name, spread, size):
+    """
+    現在値 current の ±spread の範囲の一様乱数を size 個返す (整数パラメータは 1 以上の整数)
+    """
+    if param_name in INTEGER_PARAMETERS:
+        low = max(1, int(np.floor(current * (1 - spread))))
+        high = max(low, int(np.ceil(current * (1 + spread))))
+        return rng.integers(low, high + 1, size=size).astype(float)
+    values = rng.uniform(current * (1 - spread), current * (1 + spread), size=size)
+    if param_name == 'yield_rate':
+        values = np.clip(values, 0.1, 100.0)
+    return values
+
+def sweep_frontier(processes_input, metadata, param_names, n_samples, spread=0.2, seed=0,
+                   scenario='standard', chunk_size=None, background_size=BACKGROUND_SIZE):
+    """
+    全工程の param_names を現在値 ±spread の範囲で一様乱数で振り、n_samples 点の
+    (100mmウエハ単価, 100mmウエハ年間生産数量, 総設備投資額) の非劣解を求める。
+
+    戻り値: (frontier, background)
+      frontier: 非劣解の DataFrame
+        列: wafer_cost, wafer_production, capex, ('工程名', 'パラメータ名') ごとの値
+      background: 表示用に間引いたスイープ結果の DataFrame (列: wafer_cost, wafer_production, capex)
+    chunk_size: 1回に計算する点数 (None のときは工程数から決める)
+    """
+    if chunk_size is None:
+        chunk_size = max(1000, _CHUNK_ELEMENTS // max(len(processes_input), 1))
+    rng = np.random.default_rng(seed)
+    keys = [(process_name, param_name) for process_name in processes_input for param_name in param_names]
+
+    # 非劣解の (単価, 生産数量, 総設備投資額) と、そのときのパラメータ値 (列の並びは keys)
+    frontier_objectives = np.empty((0, 3))
+    frontier_values = np.empty((0, len(keys)))
+    background = []
+    for start in range(0, n_samples, chunk_size):
+        size = min(chunk_size, n_samples - start)
+        values = np.column_stack([
+            sample_values(rng, float(processes_input[process_name][scenario][param_name]), param_name, spread, size)
+            for process_name, param_name in keys
+        ]) if keys else np.empty((size, 0))
+        overrides = {key: values[:, j] for j, key in enumerate(keys)}
+        wafer_cost, wafer_production, instances = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+        objectives = np.column_stack([
+            np.broadcast_to(wafer_cost, size),
+            np.broadcast_to(wafer_production, size),
+            np.broadcast_to(total_capex(instances), size),
+        ])
+
+        # これまでの非劣解とこのチャンクを合わせて、非劣解だけを残す
+        merged_objectives = np.vstack([frontier_objectives, objectives])
+        merged_values = np.vstack([frontier_values, values])
+        mask = pareto_mask(merged_objectives[:, 0], merged_objectives[:, 1], merged_objectives[:, 2])
+        frontier_objectives = merged_objectives[mask]
+        frontier_values = merged_values[mask]
+
+        keep = int(np.ceil(background_size * size / n_samples))
+        background.append(objectives[rng.permutation(size)[:keep]])
+
+    columns = ['wafer_cost', 'wafer_production', 'capex']
+    frontier = pd.concat([
+        pd.DataFrame(frontier_objectives, columns=columns),
+        pd.DataFrame(frontier_values, columns=pd.Index(keys, tupleize_cols=False)),
+    ], axis=1)
+    background = pd.DataFrame(np.vstack(background) if background else np.empty((0, 3)), columns=columns)
+    return frontier.sort_values('wafer_production').reset_index(drop=True), background
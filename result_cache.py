@@ -0,0 +1,167 @@
+# セッション間で共有する計算結果キャッシュ
+# 2026/10/19
+#
+# 同じ標準シナリオのワークブックを多くの利用者がアップロードするため、
+# ワークブックの内容ハッシュ・計算エンジンのバージョン(・品種)をキーに、
+# 読み込み済みパラメータ・工程チェーンの計算結果・作成済みのグラフをプロセス全体で共有する。
+# 使用メモリの上限(バイト数)を超えたら、最も長く使われていないものから捨てる (LRU)。
+#
+# キャッシュした値は全セッションで共有されるので、取り出した側で変更しないこと。
+
+import io
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from cost_engine import ENGINE_VERSION, PROCESS_MEMO, evaluate_workbooks, read_parameters
+from result_store import workbook_hash
+
+# 使用メモリの上限 (環境変数 COST_SIMULATOR_CACHE_MB で変更できる)
+CACHE_MAX_BYTES = int(os.environ.get('COST_SIMULATOR_CACHE_MB', '256')) * 1024 * 1024
+
+###################################################################################
+# LRU キャッシュ
+def _estimate_size(value):
+    # pickle したときの大きさを使用メモリの目安とする
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+class ResultCache:
+    """
+    スレッドセーフな LRU キャッシュ。値の大きさの合計が max_bytes を超えないように古いものから捨てる
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        値を登録する。大きさが測れないもの・上限を超える大きさのものは登録しない
+        """
+        if size is None:
+            size = _estimate_size(value)
+        if size is None or size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+# プロセス全体で1つのキャッシュを共有する
+_cache = ResultCache(CACHE_MAX_BYTES)
+
+def get_cache():
+    return _cache
+
+def make_key(kind, *parts):
+    """
+    キャッシュのキー (種類, 計算エンジンのバージョン, ...) を作る
+    """
+    return (kind, ENGINE_VERSION) + tuple(parts)
+
+def log_stats(label):
+    """
+    ヒット・ミスの回数などを simulation.log に出力し、その辞書を返す
+    """
+    stats = _cache.stats()
+    logging.info(
+        "result cache (%s): hits=%d misses=%d hit_rate=%.2f entries=%d bytes=%d/%d evictions=%d",
+        label, stats['hits'], stats['misses'], stats['hit_rate'], stats['entries'],
+        stats['bytes'], stats['max_bytes'], stats['evictions']
+    )
+    memo = PROCESS_MEMO.stats()
+    logging.info(
+        "process memo (%s): hits=%d misses=%d hit_rate=%.2f entries=%d/%d evictions=%d",
+        label, memo['hits'], memo['misses'], memo['hit_rate'], memo['entries'], memo['max_entries'], memo['evictions']
+    )
+    return stats
+
+###################################################################################
+# ワークブック読み込み・計算結果のキャッシュ
+def evaluate_workbooks_cached(file_bytes_list, scenario='standard'):
+    """
+    evaluate_workbooks のキャッシュ付き版。キャッシュにないワークブックだけをワーカーで計算する。
+    キーはワークブックの内容ハッシュと計算エンジンのバージョン
+    (読み込み・計算結果は品種によらないので品種はキーに含めない)。
+    キャッシュから返した結果の (読み込み時間, 計算時間) は (0, 0) とする。
+
+    戻り値: (evaluate_workbooks と同じ結果のリスト, ヒットした件数)
+    """
+    keys = [make_key('evaluate_workbook', workbook_hash(file_bytes), scenario) for file_bytes in file_bytes_list]
+    results = []
+    for key in keys:
+        cached = _cache.get(key)
+        results.append(None if cached is None else cached[:-1] + ((0.0, 0.0),))
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    if missing:
+        computed = evaluate_workbooks([file_bytes_list[i] for i in missing], scenario)
+        for i, result in zip(missing, computed):
+            _cache.put(keys[i], result)
+            results[i] = result
+    return results, len(keys) - len(missing)
+
+def read_parameters_cached(file_bytes):
+    """
+    read_parameters のキャッシュ付き版。戻り値: (metadata, process_input)
+    同じワークブックを evaluate_workbooks_cached で計算済みであれば、その読み込み結果をそのまま使う。
+    戻り値は全セッションで共有するので変更しないこと (calculate_chain_batch など入力を変更しない関数に渡す)
+    """
+    digest = workbook_hash(file_bytes)
+    evaluated = _cache.get(make_key('evaluate_workbook', digest, 'standard'))
+    if evaluated is not None:
+        return evaluated[0], evaluated[1]
+    return _cache.get_or_compute(
+        make_key('read_parameters', digest), lambda: read_parameters(io.BytesIO(file_bytes))
+    )
@@ -0,0 +1,259 @@
+# 計算結果のファイル出力モジュール
+# 2026/10/19
+#
+# 表示用の文字列整形済みコピーは作らず、計算結果の辞書から1行ずつ書き出す。
+# Excel は openpyxl の write_only モード(行を逐次書き出すため使用メモリが一定)を使う。
+
+import csv
+import io
+import pickle
+import re
+import tempfile
+import zipfile
+
+import translation_mapping as tm # 日本語英語対応外部モジュール
+
+EXPORT_FORMATS = {
+    'xlsx': 'Excel (.xlsx)',
+    'csv': 'CSV (.zip)',
+    'parquet': 'Parquet (.zip)',
+}
+
+MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'application/zip',
+    'parquet': 'application/zip',
+}
+
+# Parquet 書き出し時の行グループサイズ
+_PARQUET_ROW_GROUP = 10000
+
+###################################################################################
+# 出力する表の定義
+def _summary_rows(key_results):
+    columns = list(tm.jpn_eng_dict_summary.keys())
+    yield columns
+    for row in key_results[columns].itertuples(index=False, name=None):
+        yield list(row)
+
+def _scenario_rows(cost_details_by_process):
+    # 工程によって項目が欠けていても列がずれないよう、全工程の項目を集める
+    columns = []
+    for details in cost_details_by_process.values():
+        for key in details:
+            if key not in columns:
+                columns.append(key)
+    yield ['process'] + columns
+    for process_name, details in cost_details_by_process.items():
+        yield [process_name] + [details.get(key) for key in columns]
+
+def _input_rows(all_process_inputs, all_metadata):
+    yield ['scenario', 'process', 'parameter', 'standard', 'best', 'worst']
+    for scenario_name, process_input in all_process_inputs.items():
+        metadata = all_metadata.get(scenario_name, {})
+        for name, value in metadata.items():
+            yield [scenario_name, '__Metadata', name, value, value, value]
+        for process_name, cases in process_input.items():
+            standard = cases.get('standard', {})
+            best = cases.get('best', {})
+            worst = cases.get('worst', {})
+            for name in standard:
+                # calculate_total_cost_by_scenario でメタデータが追記されるため除外
+                if name in metadata:
+                    continue
+                yield [scenario_name, process_name, name, standard.get(name), best.get(name), worst.get(name)]
+
+def _translation_rows(product_choice):
+    yield ['key', 'label']
+    if product_choice == "基板":
+        dict_for_label = tm.jpn_eng_dict_subs_process
+    else:
+        dict_for_label = tm.jpn_eng_dict_epi_process
+    for mapping in (tm.jpn_eng_dict_summary, tm.jpn_eng_dict, dict_for_label):
+        for key, label in mapping.items():
+            yield [key, label]
+
+def iter_tables(key_results, full_results, all_process_inputs, all_metadata, product_choice):
+    """
+    (表名, 行ジェネレータ) を順に返す。行ジェネレータの1行目はヘッダ。
+    """
+    yield 'summary', _summary_rows(key_results)
+    for scenario_name, cost_details_by_process in full_results.items():
+        yield scenario_name, _scenario_rows(cost_details_by_process)
+    yield 'input_parameters', _input_rows(all_process_inputs, all_metadata)
+    yield 'header_translations', _translation_rows(product_choice)
+
+###################################################################################
+# 表名の整形
+_INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+def _unique_names(names, max_len):
+    used = set()
+    for name in names:
+        base = _INVALID_SHEET_CHARS.sub('_', str(name))[:max_len] or 'sheet'
+        candidate = base
+        i = 1
+        while candidate.lower() in used:
+            suffix = f'_{i}'
+            candidate = base[:max_len - len(suffix)] + suffix
+            i += 1
+        used.add(candidate.lower())
+        yield candidate
+
+def _to_cell(value):
+    # numpy の数値型はそのままでは書き込めない場合があるので Python の型に変換
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+###################################################################################
+# 各形式での書き出し
+def write_xlsx(fileobj, tables):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    tables = list(tables)
+    for sheet_name, (_, rows) in zip(_unique_names([name for name, _ in tables], 31), tables):
+        ws = wb.create_sheet(title=sheet_name)
+        for row in rows:
+            ws.append([_to_cell(v) for v in row])
+    wb.save(fileobj)
+
+def write_csv_zip(fileobj, tables):
+    tables = list(tables)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for file_name, (_, rows) in zip(_unique_names([name for name, _ in tables], 100), tables):
+            with zf.open(f'{file_name}.csv', 'w') as raw:
+                # Excel で開いたときに文字化けしないよう BOM 付き UTF-8
+                text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+                writer = csv.writer(text)
+                for row in rows:
+                    writer.writerow([_to_cell(v) for v in row])
+                text.flush()
+                text.detach()
+
+def write_parquet_zip(fileobj, tables):
+    # pyarrow は Parquet 出力を選んだときだけ必要
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tables = list(tables)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for file_name, (_, rows) in zip(_unique_names([name for name, _ in tables], 100), tables):
+            header = [str(col) for col in next(rows)]
+            # 列の型は全行を見てから決める (行グループごとに推定すると、後の行グループで型が変わったときに
+            # 値が切り捨てられたり書き出しが失敗したりする)。行は一時ファイルに退避してメモリに持たない
+            with tempfile.TemporaryFile() as spool:
+                kinds = _spool_rows(spool, rows, len(header))
+                schema = pa.schema([(name, _PARQUET_TYPES[kind](pa)) for name, kind in zip(header, kinds)])
+                spool.seek(0)
+                with zf.open(f'{file_name}.parquet', 'w') as raw:
+                    with pq.ParquetWriter(raw, schema) as writer:
+                        for chunk in _read_spool(spool):
+                            writer.write_table(_parquet_table(pa, schema, kinds, chunk))
+
+# 列の型 (_spool_rows の判定結果) と pyarrow の型
+#   number: 数値 (int / float) と None だけの列。float64 で保存する
+#   bool: 真偽値と None だけの列
+#   string: 文字列を含む列、型が混在する列、すべて None の列
+_PARQUET_TYPES = {
+    'number': lambda pa: pa.float64(),
+    'bool': lambda pa: pa.bool_(),
+    'string': lambda pa: pa.string(),
+}
+
+def _value_kind(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'number'
+    return 'string'
+
+def _spool_rows(spool, rows, n_columns):
+    """
+    行を _PARQUET_ROW_GROUP 行ずつ spool に pickle で書き出し、列ごとの型 ('number', 'bool', 'string') を返す
+    """
+    seen = [set() for _ in range(n_columns)]
+    chunk = []
+    for row in rows:
+        row = [_to_cell(v) for v in row]
+        for kinds, value in zip(seen, row):
+            kinds.add(_value_kind(value))
+        chunk.append(row)
+        if len(chunk) >= _PARQUET_ROW_GROUP:
+            pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+            chunk = []
+    if chunk:
+        pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+    result = []
+    for kinds in seen:
+        kinds.discard(None)
+        result.append(kinds.pop() if len(kinds) == 1 else 'string')
+    return result
+
+def _read_spool(spool):
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+def _parquet_table(pa, schema, kinds, chunk):
+    arrays = []
+    for field, kind, values in zip(schema, kinds, zip(*chunk)):
+        if kind == 'string':
+            values = [None if v is None else str(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+_WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv_zip,
+    'parquet': write_parquet_zip,
+}
+
+###################################################################################
+# 出力ファイルの作成
+def export_available(export_format):
+    """
+    指定形式で出力できるか (Parquet は pyarrow が必要)
+    """
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return False
+    return True
+
+def export_file_name(export_format):
+    """
+    (ファイル名, MIMEタイプ) を返す
+    """
+    extension = 'xlsx' if export_format == 'xlsx' else 'zip'
+    return f'cost_simulation_results.{extension}', MIME_TYPES[export_format]
+
+def export_results(key_results, full_results, all_process_inputs, all_metadata, product_choice, export_format='xlsx'):
+    """
+    計算結果を指定形式で一時ファイルに書き出し、先頭に戻した一時ファイルを返す。
+    ファイル内容はメモリに読み込まない (一時ファイルは閉じたときに削除される)。
+
+    key_results: run_simulation のサマリー DataFrame
+    full_results: {'シナリオ名': {'工程名': {...}, ...}, ...}
+    all_process_inputs: {'シナリオ名': {'工程名': {'standard': {...}, 'best': {...}, 'worst': {...}}, ...}, ...}
+    all_metadata: {'シナリオ名': {...}, ...}
+    export_format: 'xlsx', 'csv' or 'parquet'
+    """
+    writer = _WRITERS[export_format]
+    tables = iter_tables(key_results, full_results, all_process_inputs, all_metadata, product_choice)
+
+    # 書き出し中の中間データも出力ファイルもメモリではなく一時ファイルに置く
+    tmp = tempfile.TemporaryFile()
+    try:
+        writer(tmp, tables)
+    except BaseException:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return tmp
@@ -0,0 +1,266 @@
+# 計算結果のSQLite保存・履歴検索モジュール
+# 2026/10/19
+
+import sqlite3
+import hashlib
+from datetime import datetime
+
+import pandas as pd
+
+from cost_engine import SUMMARY_COLUMNS # サマリー(key_results)のうちDBに保存する列
+
+# 保存先DBファイル (simulation.log と同じくカレントディレクトリに作成)
+DB_PATH = 'simulation_results.db'
+
+# テーブル定義
+# runs: 1回の「計算実行」, scenarios: 1ファイル(シナリオ)分のサマリー,
+# metadata_values / process_inputs / process_outputs: 縦持ちの明細
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at  TEXT NOT NULL,
+    product     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scenarios (
+    scenario_id    INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id         INTEGER NOT NULL REFERENCES runs(run_id),
+    created_at     TEXT NOT NULL,
+    product        TEXT NOT NULL,
+    scenario       TEXT NOT NULL,
+    file_name      TEXT,
+    workbook_hash  TEXT NOT NULL,
+    {', '.join(f'{col} REAL' for col in SUMMARY_COLUMNS)}
+);
+CREATE TABLE IF NOT EXISTS metadata_values (
+    scenario_id  INTEGER NOT NULL REFERENCES scenarios(scenario_id),
+    parameter    TEXT NOT NULL,
+    value
+);
+CREATE TABLE IF NOT EXISTS process_inputs (
+    scenario_id    INTEGER NOT NULL REFERENCES scenarios(scenario_id),
+    process        TEXT NOT NULL,
+    process_order  INTEGER NOT NULL,
+    case_name      TEXT NOT NULL,
+    parameter      TEXT NOT NULL,
+    value
+);
+CREATE TABLE IF NOT EXISTS process_outputs (
+    scenario_id    INTEGER NOT NULL REFERENCES scenarios(scenario_id),
+    process        TEXT NOT NULL,
+    process_order  INTEGER NOT NULL,
+    metric         TEXT NOT NULL,
+    value          REAL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_created_at ON runs(created_at);
+CREATE INDEX IF NOT EXISTS idx_scenarios_scenario ON scenarios(scenario, product, created_at);
+CREATE INDEX IF NOT EXISTS idx_scenarios_product ON scenarios(product, created_at);
+CREATE INDEX IF NOT EXISTS idx_scenarios_created_at ON scenarios(created_at);
+CREATE INDEX IF NOT EXISTS idx_scenarios_hash ON scenarios(workbook_hash);
+CREATE INDEX IF NOT EXISTS idx_metadata_scenario ON metadata_values(scenario_id);
+CREATE INDEX IF NOT EXISTS idx_inputs_scenario ON process_inputs(scenario_id, process);
+CREATE INDEX IF NOT EXISTS idx_inputs_process ON process_inputs(process, parameter);
+CREATE INDEX IF NOT EXISTS idx_outputs_scenario ON process_outputs(scenario_id, process);
+CREATE INDEX IF NOT EXISTS idx_outputs_process ON process_outputs(process, metric);
+"""
+
+###################################################################################
+# 接続
+def connect(db_path=DB_PATH):
+    """
+    DBに接続し、テーブルが無ければ作成する。
+    複数ユーザーの同時アクセスを想定して WAL モードで開く。
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(_SCHEMA)
+    return conn
+
+###################################################################################
+# ワークブックのハッシュ値
+def workbook_hash(file_obj):
+    """
+    file_obj: Streamlit の UploadedFile、ファイルパス(str) またはファイル内容(bytes)
+    ファイル内容の SHA-256 を返す
+    """
+    if isinstance(file_obj, bytes):
+        data = file_obj
+    elif isinstance(file_obj, str):
+        with open(file_obj, 'rb') as f:
+            data = f.read()
+    else:
+        data = file_obj.getvalue()
+    return hashlib.sha256(data).hexdigest()
+
+def _to_sql_value(value):
+    # numpy の数値型はそのままでは保存できないので float に変換
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None if value is None else str(value)
+
+###################################################################################
+# 計算結果の保存
+def _insert_scenario(conn, run_id, created_at, product_choice, record):
+    summary = record['summary']
+    cur = conn.execute(
+        f"INSERT INTO scenarios (run_id, created_at, product, scenario, file_name, workbook_hash, "
+        f"{', '.join(SUMMARY_COLUMNS)}) VALUES ({', '.join(['?'] * (6 + len(SUMMARY_COLUMNS)))})",
+        (run_id, created_at, product_choice, record['scenario'], record.get('file_name'),
+         record['workbook_hash'], *[_to_sql_value(summary.get(col)) for col in SUMMARY_COLUMNS])
+    )
+    scenario_id = cur.lastrowid
+    metadata = record.get('metadata') or {}
+
+    conn.executemany(
+        'INSERT INTO metadata_values (scenario_id, parameter, value) VALUES (?, ?, ?)',
+        [(scenario_id, name, _to_sql_value(value)) for name, value in metadata.items()]
+    )
+    # calculate_total_cost_by_scenario でメタデータが工程パラメータに追記されるため除外する
+    conn.executemany(
+        'INSERT INTO process_inputs (scenario_id, process, process_order, case_name, parameter, value) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (scenario_id, process_name, order, case_name, name, _to_sql_value(value))
+            for order, (process_name, cases) in enumerate((record.get('process_input') or {}).items())
+            for case_name, params in cases.items()
+            for name, value in params.items()
+            if name not in metadata
+        ]
+    )
+    conn.executemany(
+        'INSERT INTO process_outputs (scenario_id, process, process_order, metric, value) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [
+            (scenario_id, process_name, order, metric, _to_sql_value(value))
+            for order, (process_name, details) in enumerate((record.get('cost_details_by_process') or {}).items())
+            for metric, value in details.items()
+        ]
+    )
+
+def save_run(product_choice, scenario_records, db_path=DB_PATH, commit_every=None):
+    """
+    product_choice: "基板" or "エピ"
+    scenario_records: [
+        {
+            'scenario': シナリオ名,
+            'file_name': ファイル名,
+            'workbook_hash': ファイル内容のハッシュ,
+            'summary': {'wafer_cost': ..., 'wafer_production': ..., ...},
+            'metadata': {...},
+            'process_input': {'工程名': {'standard': {...}, 'best': {...}, 'worst': {...}}, ...},
+            'cost_details_by_process': {'工程名': {...}, ...},
+        },
+        ...
+    ]
+    (metadata / process_input / cost_details_by_process は省略可。ジェネレータも可)
+
+    1回の計算実行分をまとめて1トランザクションで保存し、run_id を返す。
+    commit_every を指定すると、その件数ごとにコミットする (計算しながら逐次保存する場合に、
+    書き込みロックを長時間保持しないため)
+    """
+    created_at = datetime.now().isoformat(timespec='seconds')
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            'INSERT INTO runs (created_at, product) VALUES (?, ?)',
+            (created_at, product_choice)
+        )
+        run_id = cur.lastrowid
+
+        for i, record in enumerate(scenario_records, start=1):
+            _insert_scenario(conn, run_id, created_at, product_choice, record)
+            if commit_every and i % commit_every == 0:
+                conn.commit()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return run_id
+
+###################################################################################
+# 履歴検索
+def list_scenarios(product_choice=None, db_path=DB_PATH):
+    """
+    保存済みのシナリオ名一覧(最終実行日時の新しい順)
+    """
+    conn = connect(db_path)
+    try:
+        if product_choice is None:
+            rows = conn.execute(
+                'SELECT scenario, MAX(created_at) AS last FROM scenarios GROUP BY scenario ORDER BY last DESC'
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT scenario, MAX(created_at) AS last FROM scenarios WHERE product = ? '
+                'GROUP BY scenario ORDER BY last DESC',
+                (product_choice,)
+            ).fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
+
+def query_wafer_cost_trend(scenario, product_choice=None, db_path=DB_PATH):
+    """
+    指定シナリオの100mmウエハ単価・生産数量の推移を DataFrame で返す
+    列: run_id, created_at, product, workbook_hash, wafer_cost, wafer_production, ...
+    """
+    sql = (
+        f"SELECT run_id, created_at, product, file_name, workbook_hash, {', '.join(SUMMARY_COLUMNS)} "
+        "FROM scenarios WHERE scenario = ?"
+    )
+    params = [scenario]
+    if product_choice is not None:
+        sql += ' AND product = ?'
+        params.append(product_choice)
+    sql += ' ORDER BY created_at'
+
+    conn = connect(db_path)
+    try:
+        df = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+    return df
+
+def query_process_output_trend(scenario, process, metric, product_choice=None, db_path=DB_PATH):
+    """
+    指定シナリオ・工程の出力項目(例: unit_product_cost)の推移を DataFrame で返す
+    """
+    sql = (
+        'SELECT s.run_id, s.created_at, s.workbook_hash, o.value '
+        'FROM scenarios s JOIN process_outputs o ON o.scenario_id = s.scenario_id '
+        'WHERE s.scenario = ? AND o.process = ? AND o.metric = ?'
+    )
+    params = [scenario, process, metric]
+    if product_choice is not None:
+        sql += ' AND s.product = ?'
+        params.append(product_choice)
+    sql += ' ORDER BY s.created_at'
+
+    conn = connect(db_path)
+    try:
+        df = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+    return df
+
+def load_scenario_outputs(run_id, scenario, db_path=DB_PATH):
+    """
+    過去の1シナリオ分の工程別出力を (行=工程, 列=出力項目) の DataFrame で復元する
+    """
+    conn = connect(db_path)
+    try:
+        df = pd.read_sql_query(
+            'SELECT o.process, o.process_order, o.metric, o.value '
+            'FROM scenarios s JOIN process_outputs o ON o.scenario_id = s.scenario_id '
+            'WHERE s.run_id = ? AND s.scenario = ?',
+            conn, params=[run_id, scenario]
+        )
+    finally:
+        conn.close()
+    if df.empty:
+        return df
+    wide = df.pivot_table(index=['process_order', 'process'], columns='metric', values='value', sort=False)
+    return wide.sort_index(level='process_order').droplevel('process_order')
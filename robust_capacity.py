@@ -0,0 +1,209 @@
+# 不確かさを考慮した装置台数の最適化 (共通乱数による確率的最適化)
+# 2026/10/19
+#
+# standard の値だけで決めた装置台数は、worst 側に振れたときにボトルネックになりやすい。
+# 各工程のパラメータを (best, standard, worst) の三角分布で振った D 通りの引き (draw) を最初に1回だけ作り、
+# すべての候補の台数計画をこの同じ引きで評価する (共通乱数。候補どうしの差に引きのばらつきが混ざらない)。
+# 候補 C 個 × 引き D 個は、台数を (C, 1)、振るパラメータを (1, D) の配列として calculate_chain_batch に渡し、
+# ブロードキャストで一括計算する。
+#
+# 探索は整数の台数計画のビームサーチ:
+#   1. ビーム中の各計画から、1工程の台数を ±1 (台数が多い工程は ±台数の1/4 も) 変えた近傍を作る
+#   2. 近傍をまとめて全引きで評価する (評価済みの計画は再計算しない)
+#   3. 引きごとの単価のベクトルで比べ、他の計画以下 (すべての引きで同じか安く、どこかで安い) の計画は
+#      期待値でも P90 でも最適になりえないので枝刈りする
+#   4. 残った計画を目的 (期待値 または P90) の小さい順に beam_width 個だけ次のビームにする
+#   5. ビームの先頭の計画について、単独で目的が改善した工程ごとの変更をすべて合わせた計画を次の候補に加える
+#      (1工程ずつ動かすより少ない反復で台数の大きな見直しに届く)
+#   目的が改善しなくなったら止める。
+
+import numpy as np
+import pandas as pd
+
+import sensitivity
+import uncertainty
+from cost_engine import calculate_chain_batch
+
+OBJECTIVES = {
+    'mean': '期待値',
+    'p90': 'P90',
+}
+# 1回の一括計算で扱う 工程数 × 候補数 × 引きの数 の上限
+_CHUNK_ELEMENTS = 1 << 21
+
+###################################################################################
+# 共通乱数の引き
+def sample_draws(processes_input, metadata, n_draws=256, method='halton', seed=0):
+    """
+    装置台数以外で best / standard / worst の値が異なるパラメータを三角分布で振った引きを作る
+    戻り値: (keys, draws)
+      keys: [('工程名', 'パラメータ名'), ...]
+      draws: (n_draws, len(keys)) のパラメータ値
+    """
+    keys = [key for key in sensitivity.varying_parameters(processes_input, metadata) if key[1] != 'num_of_units']
+    if not keys:
+        return keys, np.empty((n_draws, 0))
+    bounds = uncertainty.triangular_bounds(processes_input, keys)
+    sampler, _ = uncertainty.make_sampler(method, len(keys), seed)
+    u = sampler.random(n_draws)[:, uncertainty.dimension_order_by_width(bounds)]
+    return keys, uncertainty.parameter_values(u, bounds, keys)
+
+def evaluate_plans(processes_input, metadata, plans, keys, draws, scenario='standard'):
+    """
+    plans: (C, 工程数) の台数計画 (列は processes_input の工程順)
+    戻り値: (C, D) の100mmウエハ単価 (計算できない組み合わせは inf)
+    """
+    plans = np.asarray(plans, dtype=float)
+    process_names = list(processes_input)
+    n_draws = len(draws)
+    costs = np.empty((len(plans), n_draws))
+    draw_overrides = {key: draws[None, :, j] for j, key in enumerate(keys)}
+    rows = max(1, _CHUNK_ELEMENTS // max(n_draws * len(process_names), 1))
+    for start in range(0, len(plans), rows):
+        stop = min(start + rows, len(plans))
+        overrides = dict(draw_overrides)
+        for p, process_name in enumerate(process_names):
+            overrides[(process_name, 'num_of_units')] = plans[start:stop, p, None]
+        wafer_cost, _, _ = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+        costs[start:stop] = np.broadcast_to(wafer_cost, (stop - start, n_draws))
+    costs[~np.isfinite(costs)] = np.inf
+    return costs
+
+def objective_values(costs, objective='mean'):
+    """
+    costs: (C, D) の引きごとの単価。戻り値: 候補ごとの目的の値 (C,)
+    """
+    if objective == 'mean':
+        with np.errstate(invalid='ignore'):
+            return np.mean(costs, axis=1)
+    if objective == 'p90':
+        return np.quantile(costs, 0.9, axis=1)
+    raise ValueError(f'unknown objective: {objective}')
+
+def dominated_mask(costs):
+    """
+    costs: (C, D)。他のいずれかの候補に、すべての引きで同じか高く、どこかの引きで高い候補を True とする
+    (同じ値の候補どうしは互いに枝刈りしない)
+    """
+    dominated = np.zeros(len(costs), dtype=bool)
+    for i in range(len(costs)):
+        not_worse = np.all(costs[i] <= costs, axis=1)
+        better = np.any(costs[i] < costs, axis=1)
+        dominated |= not_worse & better
+    return dominated
+
+###################################################################################
+# ビームサーチ
+def _combined_move(plan, candidates, values):
+    # plan から1工程だけ変えた候補のうち目的が改善したものについて、工程ごとに最も良い変更を合わせた計画
+    best_changes = {}
+    for candidate in candidates:
+        changed = [p for p, (a, b) in enumerate(zip(plan, candidate)) if a != b]
+        if len(changed) != 1 or not values[candidate] < values[plan]:
+            continue
+        p = changed[0]
+        if p not in best_changes or values[candidate] < values[best_changes[p]]:
+            best_changes[p] = candidate
+    if len(best_changes) < 2:
+        return None
+    combined = list(plan)
+    for p, candidate in best_changes.items():
+        combined[p] = candidate[p]
+    return tuple(combined)
+
+def _neighbours(plan):
+    # 1工程の台数を ±1、台数が多い工程は ±台数の1/4 も変えた計画
+    for p, units in enumerate(plan):
+        steps = {1, max(1, units // 4)}
+        for step in steps:
+            for delta in (-step, step):
+                if units + delta >= 1:
+                    yield plan[:p] + (units + delta,) + plan[p + 1:]
+
+def optimize_units(processes_input, metadata, objective='mean', n_draws=256, beam_width=3, max_iterations=50,
+                   method='halton', seed=0, scenario='standard'):
+    """
+    装置台数 (工程ごとの整数) を、共通の引きでの100mmウエハ単価の期待値 または P90 が最小になるように探索する。
+    ワークブックの standard の台数から探索を始める。
+
+    戻り値: {
+        'plan': {'工程名': 台数} (最適化後),
+        'initial_plan': {'工程名': 台数} (ワークブックの台数),
+        'objective': 最適化後の目的の値,
+        'initial_objective': ワークブックの台数での目的の値,
+        'costs': 最適化後の引きごとの単価 (D,),
+        'initial_costs': ワークブックの台数での引きごとの単価 (D,),
+        'history': 反復ごとの DataFrame (列: iteration, candidates, pruned, best_objective),
+        'plans_evaluated': 評価した計画の数,
+        'evaluations': チェーンの評価回数 (計画数 × 引きの数),
+        'draws': 引きの数, 'parameters': 振ったパラメータの数,
+    }
+    """
+    process_names = list(processes_input)
+    keys, draws = sample_draws(processes_input, metadata, n_draws, method, seed)
+    initial = tuple(max(1, int(round(float(processes_input[process_name][scenario]['num_of_units']))))
+                    for process_name in process_names)
+
+    evaluated = {initial: evaluate_plans(processes_input, metadata, [initial], keys, draws, scenario)[0]}
+    values = {initial: objective_values(evaluated[initial][None, :], objective)[0]}
+    beam = [initial]
+    best = initial
+    combined = None
+    history = []
+    for iteration in range(1, max_iterations + 1):
+        candidates = list(dict.fromkeys(
+            [combined] * (combined is not None)
+            + [neighbour for plan in beam for neighbour in _neighbours(plan)]
+        ))
+        candidates = [plan for plan in candidates if plan not in evaluated]
+        if not candidates:
+            break
+        costs = evaluate_plans(processes_input, metadata, candidates, keys, draws, scenario)
+        for plan, cost, value in zip(candidates, costs, objective_values(costs, objective)):
+            evaluated[plan] = cost
+            values[plan] = value
+
+        # ビームと新しい候補のうち、引きの上で他に劣るものを枝刈りする
+        combined = _combined_move(beam[0], candidates, values)
+        pool = beam + candidates
+        dominated = dominated_mask(np.array([evaluated[plan] for plan in pool]))
+        pruned = int(dominated[len(beam):].sum())
+        survivors = sorted((plan for plan, is_dominated in zip(pool, dominated) if not is_dominated), key=values.get)
+        beam = survivors[:beam_width]
+        history.append({
+            'iteration': iteration,
+            'candidates': len(candidates),
+            'pruned': pruned,
+            'best_objective': values[beam[0]],
+        })
+        if values[beam[0]] >= values[best]:
+            break
+        best = beam[0]
+
+    return {
+        'plan': dict(zip(process_names, best)),
+        'initial_plan': dict(zip(process_names, initial)),
+        'objective': values[best],
+        'initial_objective': values[initial],
+        'costs': evaluated[best],
+        'initial_costs': evaluated[initial],
+        'history': pd.DataFrame(history, columns=['iteration', 'candidates', 'pruned', 'best_objective']),
+        'plans_evaluated': len(evaluated),
+        'evaluations': len(evaluated) * len(draws),
+        'draws': len(draws),
+        'parameters': len(keys),
+    }
+
+def compare_plans(processes_input, metadata, plans):
+    """
+    plans: {'計画名': {'工程名': 台数}}
+    各計画の台数で best / standard / worst の各列を計算した100mmウエハ単価の DataFrame (index は計画名)
+    """
+    rows = {}
+    for name, plan in plans.items():
+        overrides = {(process_name, 'num_of_units'): units for process_name, units in plan.items()}
+        rows[name] = {
+            case: float(calculate_chain_batch(processes_input, metadata, case, overrides)[0])
+            for case in ('best', 'standard', 'worst')
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
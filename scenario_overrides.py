@@ -0,0 +1,214 @@
+# 差分シナリオファイル (ベースのワークブックに対する上書き)
+# 2026/10/19
+#
+# ベースのワークブックとの違いが数セルしかないシナリオを、27シートのワークブックを丸ごと複製する代わりに
+# 小さな差分ファイル (YAML / JSON / CSV) で表す。ベースのワークブックは1回だけ読み込み、
+# 差分ファイルは「工程名.パラメータ名 = 値」だけを読むので、アップロード・読み込みの時間は差分の大きさで決まる。
+#
+# 差分ファイルの書き方
+#   JSON / YAML : {"proc_10.yield_rate": 95, "proc_3": {"num_of_units": 4}, "__Metadata.xxx": 1}
+#                 値に {"standard": 95, "best": 97, "worst": 90} のようにケースごとの値も書ける (書いたケースだけ上書き)
+#   CSV         : 列 parameter,value (parameter は 工程名.パラメータ名) または process,parameter,value。
+#                 case 列 (standard / best / worst) を付けるとそのケースだけを上書きする
+#   工程名はシート名 ("proc 10") でも read_parameters の工程名 ("proc_10") でもよい。
+#
+# 多数の差分ファイルは、差分ごとに入力パラメータを複製せず、上書きする (工程, パラメータ) ごとに
+# 差分ファイル数の長さの配列を1本作り、calculate_chain_batch で全シナリオを一度に計算する。
+
+import csv
+import io
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from cost_engine import build_key_results, calculate_chain_batch, cost_details_from_batch, process_name_from_sheet
+
+OVERRIDE_FILE_TYPES = ['yaml', 'yml', 'json', 'csv']
+CASES = ('standard', 'best', 'worst')
+_METADATA = '__Metadata'
+
+class OverrideFileError(ValueError):
+    """
+    差分ファイルの書式・内容の誤り
+    """
+
+###################################################################################
+# 差分ファイルの読み込み
+def _split_key(key):
+    process_name, sep, param_name = str(key).strip().rpartition('.')
+    if not sep or not process_name or not param_name:
+        raise OverrideFileError(f"'{key}' must be written as <process>.<parameter>")
+    return process_name.strip(), param_name.strip()
+
+def _to_number(value, where):
+    if isinstance(value, bool):
+        raise OverrideFileError(f'{where}: value must be a number')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise OverrideFileError(f'{where}: value must be a number, got {value!r}') from None
+
+def _entries_from_mapping(data):
+    # JSON / YAML の辞書を [(工程名, パラメータ名, ケース or None, 値), ...] にする
+    if not isinstance(data, dict):
+        raise OverrideFileError('override file must contain a mapping')
+    entries = []
+    for key, value in data.items():
+        if isinstance(value, dict) and not set(value) <= set(CASES):
+            # {"工程名": {"パラメータ名": 値, ...}}
+            for param_name, param_value in value.items():
+                entries.extend(_case_entries(str(key).strip(), str(param_name).strip(), param_value))
+        else:
+            entries.extend(_case_entries(*_split_key(key), value))
+    return entries
+
+def _case_entries(process_name, param_name, value):
+    where = f'{process_name}.{param_name}'
+    if isinstance(value, dict):
+        return [(process_name, param_name, case, _to_number(v, f'{where} ({case})')) for case, v in value.items()]
+    return [(process_name, param_name, None, _to_number(value, where))]
+
+def _entries_from_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    if not {'parameter', 'value'} <= {str(name).strip().lower() for name in reader.fieldnames or []}:
+        raise OverrideFileError("CSV override file needs 'parameter' and 'value' columns")
+    entries = []
+    for line, row in enumerate(reader, start=2):
+        row = {str(k).strip().lower(): (v or '').strip() for k, v in row.items() if k is not None}
+        if row.get('process'):
+            process_name, param_name = row['process'], row['parameter']
+        else:
+            process_name, param_name = _split_key(row['parameter'])
+        case = row.get('case') or None
+        entries.append((process_name, param_name, case, _to_number(row['value'], f'line {line}')))
+    return entries
+
+def parse_override_file(file_name, data):
+    """
+    file_name: ファイル名 (拡張子で書式を決める)
+    data: ファイルの内容 (bytes または str)
+    戻り値: [(工程名, パラメータ名, ケース or None, 値), ...] (ケースが None のときは全ケースを上書き)
+    """
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    extension = os.path.splitext(file_name)[1].lower().lstrip('.')
+    if extension == 'json':
+        try:
+            return _entries_from_mapping(json.loads(text))
+        except json.JSONDecodeError as e:
+            raise OverrideFileError(f'invalid JSON: {e}') from e
+    if extension in ('yaml', 'yml'):
+        # YAML は PyYAML があれば読む (YAML の差分ファイルを読むときに初めて import する)
+        try:
+            import yaml
+        except ImportError:
+            raise OverrideFileError('PyYAML is required to read YAML override files') from None
+        try:
+            return _entries_from_mapping(yaml.safe_load(text) or {})
+        except yaml.YAMLError as e:
+            raise OverrideFileError(f'invalid YAML: {e}') from e
+    if extension == 'csv':
+        return _entries_from_csv(text)
+    raise OverrideFileError(f'unsupported override file type: {file_name}')
+
+def resolve_overrides(entries, metadata, parameters):
+    """
+    entries: parse_override_file の戻り値
+    工程名・パラメータ名・ケースをベースのワークブックと照合し、
+    {('工程名' または '__Metadata', 'パラメータ名', 'ケース'): 値} を返す (ケースは展開済み)
+    """
+    overrides = OrderedDict()
+    for process_name, param_name, case, value in entries:
+        cases = CASES if case is None else (case,)
+        if case is not None and case not in CASES:
+            raise OverrideFileError(f"unknown case '{case}' (expected one of {', '.join(CASES)})")
+        if process_name == _METADATA:
+            if param_name not in metadata:
+                raise OverrideFileError(f"unknown metadata parameter '{param_name}'")
+            # メタデータにはケースの区別がない
+            overrides[(_METADATA, param_name, 'standard')] = value
+            continue
+        if process_name not in parameters:
+            process_name = process_name_from_sheet(process_name)
+        if process_name not in parameters:
+            raise OverrideFileError(f"unknown process '{process_name}'")
+        if param_name not in parameters[process_name]['standard']:
+            raise OverrideFileError(f"unknown parameter '{param_name}' in process '{process_name}'")
+        for c in cases:
+            overrides[(process_name, param_name, c)] = value
+    return overrides
+
+def read_override_file(file_name, data, metadata, parameters):
+    """
+    差分ファイルを読み込み、ベースのワークブックと照合した上書き内容を返す (resolve_overrides の戻り値)
+    """
+    return resolve_overrides(parse_override_file(file_name, data), metadata, parameters)
+
+###################################################################################
+# ベースへの適用
+def apply_overrides(metadata, parameters, overrides):
+    """
+    1つの差分をベースに適用した (metadata, parameters) を返す。
+    上書きする工程・ケースの辞書だけを新しく作り、それ以外はベースの辞書をそのまま共有する
+    (ベースは変更しない。calculate_total_cost_by_scenario など入力を書き換える関数に渡す場合はコピーすること)
+    """
+    metadata = dict(metadata) if any(key[0] == _METADATA for key in overrides) else metadata
+    parameters = OrderedDict(parameters)
+    copied = set()
+    for (process_name, param_name, case), value in overrides.items():
+        if process_name == _METADATA:
+            metadata[param_name] = value
+            continue
+        if process_name not in copied:
+            parameters[process_name] = dict(parameters[process_name])
+            copied.add(process_name)
+        if (process_name, case) not in copied:
+            parameters[process_name][case] = dict(parameters[process_name][case])
+            copied.add((process_name, case))
+        parameters[process_name][case][param_name] = value
+    return metadata, parameters
+
+def override_arrays(metadata, parameters, override_sets, scenario='standard'):
+    """
+    override_sets: 差分ごとの resolve_overrides の戻り値のリスト
+    calculate_chain_batch に渡す上書き配列 {('工程名' or '__Metadata', 'パラメータ名'): 差分数の長さの配列} を作る。
+    いずれかの差分で上書きされる (工程, パラメータ) ごとに1本だけ配列を作り、上書きしない差分の要素はベースの値にする
+    """
+    keys = OrderedDict()
+    for overrides in override_sets:
+        for process_name, param_name, case in overrides:
+            if case == scenario or process_name == _METADATA:
+                keys[(process_name, param_name)] = None
+    arrays = {}
+    for process_name, param_name in keys:
+        base = metadata[param_name] if process_name == _METADATA else parameters[process_name][scenario][param_name]
+        arrays[(process_name, param_name)] = np.full(len(override_sets), float(base))
+    for i, overrides in enumerate(override_sets):
+        for (process_name, param_name, case), value in overrides.items():
+            if case == scenario or process_name == _METADATA:
+                arrays[(process_name, param_name)][i] = value
+    return arrays
+
+def evaluate_override_scenarios(metadata, parameters, named_overrides, scenario='standard'):
+    """
+    named_overrides: [(シナリオ名, resolve_overrides の戻り値), ...]
+    全差分シナリオを calculate_chain_batch の1回の呼び出しで計算する。
+    戻り値: (サマリー DataFrame (build_key_results と同じ列、行は named_overrides の順),
+             {シナリオ名: cost_details_by_process})
+    """
+    if not named_overrides:
+        return build_key_results([]), {}
+    arrays = override_arrays(metadata, parameters, [overrides for _, overrides in named_overrides], scenario)
+    size = len(named_overrides)
+    wafer_cost, wafer_production, process_instances = calculate_chain_batch(parameters, metadata, scenario, arrays)
+    wafer_cost = np.broadcast_to(wafer_cost, size)
+    wafer_production = np.broadcast_to(wafer_production, size)
+
+    scenario_names = [scenario_name for scenario_name, _ in named_overrides]
+    details = OrderedDict(zip(scenario_names, cost_details_from_batch(process_instances, size)))
+    scenario_results = [
+        (scenario_name, cost, production, details[scenario_name])
+        for scenario_name, cost, production in zip(scenario_names, wafer_cost.tolist(), wafer_production.tolist())
+    ]
+    return build_key_results(scenario_results), details
@@ -0,0 +1,262 @@
+# フォルダ監視による差分再計算
+# 2026/10/19
+#
+# 共有フォルダに置かれたシナリオのワークブック (*.xlsx) を監視し、変更があったファイルだけを計算し直す。
+# ワークブックはシートごとに、read_parameters が読むパラメータ表 (parameters / 標準 / 最良 / 最悪 の範囲) の
+# ハッシュを指紋として持ち、ファイルが更新されたときは
+#   - 指紋が変わったシートだけを読み直す
+#   - 工程チェーンは最初に変わった工程から後ろだけを計算し直す (それより前の工程の結果はそのまま使う)
+#   - __Metadata が変わった場合や工程の並びが変わった場合は全工程を計算し直す
+# 監視はスレッドを持たず、画面側が定期的に refresh() を呼ぶ (最短の間隔を設けて同時に呼ばれても1回だけ走査する)。
+# 同じフォルダの監視オブジェクトはプロセス内で共有するので、開いているすべてのセッションに同じ結果が表示される。
+
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+from cost_engine import (
+    METADATA_SHEET_ROWS, PROCESS_SHEET_ROWS, SHEET_HEADER_ROW,
+    build_key_results, calculate_total_cost_from,
+    process_name_from_sheet, read_metadata_sheet, read_process_sheet,
+)
+
+# 監視するフォルダの既定値 (環境変数)
+WATCH_DIR_ENV = 'COST_SIMULATOR_WATCH_DIR'
+# フォルダを走査する最短の間隔 [s]
+MIN_REFRESH_INTERVAL = 2.0
+_METADATA_SHEET = '__Metadata'
+
+###################################################################################
+# シートの指紋
+def sheet_fingerprint(xls, sheet_name):
+    """
+    xls: pd.ExcelFile (openpyxl)
+    read_parameters が読む範囲 (見出し行からパラメータ表の末尾まで) のセルの値のハッシュ
+    """
+    rows = METADATA_SHEET_ROWS if sheet_name == _METADATA_SHEET else PROCESS_SHEET_ROWS
+    values = xls.book[sheet_name].iter_rows(
+        min_row=SHEET_HEADER_ROW, max_row=SHEET_HEADER_ROW + rows, values_only=True
+    )
+    return hashlib.sha256(repr(list(values)).encode('utf-8')).hexdigest()
+
+def workbook_fingerprints(xls):
+    """
+    戻り値: OrderedDict {'シート名': 指紋} (シートの並び順。read_parameters が読まないシートは含まない)
+    """
+    return OrderedDict(
+        (sheet_name, sheet_fingerprint(xls, sheet_name))
+        for sheet_name in xls.sheet_names
+        if not sheet_name.startswith('_') or sheet_name == _METADATA_SHEET
+    )
+
+###################################################################################
+# ワークブック1ファイルの状態
+class WatchedWorkbook:
+    """
+    1ファイル分の読み込み結果と計算結果。update() で前回の状態との差分だけを読み直し・計算し直す
+    """
+    def __init__(self, path, scenario='standard'):
+        self.path = path
+        self.scenario = scenario
+        self.stat = None            # (更新時刻, サイズ)
+        self.fingerprints = OrderedDict()
+        self.metadata = {}
+        self.process_input = OrderedDict()
+        self.final_cost = None
+        self.wafer_production = None
+        self.cost_details_by_process = OrderedDict()
+        self.version = 0            # 計算結果が変わるたびに増やす
+        self.updated_at = None
+        self.last_change = {}       # 直近の更新の内容 (読み直したシート数、計算し直した工程数)
+        self.error = None
+
+    def update(self):
+        """
+        ファイルが前回から変わっていれば差分を反映する。
+        戻り値: 計算結果が変わったか。読み込みに失敗した場合は前回の状態を残す (保存途中のファイルなど)
+        """
+        stat = os.stat(self.path)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if stat == self.stat:
+            return False
+        try:
+            with pd.ExcelFile(self.path) as xls:
+                changed = self._apply(xls)
+        except Exception as e:
+            # 次回の走査で読み直すため stat は更新しない
+            self.error = repr(e)
+            logging.warning('failed to read watched workbook %s: %r', self.path, e)
+            return False
+        self.stat = stat
+        self.error = None
+        return changed
+
+    def _apply(self, xls):
+        fingerprints = workbook_fingerprints(xls)
+        if fingerprints == self.fingerprints:
+            return False
+
+        metadata_changed = fingerprints.get(_METADATA_SHEET) != self.fingerprints.get(_METADATA_SHEET)
+        metadata = read_metadata_sheet(xls) if metadata_changed and _METADATA_SHEET in fingerprints else self.metadata
+        if _METADATA_SHEET not in fingerprints:
+            metadata = {}
+
+        # 工程シートは指紋が変わったもの・新しいものだけを読み直す
+        process_sheets = [name for name in fingerprints if name != _METADATA_SHEET]
+        old_sheets = [name for name in self.fingerprints if name != _METADATA_SHEET]
+        process_input = OrderedDict()
+        reparsed = 0
+        first_changed = len(process_sheets)
+        for index, sheet_name in enumerate(process_sheets):
+            process_name = process_name_from_sheet(sheet_name)
+            unchanged = (
+                index < len(old_sheets) and old_sheets[index] == sheet_name
+                and self.fingerprints[sheet_name] == fingerprints[sheet_name]
+            )
+            if unchanged:
+                process_input[process_name] = self.process_input[process_name]
+            else:
+                process_input[process_name] = read_process_sheet(xls, sheet_name)
+                reparsed += 1
+                first_changed = min(first_changed, index)
+        # 末尾の工程が削除された場合は、残った最後の工程の結果がそのまま最終結果になる
+        if len(process_sheets) < len(old_sheets):
+            first_changed = min(first_changed, len(process_sheets))
+        start = 0 if metadata_changed or not self.cost_details_by_process else first_changed
+
+        # calculate_total_cost_by_scenario は入力の辞書を書き換えるので、シナリオの値はコピーして渡す
+        calc_input = OrderedDict(
+            (process_name, {self.scenario: dict(cases[self.scenario])})
+            for process_name, cases in process_input.items()
+        )
+        if process_input:
+            self.final_cost, self.wafer_production, self.cost_details_by_process = calculate_total_cost_from(
+                calc_input, metadata, self.scenario, self.cost_details_by_process, start
+            )
+        else:
+            self.final_cost, self.wafer_production, self.cost_details_by_process = None, None, OrderedDict()
+
+        self.fingerprints = fingerprints
+        self.metadata = metadata
+        self.process_input = process_input
+        self.version += 1
+        self.updated_at = time.time()
+        self.last_change = {
+            'sheets_reparsed': reparsed + (1 if metadata_changed else 0),
+            'processes_recomputed': max(len(process_input) - start, 0),
+            'processes': len(process_input),
+        }
+        return True
+
+###################################################################################
+# フォルダの監視
+class ScenarioWatcher:
+    """
+    directory 直下の *.xlsx をシナリオとして監視する (Excel の一時ファイル ~$*.xlsx は除く)
+    """
+    def __init__(self, directory, scenario='standard', min_interval=MIN_REFRESH_INTERVAL):
+        self.directory = directory
+        self.scenario = scenario
+        self.min_interval = min_interval
+        self.workbooks = OrderedDict()  # {ファイル名: WatchedWorkbook}
+        self.version = 0                # いずれかのファイルの結果が変わるたびに増やす
+        self.last_refresh = 0.0
+        self.stats = {'refreshes': 0, 'files_updated': 0, 'sheets_reparsed': 0, 'processes_recomputed': 0}
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        paths = glob.glob(os.path.join(self.directory, '*.xlsx'))
+        return sorted(path for path in paths if not os.path.basename(path).startswith('~$'))
+
+    def refresh(self, force=False):
+        """
+        フォルダを走査し、追加・更新・削除されたファイルを反映する。
+        前回の走査から min_interval 秒以内の呼び出しは何もしない (force=True のときを除く)。
+        戻り値: 結果が変わったか
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self.last_refresh < self.min_interval:
+                return False
+            self.last_refresh = now
+            self.stats['refreshes'] += 1
+
+            paths = self._scan()
+            names = [os.path.basename(path) for path in paths]
+            changed = set(self.workbooks) - set(names)
+            for name in changed:
+                del self.workbooks[name]
+            for name, path in zip(names, paths):
+                workbook = self.workbooks.get(name)
+                if workbook is None:
+                    workbook = self.workbooks[name] = WatchedWorkbook(path, self.scenario)
+                try:
+                    updated = workbook.update()
+                except FileNotFoundError:
+                    # 走査の後に削除された
+                    del self.workbooks[name]
+                    changed.add(name)
+                    continue
+                if updated:
+                    changed.add(name)
+                    self.stats['files_updated'] += 1
+                    self.stats['sheets_reparsed'] += workbook.last_change['sheets_reparsed']
+                    self.stats['processes_recomputed'] += workbook.last_change['processes_recomputed']
+            # ファイル名の順にそろえる
+            self.workbooks = OrderedDict(sorted(self.workbooks.items()))
+            if changed:
+                self.version += 1
+            return bool(changed)
+
+    def key_results(self, scenario_name=None):
+        """
+        計算できたファイルのサマリー DataFrame (build_key_results と同じ列)
+        scenario_name: ファイル名からシナリオ名を作る関数 (None のときはファイル名のまま)
+        """
+        with self._lock:
+            scenario_results = [
+                ((scenario_name or str)(name), workbook.final_cost, workbook.wafer_production,
+                 workbook.cost_details_by_process)
+                for name, workbook in self.workbooks.items() if workbook.cost_details_by_process
+            ]
+        return build_key_results(scenario_results) if scenario_results else None
+
+    def status(self):
+        """
+        戻り値: ファイルごとの状態の DataFrame
+          列: file, processes, version, updated_at, sheets_reparsed, processes_recomputed, error
+        """
+        with self._lock:
+            rows = [{
+                'file': name,
+                'processes': len(workbook.process_input),
+                'version': workbook.version,
+                'updated_at': datetime.fromtimestamp(workbook.updated_at) if workbook.updated_at else None,
+                'sheets_reparsed': workbook.last_change.get('sheets_reparsed'),
+                'processes_recomputed': workbook.last_change.get('processes_recomputed'),
+                'error': workbook.error,
+            } for name, workbook in self.workbooks.items()]
+        return pd.DataFrame(rows, columns=['file', 'processes', 'version', 'updated_at', 'sheets_reparsed',
+                                           'processes_recomputed', 'error'])
+
+###################################################################################
+# プロセス内で共有する監視オブジェクト
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+def get_watcher(directory, scenario='standard'):
+    """
+    同じフォルダ・シナリオには同じ ScenarioWatcher を返す (セッション間で共有)
+    """
+    key = (os.path.realpath(directory), scenario)
+    with _watchers_lock:
+        if key not in _watchers:
+            _watchers[key] = ScenarioWatcher(key[0], scenario)
+        return _watchers[key]
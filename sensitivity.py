@@ -0,0 +1,130 @@
+# 分散に基づく大域的感度分析 (Sobol 指標)
+# 2026/10/19
+#
+# 各工程のパラメータを (best, standard, worst) の三角分布で同時に振ったときに、
+# 100mmウエハ単価の分散のうちどれだけが各パラメータによるかを求める。
+#   一次の指標 S1 : そのパラメータ単独の寄与 (Saltelli 2010 の推定式)
+#   全効果 ST     : 他のパラメータとの交互作用を含めた寄与 (Jansen の推定式)
+# ST - S1 が大きいパラメータは、他の工程のパラメータとの組み合わせで効いている
+# (例: 前工程の歩留まりと、後工程の装置台数によるボトルネック)。
+#
+# 行列 A, B (各 N 点) と、A の i 列目だけを B に入れ替えた AB_i を作り、
+# N × (パラメータ数 + 2) 点を工程チェーンの一括計算でまとめて評価する。
+# 信頼区間は評価済みの結果の行を復元抽出するブートストラップで求める (追加のチェーン計算はしない)。
+
+import numpy as np
+import pandas as pd
+
+import uncertainty
+
+# 工程チェーンで前工程の出力に置き換えられるため、2番目以降の工程では振っても効かないパラメータ
+_CHAINED_PARAMETERS = {'upstream_total_annual_production', 'upstream_total_product_cost'}
+# AB_i を縦に積んで一度に作る配列の要素数 (行数 × パラメータ数) の上限
+_BLOCK_ELEMENTS = 1 << 22
+
+###################################################################################
+# 対象パラメータ
+def varying_parameters(processes_input, metadata, param_names=None):
+    """
+    best / standard / worst で値が異なるパラメータの [('工程名', 'パラメータ名'), ...]
+    param_names: 対象のパラメータ名 (None のときは全パラメータ)
+    """
+    keys = []
+    for order, (process_name, cases) in enumerate(processes_input.items()):
+        for param_name in cases['standard']:
+            if param_name in metadata or (param_names is not None and param_name not in param_names):
+                continue
+            if order > 0 and param_name in _CHAINED_PARAMETERS:
+                continue
+            values = [float(cases[case][param_name]) for case in ('best', 'standard', 'worst')]
+            if max(values) > min(values):
+                keys.append((process_name, param_name))
+    return keys
+
+###################################################################################
+# 推定式
+def _indices(f_a, f_b, f_ab):
+    """
+    f_a, f_b: (N,), f_ab: (N, P)
+    戻り値: (S1 (P,), ST (P,))
+    単価は平均が大きく分散が相対的に小さいので、f_b は平均を引いてから使う
+    (期待値は変わらず、S1 の推定のばらつきが小さくなる)
+    """
+    f_all = np.concatenate([f_a, f_b])
+    variance = np.var(f_all)
+    f_b = f_b - f_all.mean()
+    first_order = np.mean(f_b[:, None] * (f_ab - f_a[:, None]), axis=0) / variance
+    total_effect = 0.5 * np.mean((f_a[:, None] - f_ab) ** 2, axis=0) / variance
+    return first_order, total_effect
+
+def sobol_indices(processes_input, metadata, param_names=None, n_base=4096, method='sobol',
+                  n_bootstrap=200, confidence=0.95, seed=0, scenario='standard'):
+    """
+    100mmウエハ単価に対する Sobol 指標を求める。
+    n_base: 行列 A, B の点数 N (チェーンの評価回数は N × (パラメータ数 + 2))
+    method: A, B を作る点列 (uncertainty.SAMPLING_METHODS)
+
+    戻り値: (indices, info)
+      indices: パラメータごとの DataFrame (ST の降順)
+        列: process, parameter, S1, S1_low, S1_high, ST, ST_low, ST_high
+      info: {'evaluations': チェーンの評価回数, 'used_rows': 有効な行数, 'variance': 単価の分散, 'method': 点列}
+    """
+    keys = varying_parameters(processes_input, metadata, param_names)
+    columns = ['process', 'parameter', 'S1', 'S1_low', 'S1_high', 'ST', 'ST_low', 'ST_high']
+    if not keys:
+        return pd.DataFrame(columns=columns), {'evaluations': 0, 'used_rows': 0, 'variance': np.nan, 'method': method}
+
+    # A, B は同じ点列の前半・後半の次元から作る (2 × パラメータ数 次元)
+    bounds = uncertainty.triangular_bounds(processes_input, keys)
+    sampler, used_method = uncertainty.make_sampler(method, 2 * len(keys), seed)
+    u = sampler.random(n_base)
+    order = uncertainty.dimension_order_by_width(bounds)
+    a = uncertainty.parameter_values(u[:, order], bounds, keys)
+    b = uncertainty.parameter_values(u[:, len(keys) + order], bounds, keys)
+
+    def evaluate(values):
+        return uncertainty.evaluate_wafer_cost(processes_input, metadata, scenario, keys, values)
+
+    f_a = evaluate(a)
+    f_b = evaluate(b)
+    # AB_i を数列分ずつ縦に積んだ大きな配列にまとめて一括計算する
+    f_ab = np.empty((n_base, len(keys)))
+    block = max(1, _BLOCK_ELEMENTS // (n_base * len(keys)))
+    for start in range(0, len(keys), block):
+        stop = min(start + block, len(keys))
+        stacked = np.tile(a, (stop - start, 1))
+        for offset, i in enumerate(range(start, stop)):
+            stacked[offset * n_base:(offset + 1) * n_base, i] = b[:, i]
+        f_ab[:, start:stop] = evaluate(stacked).reshape(stop - start, n_base).T
+
+    # 計算できなかった行 (0除算など) は除く
+    valid = np.isfinite(f_a) & np.isfinite(f_b) & np.isfinite(f_ab).all(axis=1)
+    f_a, f_b, f_ab = f_a[valid], f_b[valid], f_ab[valid]
+    first_order, total_effect = _indices(f_a, f_b, f_ab)
+
+    # ブートストラップ (評価済みの行の復元抽出)
+    rng = np.random.default_rng(seed)
+    samples_s1 = np.empty((n_bootstrap, len(keys)))
+    samples_st = np.empty((n_bootstrap, len(keys)))
+    for r in range(n_bootstrap):
+        rows = rng.integers(0, len(f_a), len(f_a))
+        samples_s1[r], samples_st[r] = _indices(f_a[rows], f_b[rows], f_ab[rows])
+    tail = (1 - confidence) / 2 * 100
+
+    indices = pd.DataFrame({
+        'process': [process_name for process_name, _ in keys],
+        'parameter': [param_name for _, param_name in keys],
+        'S1': first_order,
+        'S1_low': np.percentile(samples_s1, tail, axis=0),
+        'S1_high': np.percentile(samples_s1, 100 - tail, axis=0),
+        'ST': total_effect,
+        'ST_low': np.percentile(samples_st, tail, axis=0),
+        'ST_high': np.percentile(samples_st, 100 - tail, axis=0),
+    }, columns=columns).sort_values('ST', ascending=False).reset_index(drop=True)
+    info = {
+        'evaluations': n_base * (len(keys) + 2),
+        'used_rows': int(valid.sum()),
+        'variance': float(np.var(np.concatenate([f_a, f_b]))),
+        'method': used_method,
+    }
+    return indices, info
@@ -0,0 +1,166 @@
+# 処理段階ごとの時間計測モジュール
+# 2026/10/19
+#
+# 計測結果は JSON Lines 形式で simulation_timing.jsonl に1行ずつ出力する。
+# 同時に、リクエスト(計算実行)ごとの計測結果をメモリ上にも保持し、開発者パネルで表示する。
+
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+TIMING_LOG_PATH = 'simulation_timing.jsonl'
+
+# simulation.log とは別ファイルに、メッセージ(JSON)のみを出力する
+_logger = logging.getLogger('cost_simulator.timing')
+if not _logger.handlers:
+    _handler = logging.FileHandler(TIMING_LOG_PATH, encoding='utf-8')
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(_handler)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+
+# 実行中リクエストのID と計測結果の保存先 (Streamlit はセッションごとに別スレッドで実行される)
+_request_id = contextvars.ContextVar('request_id', default=None)
+_records = contextvars.ContextVar('timing_records', default=None)
+
+###################################################################################
+# リクエスト単位の管理
+def start_request():
+    """
+    新しいリクエストを開始し、計測結果を溜めるリストを返す
+    """
+    records = []
+    _request_id.set(uuid.uuid4().hex[:12])
+    _records.set(records)
+    return records
+
+def current_records():
+    records = _records.get()
+    return [] if records is None else records
+
+###################################################################################
+# 計測
+@contextmanager
+def stage(name, **fields):
+    """
+    with stage('read_parameters', scenario='A') as info:
+        ...
+        info['processes'] = 27   # 処理後に分かる項目は info に追記する
+
+    終了時に {ts, request_id, stage, elapsed_ms, ...fields} を1行のJSONとして出力する
+    """
+    info = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(name, time.perf_counter() - start, **info)
+
+def record(name, elapsed, **fields):
+    """
+    計測済みの経過時間 elapsed[s] を1行のJSONとして出力する
+    """
+    entry = {
+        'ts': datetime.now().isoformat(timespec='milliseconds'),
+        'request_id': _request_id.get(),
+        'stage': name,
+        'elapsed_ms': round(elapsed * 1000, 3),
+    }
+    entry.update(fields)
+    _logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+    records = _records.get()
+    if records is not None:
+        records.append(entry)
+
+def _payload_fields(args):
+    # 最初の引数(シナリオ別の辞書 or DataFrame)からシナリオ数・工程数を数える
+    if not args:
+        return {}
+    data = args[0]
+    if isinstance(data, dict):
+        process_counts = [len(v) for v in data.values() if isinstance(v, dict)]
+        return {
+            'scenarios': len(data),
+            'processes': max(process_counts) if process_counts else 0,
+        }
+    if hasattr(data, 'shape'):
+        return {'rows': int(data.shape[0])}
+    return {}
+
+def timed(func):
+    """
+    plot_* / show_* 関数用のデコレータ。関数名を stage 名として計測する
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__, **_payload_fields(args)):
+            return func(*args, **kwargs)
+    return wrapper
+
+###################################################################################
+# 集計・プロファイル
+def summarize(records):
+    """
+    stage ごとに 回数・合計時間・最大時間 を集計して、合計時間の大きい順に返す
+    """
+    summary = {}
+    for entry in records:
+        s = summary.setdefault(entry['stage'], {'stage': entry['stage'], 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        s['calls'] += 1
+        s['total_ms'] += entry['elapsed_ms']
+        s['max_ms'] = max(s['max_ms'], entry['elapsed_ms'])
+    return sorted(summary.values(), key=lambda s: s['total_ms'], reverse=True)
+
+def profile_call(func, *args, sort_by='cumulative', limit=40, **kwargs):
+    """
+    func を cProfile 付きで実行し、(戻り値, 統計テキスト) を返す
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats(sort_by).print_stats(limit)
+    return result, stream.getvalue()
+
+###################################################################################
+# import 時間の内訳 (python -X importtime)
+def import_time_report(modules, cwd=None, timeout=120):
+    """
+    新しい Python プロセスで modules を順に import し、-X importtime の出力をモジュールごとに返す
+    (サーバー再起動直後の起動時間の内訳を確認するため。計測は毎回新しいプロセスで行うので、このプロセスの状態に左右されない)
+    戻り値: (全体の所要時間[ms], [{'module': 名前, 'depth': 入れ子の深さ, 'self_ms': ..., 'cumulative_ms': ...}, ...])
+            行は import された順
+    """
+    code = '; '.join(f'import {name}' for name in modules)
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, timeout=timeout, cwd=cwd,
+        env={**os.environ, 'STREAMLIT_LOGGER_LEVEL': 'error'}
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # 見出し行
+        name = fields[2].rstrip()
+        rows.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip())) // 2,
+            'self_ms': int(fields[0]) / 1000,
+            'cumulative_ms': int(fields[1]) / 1000,
+        })
+    return elapsed_ms, rows
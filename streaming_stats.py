@@ -0,0 +1,336 @@
+# 計算結果の逐次集計 (メモリ一定のモンテカルロ集計)
+# 2026/10/19
+#
+# 大量の乱数サンプルを工程チェーンで計算するとき、全サンプルの工程ごとの結果を保持せずに
+# チャンクごとに集計だけを更新する。サンプル数が 10^5 でも 10^8 でも使用メモリは変わらない。
+#   - 平均・分散        : Welford 法 (チャンクどうしは Chan らの式で合成)
+#   - 分位点            : t-digest (重心の数を圧縮パラメータで抑えた分位点スケッチ)
+#   - ヒストグラム      : 固定ビン (範囲外は下側・上側の個数として数える)
+# どの集計もワーカーごとに作ったものを merge で1つにまとめられる。
+# ただしヒストグラムはビンの区切りが同じものどうししかまとめられないので、並列に集計するときは
+# 親プロセスで試しに計算したチャンクから pilot_edges / ChainAccumulator.edges_from_pilot で区切りを1回だけ決め、
+# すべてのワーカーの集計に edges として渡す (edges を渡さないと各集計が自分の最初のチャンクから区切りを決める)。
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# t-digest の圧縮パラメータ (重心の数はおよそこの値の半分)
+DEFAULT_COMPRESSION = 400
+# ヒストグラムのビン数
+DEFAULT_BINS = 100
+# 最初のチャンクからヒストグラムの範囲を決めるときの余裕 (値の幅に対する割合)
+_HISTOGRAM_MARGIN = 0.25
+# 既定で表示する分位点
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+
+def _finite(values):
+    values = np.asarray(values, dtype=float).ravel()
+    return values[np.isfinite(values)]
+
+###################################################################################
+# 平均・分散
+class RunningMoments:
+    """
+    件数・平均・偏差平方和 (Welford 法) と最小・最大。NaN・無限大は nonfinite として数えるだけにする
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.nonfinite = 0
+
+    def _combine(self, count, mean, m2, low, high):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        finite = values[np.isfinite(values)]
+        self.nonfinite += len(values) - len(finite)
+        if len(finite):
+            mean = finite.mean()
+            self._combine(len(finite), mean, float(((finite - mean) ** 2).sum()), finite.min(), finite.max())
+
+    def merge(self, other):
+        self.nonfinite += other.nonfinite
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    @property
+    def variance(self):
+        # 不偏分散
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+###################################################################################
+# 分位点スケッチ (t-digest)
+def _merge_centroids(means, weights, compression):
+    """
+    重み付きの点 (平均, 重み) を t-digest の重心にまとめる。
+    各点の左端の累積割合 q に対する k(q) = δ/(2π)·asin(2q-1) の整数部が同じ点を1つの重心にする
+    (k の傾きが大きい両端ほど重心が小さくなり、P1・P99 などの精度が保たれる)
+    """
+    order = np.argsort(means, kind='stable')
+    means = means[order]
+    weights = weights[order]
+    q = (np.cumsum(weights) - weights) / weights.sum()
+    k = compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+    group = np.floor(k - k[0]).astype(np.int64)
+    starts = np.flatnonzero(np.diff(group, prepend=-1))
+    merged_weights = np.add.reduceat(weights, starts)
+    return np.add.reduceat(means * weights, starts) / merged_weights, merged_weights
+
+class QuantileSketch:
+    """
+    t-digest による分位点の近似。値を重心 (平均, 重み) の列に圧縮して持つ (重心の数は compression 程度で一定)
+    """
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self._buffer = []  # まだ重心にまとめていない値
+        self._buffered = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = _finite(values)
+        if len(values) == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._buffer.append(values)
+        self._buffered += len(values)
+        # 未圧縮の値は重心数の一定倍までにとどめる
+        if self._buffered > 25 * self.compression:
+            self._compress()
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        self.means, self.weights = _merge_centroids(
+            np.concatenate([self.means, *self._buffer]),
+            np.concatenate([self.weights, np.ones(self._buffered)]),
+            self.compression
+        )
+        self._buffer = []
+        self._buffered = 0
+
+    def merge(self, other):
+        other._compress()
+        if len(other.weights) == 0:
+            return
+        self._compress()
+        self.means, self.weights = _merge_centroids(
+            np.concatenate([self.means, other.means]),
+            np.concatenate([self.weights, other.weights]),
+            self.compression
+        )
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """
+        q: 0〜1 の割合 (スカラーまたは配列)。値がなければ NaN
+        """
+        self._compress()
+        q = np.asarray(q, dtype=float)
+        if len(self.weights) == 0:
+            return np.full(q.shape, np.nan)
+        total = self.weights.sum()
+        # 重心の中心の累積重みと平均を結び、両端は最小・最大につなぐ
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0.0], centers, [total]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(q * total, positions, values)
+
+###################################################################################
+# 固定ビンのヒストグラム
+def pilot_edges(values, bins=DEFAULT_BINS):
+    """
+    試しに計算した値の範囲に余裕を持たせたビンの区切り (bins + 1,)。有限の値がなければ None
+    """
+    values = _finite(values)
+    if len(values) == 0:
+        return None
+    low, high = values.min(), values.max()
+    margin = (high - low) * _HISTOGRAM_MARGIN or max(abs(low) * 0.01, 1.0)
+    return np.linspace(low - margin, high + margin, bins + 1)
+
+class FixedHistogram:
+    """
+    edges で区切ったビンごとの個数。範囲外の値は underflow / overflow に数える。
+    merge できるのはビンの区切りが同じものどうしだけ
+    """
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    @classmethod
+    def from_pilot(cls, values, bins=DEFAULT_BINS):
+        """
+        最初のチャンクの値の範囲に余裕を持たせてビンを決める
+        """
+        edges = pilot_edges(values, bins)
+        return None if edges is None else cls(edges)
+
+    def update(self, values):
+        values = _finite(values)
+        self.underflow += int((values < self.edges[0]).sum())
+        self.overflow += int((values > self.edges[-1]).sum())
+        self.counts += np.histogram(values, bins=self.edges)[0]
+
+    def check_mergeable(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError(
+                'histograms with different bin edges cannot be merged '
+                '(pass the same edges, e.g. from pilot_edges, to every accumulator)'
+            )
+
+    def merge(self, other):
+        self.check_mergeable(other)
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+###################################################################################
+# 1つの出力値の集計
+class MetricAccumulator:
+    """
+    1つの出力値について、平均・分散、分位点スケッチ、ヒストグラムをまとめて更新する
+    edges: ヒストグラムのビンの区切り。None のときは最初に渡された値から決める
+    """
+    def __init__(self, edges=None, bins=DEFAULT_BINS, compression=DEFAULT_COMPRESSION):
+        self.bins = bins
+        self.moments = RunningMoments()
+        self.sketch = QuantileSketch(compression)
+        self.histogram = None if edges is None else FixedHistogram(edges)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if self.histogram is None:
+            self.histogram = FixedHistogram.from_pilot(values, self.bins)
+        self.moments.update(values)
+        self.sketch.update(values)
+        if self.histogram is not None:
+            self.histogram.update(values)
+
+    def check_mergeable(self, other):
+        # merge の前に確認する (途中で失敗して片方だけまとめた状態を残さない)
+        if self.histogram is not None and other.histogram is not None:
+            self.histogram.check_mergeable(other.histogram)
+
+    def merge(self, other):
+        self.check_mergeable(other)
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        if other.histogram is not None:
+            if self.histogram is None:
+                self.histogram = FixedHistogram(other.histogram.edges)
+            self.histogram.merge(other.histogram)
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        row = {
+            'count': self.moments.count,
+            'nonfinite': self.moments.nonfinite,
+            'mean': self.moments.mean if self.moments.count else np.nan,
+            'std': self.moments.std,
+            'min': self.moments.min if self.moments.count else np.nan,
+        }
+        for q, value in zip(quantiles, np.atleast_1d(self.sketch.quantile(quantiles))):
+            row[f'p{q * 100:g}'] = value
+        row['max'] = self.moments.max if self.moments.count else np.nan
+        return row
+
+###################################################################################
+# 工程チェーンの計算結果の集計
+class ChainAccumulator:
+    """
+    calculate_chain_batch の結果をチャンクごとに受け取り、
+      wafer_cost       : 100mmウエハ単価 (最終工程の unit_product_cost_100mm)
+      wafer_production : 100mmウエハ年間生産数量
+      工程ごとの unit_product_cost
+    を集計する。使用メモリはサンプル数によらず (工程数 × (重心数 + ビン数)) 程度。
+    edges: {'wafer_cost': ビンの区切り, 'wafer_production': ..., '工程名': ...}
+           並列に集計して merge する場合は、edges_from_pilot で決めた同じ区切りをすべてのワーカーに渡す
+    """
+    def __init__(self, process_names, edges=None, bins=DEFAULT_BINS, compression=DEFAULT_COMPRESSION):
+        edges = edges or {}
+        self.metrics = OrderedDict(
+            (name, MetricAccumulator(edges.get(name), bins, compression))
+            for name in ['wafer_cost', 'wafer_production', *process_names]
+        )
+
+    @staticmethod
+    def _values(wafer_cost, wafer_production, process_instances, size):
+        def expand(values):
+            return values if size is None else np.broadcast_to(values, size)
+
+        yield 'wafer_cost', expand(wafer_cost)
+        yield 'wafer_production', expand(wafer_production)
+        for process_name, process in process_instances.items():
+            yield process_name, expand(process.unit_product_cost)
+
+    @classmethod
+    def edges_from_pilot(cls, wafer_cost, wafer_production, process_instances, size=None, bins=DEFAULT_BINS):
+        """
+        親プロセスで試しに計算したチャンクから、ワーカーの集計に共通で渡す edges を決める (集計はしない)
+        引数は update と同じ
+        """
+        edges = {}
+        for name, values in cls._values(wafer_cost, wafer_production, process_instances, size):
+            metric_edges = pilot_edges(values, bins)
+            if metric_edges is not None:
+                edges[name] = metric_edges
+        return edges
+
+    def update(self, wafer_cost, wafer_production, process_instances, size=None):
+        """
+        size: チャンクの点数。上書きしなかった値がスカラーのまま返る場合に、この点数分に広げて数える
+        """
+        for name, values in self._values(wafer_cost, wafer_production, process_instances, size):
+            self.metrics[name].update(values)
+
+    def merge(self, other):
+        """
+        other の集計を足し込む。出力値の組み合わせかヒストグラムの区切りが異なる場合は、
+        何も変更せずに ValueError を送出する
+        """
+        missing = [name for name in other.metrics if name not in self.metrics]
+        if missing:
+            raise ValueError(f'cannot merge accumulators with different outputs: {missing}')
+        for name, metric in other.metrics.items():
+            self.metrics[name].check_mergeable(metric)
+        for name, metric in other.metrics.items():
+            self.metrics[name].merge(metric)
+
+    def histogram_edges(self):
+        # 他のワーカーの集計とビンを合わせるための区切り
+        return {name: metric.histogram.edges for name, metric in self.metrics.items() if metric.histogram is not None}
+
+    @property
+    def count(self):
+        return self.metrics['wafer_cost'].moments.count + self.metrics['wafer_cost'].moments.nonfinite
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        """
+        戻り値: 出力値ごとの DataFrame
+          index: wafer_cost, wafer_production, 工程名 (工程の行は unit_product_cost)
+          列: count, nonfinite, mean, std, min, p5, p50, p95, max
+        """
+        return pd.DataFrame({name: metric.summary(quantiles) for name, metric in self.metrics.items()}).T
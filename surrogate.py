@@ -0,0 +1,186 @@
+# サロゲートモデル (多項式カオス展開) による即時プレビュー
+# 2026/10/19
+#
+# 多数のパラメータを同時に動かしながら結果を見るために、工程チェーンの代わりに安価な近似式で予測する。
+# 近似式は、バックグラウンドジョブで保存済みのスイープ結果 (job_queue.load_result の X, Y) に当てはめるので、
+# 当てはめのために工程チェーンを新たに計算しない。
+#   - 入力: 各パラメータをスイープの範囲 [下限, 上限] で [-1, 1] に正規化する
+#   - 基底: ルジャンドル多項式 (一様分布の多項式カオス展開の基底)。各パラメータの 1〜degree 次と、
+#           degree >= 2 のときは2パラメータの積 (1次 × 1次) を使う (パラメータ数が多くても項数が爆発しない)
+#   - 出力: 100mmウエハ単価・100mm年間生産数量の対数 (掛け算・割り算の多い式なので対数の方が近似しやすい)
+#   - 係数: 正規方程式をチャンクごとに積み上げ、リッジ回帰で解く (全点の特徴量行列をメモリに持たない)
+# 当てはめに使わなかった点 (検証用) の相対誤差から、全体の精度と、予測点の近くの検証点の誤差による
+# 予測ごとの誤差の目安を求める。
+
+import numpy as np
+
+import job_queue
+
+# 予測する目的変数 (job_queue.RESULT_COLUMNS のうち)
+TARGETS = ['wafer_cost', 'wafer_production']
+DEGREES = [1, 2, 3]
+# 当てはめに使わない検証用の点の割合と上限
+_VALIDATION_FRACTION = 0.2
+_MAX_VALIDATION = 20000
+# 当てはめに使う点数の上限 (項数あたり)。これより多い点は精度がほとんど変わらず時間だけがかかる
+_TRAIN_PER_TERM = 20
+_MIN_TRAIN = 20000
+# 予測ごとの誤差の目安に使う近傍の検証点の数
+_NEIGHBORS = 32
+# 特徴量行列を作るときの要素数 (行数 × 項数) の上限
+_CHUNK_ELEMENTS = 1 << 22
+
+###################################################################################
+# 基底
+def _legendre(z, order):
+    if order == 1:
+        return z
+    if order == 2:
+        return 1.5 * z * z - 0.5
+    return 2.5 * z ** 3 - 1.5 * z
+
+class PolynomialSurrogate:
+    """
+    keys: 入力の [('工程名', 'パラメータ名'), ...]
+    lower, upper: 各入力の範囲 (正規化に使う。当てはめたデータの最小・最大)
+    coefficients: (項数, len(TARGETS)) の係数 (対数の目的変数に対する)
+    """
+    def __init__(self, keys, lower, upper, degree=2):
+        if degree not in DEGREES:
+            raise ValueError(f'degree must be one of {DEGREES}')
+        self.keys = [tuple(key) for key in keys]
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.degree = degree
+        self.coefficients = None
+        self.validation = None       # (正規化した入力 (M, P), 絶対相対誤差 (M, len(TARGETS)))
+        self.metrics = {}
+        n = len(self.keys)
+        self._pairs = np.triu_indices(n, 1) if degree >= 2 else (np.empty(0, int), np.empty(0, int))
+
+    @property
+    def n_terms(self):
+        return 1 + len(self.keys) * self.degree + len(self._pairs[0])
+
+    def scale(self, X):
+        """
+        入力 (N, P) を [-1, 1] に正規化する (範囲の幅が 0 の入力は 0)
+        """
+        width = self.upper - self.lower
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(width > 0, 2 * (np.asarray(X, dtype=float) - self.lower) / width - 1, 0.0)
+        return z
+
+    def features(self, z):
+        """
+        正規化した入力 (N, P) の特徴量行列 (N, 項数)
+        """
+        columns = [np.ones((len(z), 1))]
+        for order in range(1, self.degree + 1):
+            columns.append(_legendre(z, order))
+        if len(self._pairs[0]):
+            columns.append(z[:, self._pairs[0]] * z[:, self._pairs[1]])
+        return np.hstack(columns)
+
+    def _chunks(self, size):
+        rows = max(256, _CHUNK_ELEMENTS // self.n_terms)
+        return ((start, min(start + rows, size)) for start in range(0, size, rows))
+
+    def fit(self, X, log_y, ridge=1e-8):
+        """
+        X: (N, P) の入力、log_y: (N, len(TARGETS)) の目的変数の対数
+        """
+        gram = np.zeros((self.n_terms, self.n_terms))
+        moment = np.zeros((self.n_terms, log_y.shape[1]))
+        for start, stop in self._chunks(len(X)):
+            phi = self.features(self.scale(X[start:stop]))
+            gram += phi.T @ phi
+            moment += phi.T @ log_y[start:stop]
+        # 項のスケールに合わせた小さなリッジ項で、値が変化しない入力などによる特異性を避ける
+        gram[np.diag_indices_from(gram)] += ridge * max(np.trace(gram) / self.n_terms, 1.0)
+        try:
+            self.coefficients = np.linalg.solve(gram, moment)
+        except np.linalg.LinAlgError:
+            self.coefficients = np.linalg.lstsq(gram, moment, rcond=None)[0]
+        return self
+
+    def predict_log(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        log_y = np.empty((len(X), self.coefficients.shape[1]))
+        for start, stop in self._chunks(len(X)):
+            log_y[start:stop] = self.features(self.scale(X[start:stop])) @ self.coefficients
+        return log_y
+
+    def predict(self, X):
+        """
+        X: (N, P) または長さ P の入力
+        戻り値: (予測値 (N, len(TARGETS)), 予測ごとの誤差の目安 (N, len(TARGETS)) [相対誤差], 範囲外か (N,))
+          誤差の目安は、正規化した入力空間で近い検証点 _NEIGHBORS 個の絶対相対誤差の 90% 点。
+          入力がスイープの範囲外 (外挿) のときは、はみ出した幅に応じて目安を大きくする
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        prediction = np.exp(self.predict_log(X))
+        z = self.scale(X)
+        outside = np.abs(z) > 1 + 1e-9
+        error = np.full(prediction.shape, np.nan)
+        if self.validation is not None and len(self.validation[0]):
+            val_z, val_error = self.validation
+            k = min(_NEIGHBORS, len(val_z))
+            for i, point in enumerate(np.clip(z, -1, 1)):
+                distance = np.sum((val_z - point) ** 2, axis=1)
+                nearest = np.argpartition(distance, k - 1)[:k]
+                error[i] = np.quantile(val_error[nearest], 0.9, axis=0)
+        overshoot = np.max(np.where(outside, np.abs(z) - 1, 0.0), axis=1, initial=0.0)
+        error *= (1 + 4 * overshoot)[:, None]
+        return prediction, error, outside.any(axis=1)
+
+###################################################################################
+# 保存済みのスイープ結果への当てはめ
+def fit_surrogate(keys, X, Y, degree=2, seed=0):
+    """
+    keys, X, Y: job_queue.load_result の戻り値 (Y の列は job_queue.RESULT_COLUMNS)
+    戻り値: 当てはめた PolynomialSurrogate。metrics に検証用の点での精度を持つ
+      {'train_samples', 'validation_samples', 'terms', 'rmse': {目的変数: 相対誤差の二乗平均平方根},
+       'p95': {目的変数: 絶対相対誤差の 95% 点}, 'max': {目的変数: 絶対相対誤差の最大値}}
+    """
+    columns = [job_queue.RESULT_COLUMNS.index(target) for target in TARGETS]
+    Y = np.asarray(Y, dtype=float)[:, columns]
+    X = np.asarray(X, dtype=float)
+    # 計算できなかった点 (0除算など) は除く (対数を取るので正の値だけ)
+    valid = np.isfinite(X).all(axis=1) & np.isfinite(Y).all(axis=1) & (Y > 0).all(axis=1)
+    X, Y = X[valid], Y[valid]
+
+    model = PolynomialSurrogate(keys, X.min(axis=0, initial=np.inf), X.max(axis=0, initial=-np.inf), degree)
+    order = np.random.default_rng(seed).permutation(len(X))
+    n_validation = min(int(len(X) * _VALIDATION_FRACTION), _MAX_VALIDATION)
+    validation, train = order[:n_validation], order[n_validation:]
+    train = train[:max(_MIN_TRAIN, _TRAIN_PER_TERM * model.n_terms)]
+    # 精度の評価に検証用の点が少なくとも1点必要
+    if len(train) < 2 * model.n_terms or n_validation < 1:
+        raise ValueError(
+            f'not enough samples to fit degree {degree}: {len(X)} usable samples for {model.n_terms} terms '
+            f'(need {2 * model.n_terms} for fitting plus {_VALIDATION_FRACTION:.0%} held out for validation, '
+            f'at least 1 sample)'
+        )
+    model.fit(X[train], np.log(Y[train]))
+
+    relative_error = np.exp(model.predict_log(X[validation]) - np.log(Y[validation])) - 1
+    model.validation = (model.scale(X[validation]), np.abs(relative_error))
+    model.metrics = {
+        'train_samples': len(train),
+        'validation_samples': len(validation),
+        'terms': model.n_terms,
+        'rmse': dict(zip(TARGETS, np.sqrt(np.mean(relative_error ** 2, axis=0)))),
+        'p95': dict(zip(TARGETS, np.quantile(np.abs(relative_error), 0.95, axis=0))),
+        'max': dict(zip(TARGETS, np.max(np.abs(relative_error), axis=0))),
+    }
+    return model
+
+def fit_from_job(job_id, degree=2, seed=0, db_path=job_queue.JOB_DB_PATH, job_dir=job_queue.JOB_DIR):
+    """
+    ジョブで保存済みの全点の結果 (keep_samples=True のジョブ) にサロゲートモデルを当てはめる
+    """
+    keys, X, Y = job_queue.load_result(job_id, db_path, job_dir)
+    if not len(X):
+        raise ValueError(f'job {job_id} has no stored samples (submit it with keep_samples=True)')
+    return fit_surrogate(keys, X, Y, degree, seed)
@@ -0,0 +1,184 @@
+# ベンチマーク用 合成シナリオワークブックの生成
+# 2026/10/19
+#
+# read_parameters が読み込むレイアウトと同じ形式のワークブックを作る。
+#   工程シート: 1～2行目はタイトル、3行目がヘッダ (parameters / 標準 / 最良 / 最悪)、4行目から23パラメータ
+#   __Metadata シート: 3行目がヘッダ (parameters / 値)、4行目から4パラメータ
+#
+# 使い方:
+#   python synthetic_workbook.py --processes 27 --scenarios 5 --out synthetic
+
+import argparse
+import io
+import math
+import os
+import random
+from collections import OrderedDict
+
+# 工程シートのパラメータ (read_parameters の nrows=23 に対応する順序)
+PARAMETER_NAMES = [
+    'product_split_count',
+    'batch_process_quantity',
+    'annual_process_capacity_per_unit',
+    'num_of_units',
+    'unit_cost',
+    'depreciation_period',
+    'yield_rate',
+    'material_cost_per_process',
+    'labor_cost_per_hour',
+    'labor_hours_per_process',
+    'auxiliary_material_cost_per_process',
+    'utility_cost_per_process',
+    'maintenance_cost_per_process',
+    'subcontract_cost_per_process',
+    'other_cost_per_process',
+    'upstream_total_annual_production',
+    'upstream_total_product_cost',
+    'production_ratio_100mm',
+    'cost_allocation_ratio_100mm',
+    'depreciation_allocation_ratio',
+    'maintenance_cost_allocation_ratio',
+    'consumables_cost_per_process',
+    'common_consumables_allocation_ratio',
+]
+
+METADATA_NAMES = [
+    'annual_depreciation_common_equipments',
+    'labor_cost_indirect_direct_ratio',
+    'annual_maintenance_common_equipment_cost',
+    'annual_common_consumables_cost',
+]
+
+# 値が大きいほど良いパラメータ (それ以外は小さいほど良い)
+_HIGHER_IS_BETTER = {'yield_rate', 'annual_process_capacity_per_unit', 'batch_process_quantity'}
+# 最良/最悪で振らないパラメータ
+_FIXED = {
+    'product_split_count', 'num_of_units', 'depreciation_period', 'labor_cost_per_hour',
+    'upstream_total_annual_production', 'upstream_total_product_cost',
+    'production_ratio_100mm', 'cost_allocation_ratio_100mm',
+    'depreciation_allocation_ratio', 'maintenance_cost_allocation_ratio', 'common_consumables_allocation_ratio',
+}
+
+###################################################################################
+# パラメータ生成
+def make_scenario(n_processes, seed=0, annual_demand=5000):
+    """
+    n_processes 工程分の合成パラメータを作る。
+    戻り値は read_parameters と同じ (metadata, parameters) の形式。
+    """
+    rng = random.Random(seed)
+    metadata = {
+        'annual_depreciation_common_equipments': 5.0e7,
+        'labor_cost_indirect_direct_ratio': 0.5,
+        'annual_maintenance_common_equipment_cost': 1.0e7,
+        'annual_common_consumables_cost': 5.0e6,
+    }
+
+    # 1/4 の位置の工程で製品を分割する (結晶 -> 基板 のスライスを想定)
+    split_index = n_processes // 4
+    volume = annual_demand
+    parameters = OrderedDict()
+    for i in range(n_processes):
+        split = 10 if i == split_index and n_processes > 1 else 1
+        volume *= split
+        batch = rng.choice([1, 1, 5, 25])
+        capacity_runs = rng.uniform(200, 3000)
+        # 総キャパシティが年間需要の 0.9～1.5倍 になるよう装置台数を決める
+        units = max(1, math.ceil(volume * rng.uniform(0.9, 1.5) / (batch * capacity_runs * split)))
+
+        standard = {
+            'product_split_count': split,
+            'batch_process_quantity': batch,
+            'annual_process_capacity_per_unit': capacity_runs,
+            'num_of_units': units,
+            'unit_cost': rng.uniform(1e6, 1e8),
+            'depreciation_period': 8,
+            # 工程数が多いほど1工程あたりの歩留まりを高くし、最終工程まで数量が残るようにする
+            'yield_rate': rng.uniform(max(90.0, 100 - 300 / n_processes), 99.9),
+            'material_cost_per_process': rng.uniform(0, 20000),
+            'labor_cost_per_hour': 2960,
+            'labor_hours_per_process': rng.uniform(0.1, 5),
+            'auxiliary_material_cost_per_process': rng.uniform(0, 20000),
+            'utility_cost_per_process': rng.uniform(0, 10000),
+            'maintenance_cost_per_process': rng.uniform(0, 10000),
+            'subcontract_cost_per_process': 0,
+            'other_cost_per_process': rng.uniform(0, 2000),
+            'upstream_total_annual_production': annual_demand,
+            'upstream_total_product_cost': 10000,
+            'production_ratio_100mm': 100,
+            'cost_allocation_ratio_100mm': 100,
+            'depreciation_allocation_ratio': 100 / n_processes,
+            'maintenance_cost_allocation_ratio': 100 / n_processes,
+            'consumables_cost_per_process': rng.uniform(0, 1000),
+            'common_consumables_allocation_ratio': 100 / n_processes,
+        }
+        # Excel に保存して読み直しても同じ値になるよう桁数を揃える
+        standard = {name: round(value, 6) for name, value in standard.items()}
+        best = {}
+        worst = {}
+        for name, value in standard.items():
+            if name in _FIXED:
+                best[name] = worst[name] = value
+            elif name in _HIGHER_IS_BETTER:
+                best[name] = round(value * 1.05, 6)
+                worst[name] = round(value * 0.9, 6)
+            else:
+                best[name] = round(value * 0.9, 6)
+                worst[name] = round(value * 1.1, 6)
+        best['yield_rate'] = min(100.0, best['yield_rate'])
+
+        parameters[f'process_{i + 1:03d}'] = {'standard': standard, 'best': best, 'worst': worst}
+
+    return metadata, parameters
+
+###################################################################################
+# ワークブック書き出し
+def write_workbook(target, metadata, parameters):
+    """
+    target: ファイルパス(str) または書き込み可能なバイナリIO
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for process_name, cases in parameters.items():
+        ws = wb.create_sheet(title=process_name[:31])
+        ws.append([process_name])
+        ws.append([])
+        ws.append(['parameters', '標準', '最良', '最悪'])
+        for name in PARAMETER_NAMES:
+            ws.append([name, cases['standard'][name], cases['best'][name], cases['worst'][name]])
+
+    ws = wb.create_sheet(title='__Metadata')
+    ws.append(['metadata'])
+    ws.append([])
+    ws.append(['parameters', '値'])
+    for name in METADATA_NAMES:
+        ws.append([name, metadata[name]])
+
+    wb.save(target)
+
+def make_workbook_bytes(n_processes, seed=0):
+    buffer = io.BytesIO()
+    write_workbook(buffer, *make_scenario(n_processes, seed))
+    return buffer.getvalue()
+
+###################################################################################
+# コマンドライン
+def main():
+    parser = argparse.ArgumentParser(description='合成シナリオワークブックを生成する')
+    parser.add_argument('--processes', type=int, default=27, help='工程数')
+    parser.add_argument('--scenarios', type=int, default=1, help='シナリオ(ファイル)数')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+    parser.add_argument('--out', default='synthetic', help='出力ディレクトリ')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for i in range(args.scenarios):
+        # run_simulation はファイル名の26文字目以降をシナリオ名とするため、先頭25文字は固定の接頭辞
+        path = os.path.join(args.out, f'20260101_synthetic_bench_scenario_{i + 1:04d}.xlsx')
+        write_workbook(path, *make_scenario(args.processes, args.seed + i))
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# 工程チェーンの離散事象シミュレーション (スループット・仕掛品・稼働率)
+# 2026/10/19
+#
+# calculate_cost_per_process は年間キャパシティを決定的な数値として扱い、
+# min(前工程に律速される総年間生産数量, 総年間生産キャパシティ) で生産数量を決めるため、
+# 待ち行列・バッチ待ち・装置の停止による損失が現れない。
+# ここでは1年分のロットを工程チェーンに流し、実際に処理できた数量・仕掛品・稼働率を求めて、コスト計算に戻す。
+#
+# モデル
+#   - 時間の単位は年。工程ごとに装置を num_of_units 台持ち、1回の処理 (run) は batch_process_quantity 個を投入して
+#     batch_process_quantity × product_split_count × 歩留まり 個の良品を次工程の待ち行列に送る
+#     (歩留まりは期待値として扱い、個数は小数のまま持つ)
+#   - 処理時間の平均は 1 / annual_process_capacity_per_unit [year/run]。変動係数 run_time_cv のガンマ分布で揺らす
+#   - 装置はバッチ分の個数が待ち行列にそろうまで処理を始めない (バッチ待ち)
+#   - availability < 1 のときは、装置ごとに稼働時間が指数分布の故障間隔に達したら、処理の区切りで
+#     平均 mttr_hours の修理に入る (稼働率 = 平均故障間隔 / (平均故障間隔 + 平均修理時間))
+#   - 最初の工程には upstream_total_annual_production [pcs/year] の割合で、最初の工程のバッチ単位で等間隔に投入する
+#   - 空の状態から始めるので、warmup [year] の間は集計せず、その後の1年を集計する
+#   - 前工程からの流量と装置の能力から見積もった年間処理回数が max_discrete_runs を超える工程
+#     (バッチが小さく処理回数の多い工程) は、1回ごとの事象を作らず流体近似で扱う。
+#     FLUID_STEP ごとに 装置台数 × 年間キャパシティ × バッチ処理数量 × availability × FLUID_STEP 個まで処理でき、
+#     届いた分はその刻みの残りの能力の範囲で、バッチ単位ですぐに処理して次工程に送る
+#     (バッチに満たない分と能力を超えた分は待つ。1バッチに満たない能力の残りは次の刻みに持ち越す)。
+#     処理中の仕掛品は 処理回数 × 平均処理時間 として数える。処理時間のばらつき・故障は平均に均され、
+#     修理中の時間は1回ずつ扱う場合の期待値 (処理中の時間 × (1 - availability) / availability) として数える。
+#     多数の装置で多数の回数を処理する工程ほど、個々の処理の揺らぎは年間の値にほとんど効かない
+#   - 投入は最大でも年 _MAX_RELEASES 回にまとめる
+# 事象はヒープ (heapq) に (時刻, 工程, 装置, 処理時間) で積み、時刻順に取り出して処理する。
+
+import heapq
+import math
+import random
+
+import numpy as np
+import pandas as pd
+
+from cost_engine import calculate_chain_batch
+
+HOURS_PER_YEAR = 8760.0
+# 流体近似に切り替える年間処理回数 (見積もり) の上限
+MAX_DISCRETE_RUNS = 1000
+# 流体近似の工程を進める時間の刻み [year]
+FLUID_STEP = 1.0 / 365
+# 最初の工程への投入の年間回数の上限
+_MAX_RELEASES = 1000
+# バッチがそろったかの判定の許容誤差 (小数の個数を扱うため)
+_EPS = 1e-9
+# 特別な事象の工程番号
+_RELEASE = -1
+_MEASURE_START = -2
+_FLUID_STEP = -3
+
+###################################################################################
+# シミュレーション
+def _estimated_runs(supply, batch, output_per_run, capacity, availability):
+    # 前工程からの流量と装置の能力 (台数 × 年間キャパシティ) の小さい方による年間処理回数の見積もり
+    runs = []
+    flow = supply
+    for p in range(len(batch)):
+        count = min(flow / batch[p] if batch[p] > 0 else 0.0, capacity[p] * availability)
+        runs.append(count)
+        flow = count * output_per_run[p]
+    return runs
+
+def simulate_year(processes_input, scenario='standard', run_time_cv=0.25, availability=1.0, mttr_hours=24.0,
+                  warmup=0.25, seed=0, max_discrete_runs=MAX_DISCRETE_RUNS):
+    """
+    processes_input: read_parameters の parameters
+    run_time_cv: 処理時間の変動係数 (0 なら一定)
+    availability: 装置の稼働率の上限 (1 なら故障しない)
+    mttr_hours: 平均修理時間 [h]
+    warmup: 集計を始めるまでの時間 [year]
+    max_discrete_runs: 年間処理回数の見積もりがこれを超える工程は流体近似で扱う (None なら全工程を1回ずつ扱う)
+
+    戻り値: {
+        'processes': 工程ごとの DataFrame (index は工程名)
+          列: runs (年間処理回数), input (年間投入数), output (年間良品数), utilization (処理中の装置の割合),
+              down (修理中の装置の割合), wip (平均仕掛品数 = 待ち + 処理中), queue (平均待ち数),
+              cycle_time_days (平均滞在日数 = 仕掛品 / 投入数), fluid (流体近似で扱ったか)
+        'wafer_production': 最終工程の年間良品数 × 100mm品製造比率 [pcs/year],
+        'events': 処理した事象の数,
+    }
+    """
+    process_names = list(processes_input)
+    params = [processes_input[process_name][scenario] for process_name in process_names]
+    n = len(params)
+    batch = [float(p['batch_process_quantity']) for p in params]
+    output_per_run = [
+        float(p['batch_process_quantity']) * float(p['product_split_count']) * float(p['yield_rate']) / 100
+        for p in params
+    ]
+    mean_run_time = [
+        1.0 / float(p['annual_process_capacity_per_unit']) if float(p['annual_process_capacity_per_unit']) > 0 else math.inf
+        for p in params
+    ]
+    units = [max(0, int(round(float(p['num_of_units'])))) for p in params]
+    supply = float(params[0]['upstream_total_annual_production']) if n else 0.0
+    capacity = [count / run_time if run_time > 0 else 0.0 for count, run_time in zip(units, mean_run_time)]
+    estimated_runs = _estimated_runs(supply, batch, output_per_run, capacity, availability)
+    fluid = [max_discrete_runs is not None and runs > max_discrete_runs for runs in estimated_runs]
+    fluid_processes = [p for p in range(n) if fluid[p]]
+    # 流体近似の工程が1刻みに処理できる投入数と、今の刻みの残り
+    fluid_step_input = [capacity[p] * batch[p] * availability * FLUID_STEP for p in range(n)]
+    fluid_budget = [0.0] * n
+
+    rng = random.Random(seed)
+    shape = 1.0 / run_time_cv ** 2 if run_time_cv > 0 else None
+    mttr = mttr_hours / HOURS_PER_YEAR
+    mtbf = mttr * availability / (1 - availability) if availability < 1 else None
+
+    queue = [0.0] * n            # 待ち行列の個数
+    wip = [0.0] * n              # 仕掛品 (待ち + 処理中) の個数
+    busy = [0] * n               # 処理中の装置の台数
+    down = [0] * n               # 修理中の装置の台数
+    idle = [[] if fluid[p] else list(range(units[p])) for p in range(n)]
+    time_to_failure = [[rng.expovariate(1 / mtbf) if mtbf else math.inf for _ in unit_ids] for unit_ids in idle]
+    runs = [0] * n
+    produced = [0.0] * n
+    # 時間積分 (仕掛品・処理中の台数・修理中の台数) と最後に更新した時刻
+    wip_area = [0.0] * n
+    busy_area = [0.0] * n
+    down_area = [0.0] * n
+    last = [0.0] * n
+    snapshot = None
+
+    def advance(p, t):
+        dt = t - last[p]
+        if dt > 0:
+            wip_area[p] += wip[p] * dt
+            busy_area[p] += busy[p] * dt
+            down_area[p] += down[p] * dt
+            last[p] = t
+
+    def try_start(p, t):
+        if not idle[p] or queue[p] < batch[p] - _EPS:
+            return
+        advance(p, t)
+        while idle[p] and queue[p] >= batch[p] - _EPS:
+            unit = idle[p].pop()
+            queue[p] -= batch[p]
+            busy[p] += 1
+            duration = mean_run_time[p] * (rng.gammavariate(shape, 1 / shape) if shape else 1.0)
+            heapq.heappush(events, (t + duration, p, unit, duration))
+
+    def deliver(p, t, amount):
+        # 工程 p の待ち行列に amount 個を加える
+        if p >= n:
+            return
+        advance(p, t)
+        queue[p] += amount
+        wip[p] += amount
+        if fluid[p]:
+            fluid_process(p, t)
+        else:
+            try_start(p, t)
+
+    def fluid_process(p, t):
+        # 流体近似の工程 p の待ち行列を、今の刻みの残りの能力の範囲でバッチ単位で処理して次工程に送る
+        run_count = math.floor(min(queue[p], fluid_budget[p]) / batch[p] + _EPS)
+        if run_count <= 0:
+            return
+        amount = run_count * batch[p]
+        fluid_budget[p] -= amount
+        queue[p] -= amount
+        wip[p] -= amount
+        # 処理中の時間は処理回数 × 平均処理時間 (1回ずつ扱う場合と同じ量)
+        wip_area[p] += amount * mean_run_time[p]
+        busy_area[p] += run_count * mean_run_time[p]
+        down_area[p] += run_count * mean_run_time[p] * (1 - availability) / availability
+        runs[p] += run_count
+        produced[p] += run_count * output_per_run[p]
+        deliver(p + 1, t, run_count * output_per_run[p])
+
+    def fluid_step(t):
+        # 上流の工程から能力を戻して待ち行列を処理する (流体近似の工程どうしは同じ刻みの中で次工程に届く)
+        for p in fluid_processes:
+            advance(p, t)
+            fluid_budget[p] = fluid_step_input[p] + min(fluid_budget[p], batch[p])
+            fluid_process(p, t)
+
+    release_quantity = batch[0] * max(1, math.ceil(supply / batch[0] / _MAX_RELEASES)) if n and batch[0] > 0 else 0.0
+    release_interval = release_quantity / supply if release_quantity > 0 and supply > 0 else math.inf
+    end = warmup + 1.0
+    events = [(warmup, _MEASURE_START, 0, 0.0)]
+    if release_interval < math.inf:
+        events.append((0.0, _RELEASE, 0, 0.0))
+    if fluid_processes:
+        events.append((0.0, _FLUID_STEP, 0, 0.0))
+    heapq.heapify(events)
+    count = 0
+    while events:
+        t, p, unit, duration = heapq.heappop(events)
+        if t > end:
+            break
+        count += 1
+        if p == _RELEASE:
+            deliver(0, t, release_quantity)
+            heapq.heappush(events, (t + release_interval, _RELEASE, 0, 0.0))
+        elif p == _FLUID_STEP:
+            fluid_step(t)
+            heapq.heappush(events, (t + FLUID_STEP, _FLUID_STEP, 0, 0.0))
+        elif p == _MEASURE_START:
+            for q in range(n):
+                advance(q, t)
+            snapshot = (list(runs), list(produced), list(wip_area), list(busy_area), list(down_area))
+        elif p >= n:
+            # 修理の完了
+            p -= n
+            advance(p, t)
+            down[p] -= 1
+            time_to_failure[p][unit] = rng.expovariate(1 / mtbf)
+            idle[p].append(unit)
+            try_start(p, t)
+        else:
+            # 処理の完了
+            advance(p, t)
+            busy[p] -= 1
+            wip[p] -= batch[p]
+            runs[p] += 1
+            produced[p] += output_per_run[p]
+            time_to_failure[p][unit] -= duration
+            if time_to_failure[p][unit] <= 0:
+                down[p] += 1
+                heapq.heappush(events, (t + rng.expovariate(1 / mttr), p + n, unit, 0.0))
+            else:
+                idle[p].append(unit)
+            deliver(p + 1, t, output_per_run[p])
+            try_start(p, t)
+
+    for p in range(n):
+        advance(p, end)
+    if snapshot is None:
+        snapshot = ([0] * n, [0.0] * n, [0.0] * n, [0.0] * n, [0.0] * n)
+    runs_0, produced_0, wip_0, busy_0, down_0 = (np.asarray(values, dtype=float) for values in snapshot)
+    year_runs = np.asarray(runs, dtype=float) - runs_0
+    year_wip = np.asarray(wip_area) - wip_0
+    year_busy = np.asarray(busy_area) - busy_0
+    year_input = year_runs * np.asarray(batch)
+    unit_count = np.maximum(np.asarray(units, dtype=float), 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cycle_time_days = np.where(year_input > 0, year_wip / year_input * 365, np.nan)
+    frame = pd.DataFrame({
+        'runs': year_runs,
+        'input': year_input,
+        'output': np.asarray(produced) - produced_0,
+        'utilization': year_busy / unit_count,
+        'down': (np.asarray(down_area) - down_0) / unit_count,
+        'wip': year_wip,
+        'queue': year_wip - year_busy * np.asarray(batch),
+        'cycle_time_days': cycle_time_days,
+        'fluid': fluid,
+    }, index=pd.Index(process_names, name='process'))
+    last_output = frame['output'].iloc[-1] if n else 0.0
+    return {
+        'processes': frame,
+        'wafer_production': last_output * float(params[-1]['production_ratio_100mm']) / 100 if n else 0.0,
+        'events': count,
+    }
+
+###################################################################################
+# コスト計算への反映
+def simulated_cost(processes_input, metadata, simulation, scenario='standard'):
+    """
+    シミュレーションで実際に処理できた回数を装置1台の年間工程キャパシティとしてコスト計算をやり直す
+    (年間工程実施回数がシミュレーションの処理回数と一致し、装置費などの固定費は少ない生産数量に配られる)。
+    各工程の生産数量は min(前工程の良品数, 処理回数 × バッチ処理数量) になるので、集計期間の初めに残っていた
+    仕掛品を処理した分だけ、simulate_year の wafer_production より少し小さくなることがある
+    戻り値: {'wafer_cost', 'wafer_production': シミュレーションを反映した値,
+             'analytic_wafer_cost', 'analytic_wafer_production': 決定的な年間キャパシティでの値}
+    """
+    analytic_cost, analytic_production, _ = calculate_chain_batch(processes_input, metadata, scenario)
+    overrides = {}
+    for process_name, runs in simulation['processes']['runs'].items():
+        units = float(processes_input[process_name][scenario]['num_of_units'])
+        overrides[(process_name, 'annual_process_capacity_per_unit')] = runs / units if units > 0 else 0.0
+    wafer_cost, wafer_production, _ = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+    return {
+        'wafer_cost': float(wafer_cost),
+        'wafer_production': float(wafer_production),
+        'analytic_wafer_cost': float(analytic_cost),
+        'analytic_wafer_production': float(analytic_production),
+    }
@@ -178,3 +178,18 @@ jpn_eng_dict_epi_process = {
     'lt_inspection' :  '170 エピウエハ表面検査',
     'shipping' :  '200 出荷',
 }
+
+# サマリー(key_results)の列名
+jpn_eng_dict_summary = {
+    'senario' : 'シナリオ',
+    'wafer_cost' : '100mmウエハー単価[yen/pcs]',
+    'depr_per_wafer' : '100mmウエハー単価中の減価償却費[yen/pcs]',
+    'depr_ratio' : '100mmウエハー単価中の減価償却費の割合[%]',
+    'wafer_production' : '100mm年間生産数量[pcs/year]',
+    'total_annual_cost_without_upstream_product_cost' : '年間総コスト[yen/year]',
+    'unit_variable_cost_100mm' : '100mm変動費総額[yen/pcs]',
+    'annual_depreciation_total' : '年間減価償却費[yen/year]',
+    'annual_labor_cost_total' : '年間労務費[yen/year]',
+    'annual_material_cost_total' : '年間材料費[yen/year]',
+    'annual_other_cost_total' : '年間その他経費[yen/year]',
+}
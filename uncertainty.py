@@ -0,0 +1,253 @@
+# 不確かさ評価 (best / standard / worst の範囲の準モンテカルロ)
+# 2026/10/19
+#
+# 各工程のパラメータを (best, standard, worst) の三角分布とみなし、100mmウエハ単価の分布を求める。
+# 擬似乱数の代わりに低食い違い量列 (Sobol / Halton) を使い、一様乱数 u を逆累積分布関数で
+# 各パラメータの値に変換する。点が偏りなく埋まるので、同じ点数でも分位点 (P5, P95 など) が早く安定する。
+#   - Sobol  : scipy がある場合のみ (scipy.stats.qmc.Sobol, スクランブルあり)。なければ Halton を使う
+#   - Halton : 桁ごとにランダムな置換をかけたスクランブル Halton 列
+#   - random : 擬似乱数 (比較用)
+# 点数を倍々に増やしながら分位点の変化量を見て、変化が rtol 未満で安定したら打ち切る。
+
+import functools
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+from cost_engine import INTEGER_PARAMETERS, calculate_chain_batch
+
+SAMPLING_METHODS = {
+    'sobol': 'Sobol (準モンテカルロ)',
+    'halton': 'Halton (準モンテカルロ)',
+    'random': '擬似乱数 (モンテカルロ)',
+}
+# 1回の一括計算で扱う 工程数 × 点数 の上限
+_CHUNK_ELEMENTS = 1 << 18
+
+# scipy はあれば使う (Sobol 列)。import に時間がかかるので、Sobol 列を作るときに初めて読み込む
+@functools.lru_cache(maxsize=None)
+def _scipy_qmc():
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        return None
+    return qmc
+
+def sobol_available():
+    # scipy を読み込まずに有無だけを確認する
+    return importlib.util.find_spec('scipy') is not None
+
+###################################################################################
+# 低食い違い量列
+def _first_primes(count):
+    primes = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % p for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+# Halton 列で複数の桁をまとめて表引きするときの表の大きさの上限
+_HALTON_TABLE_SIZE = 4096
+
+class HaltonSequence:
+    """
+    スクランブル Halton 列。次元 j は j 番目の素数を基数とし、各桁の数字にランダムな置換をかける。
+    倍精度の分解能まで全桁を置換するので、値が 0 や格子点に偏らない。
+    random(n) を呼ぶたびに列の続きを返す。
+    計算を速くするため、連続する数桁 (基数^桁数 が表の大きさの上限以下) の寄与をまとめた表を引く。
+    """
+    def __init__(self, dimension, seed=0):
+        rng = np.random.default_rng(seed)
+        self.bases = _first_primes(dimension)
+        # 次元ごとに [(まとめた基数, 寄与の表), ...] (下の桁から順)
+        self.tables = []
+        for base in self.bases:
+            digits = int(np.ceil(52 / np.log2(base)))
+            group = max(1, int(np.log(_HALTON_TABLE_SIZE) // np.log(base)))
+            tables = []
+            for first in range(0, digits, group):
+                width = min(group, digits - first)
+                codes = np.arange(base ** width)
+                contribution = np.zeros(len(codes))
+                for position in range(first, first + width):
+                    permutation = rng.permutation(base)
+                    contribution += permutation[codes % base] * float(base) ** -(position + 1)
+                    codes = codes // base
+                tables.append((base ** width, contribution))
+            self.tables.append(tables)
+        self.index = 0
+
+    def random(self, n):
+        indices = np.arange(self.index, self.index + n, dtype=np.int64)
+        self.index += n
+        points = np.empty((n, len(self.bases)))
+        for j, tables in enumerate(self.tables):
+            remaining = indices.copy()
+            largest = self.index - 1
+            value = np.zeros(n)
+            for radix, contribution in tables:
+                if largest == 0:
+                    # 残りの桁はすべて 0 (置換後の 0 の寄与を足すだけ)
+                    value += contribution[0]
+                    continue
+                value += contribution[remaining % radix]
+                remaining //= radix
+                largest //= radix
+            points[:, j] = value
+        return points
+
+class _PseudoRandom:
+    # HaltonSequence と同じ使い方をする擬似乱数
+    def __init__(self, dimension, seed=0):
+        self.dimension = dimension
+        self.rng = np.random.default_rng(seed)
+
+    def random(self, n):
+        return self.rng.random((n, self.dimension))
+
+def make_sampler(method, dimension, seed=0):
+    """
+    [0, 1)^dimension の点列を返すオブジェクトを作る (random(n) で続きの n 点を返す)
+    戻り値: (sampler, 実際に使った方式)。scipy がない場合の 'sobol' は 'halton' になる
+    """
+    qmc = _scipy_qmc() if method == 'sobol' else None
+    if qmc is not None:
+        return qmc.Sobol(d=max(dimension, 1), scramble=True, seed=seed), 'sobol'
+    if method in ('sobol', 'halton'):
+        return HaltonSequence(max(dimension, 1), seed), 'halton'
+    if method == 'random':
+        return _PseudoRandom(max(dimension, 1), seed), 'random'
+    raise ValueError(f'unknown sampling method: {method}')
+
+###################################################################################
+# パラメータの分布 (三角分布)
+def triangular_bounds(processes_input, keys):
+    """
+    keys: [('工程名', 'パラメータ名'), ...]
+    戻り値: (下限, 最頻値, 上限) の配列 (len(keys), 3)。
+            最頻値は standard、下限・上限は best / worst の小さい方・大きい方
+            (best と worst の大小はパラメータによって逆になる)
+    """
+    bounds = np.empty((len(keys), 3))
+    for i, (process_name, param_name) in enumerate(keys):
+        cases = processes_input[process_name]
+        values = [float(cases[case][param_name]) for case in ('best', 'standard', 'worst')]
+        bounds[i] = (min(values), values[1], max(values))
+    return bounds
+
+def triangular_ppf(u, low, mode, high):
+    """
+    三角分布の逆累積分布関数。u: (N, P) の一様乱数、low / mode / high: 長さ P の配列
+    幅が 0 のパラメータは最頻値を返す
+    """
+    width = high - low
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mode_quantile = np.where(width > 0, (mode - low) / width, 0.0)
+        lower = low + np.sqrt(u * width * (mode - low))
+        upper = high - np.sqrt((1 - u) * width * (high - mode))
+    return np.where(u < mode_quantile, lower, upper)
+
+def parameter_values(u, bounds, keys):
+    """
+    一様乱数 u (N, len(keys)) を各パラメータの三角分布の値に変換する (整数パラメータは 1 以上の整数に丸める)
+    """
+    values = triangular_ppf(u, bounds[:, 0], bounds[:, 1], bounds[:, 2])
+    for j, (_, param_name) in enumerate(keys):
+        if param_name in INTEGER_PARAMETERS:
+            values[:, j] = np.maximum(1.0, np.round(values[:, j]))
+    return values
+
+def dimension_order_by_width(bounds):
+    """
+    低食い違い量列の次元の割り当て順。相対幅 (上限-下限)/|最頻値| の大きいパラメータほど
+    均一性の高い前の次元 (Halton では小さい基数) を使うようにする。
+    戻り値: パラメータ i に使う次元の番号の配列 (u[:, 戻り値] でパラメータ順の列になる)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_width = np.nan_to_num((bounds[:, 2] - bounds[:, 0]) / np.abs(bounds[:, 1]), nan=0.0, posinf=0.0)
+    rank = np.empty(len(bounds), dtype=np.int64)
+    rank[np.argsort(-relative_width, kind='stable')] = np.arange(len(bounds))
+    return rank
+
+###################################################################################
+# 分位点が安定するまでの評価
+def evaluate_wafer_cost(processes_input, metadata, scenario, keys, values):
+    """
+    values: (N, len(keys)) のパラメータ値。工程数に応じたチャンクに分けて一括計算し、100mmウエハ単価 (N,) を返す
+    """
+    size = len(values)
+    chunk_size = max(1000, _CHUNK_ELEMENTS // max(len(processes_input), 1))
+    wafer_cost = np.empty(size)
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        overrides = {key: values[start:stop, j] for j, key in enumerate(keys)}
+        cost, _, _ = calculate_chain_batch(processes_input, metadata, scenario, overrides)
+        wafer_cost[start:stop] = cost
+    return wafer_cost
+
+def run_until_stable(processes_input, metadata, param_names, method='sobol', min_samples=1024,
+                     max_samples=1 << 20, rtol=1e-3, patience=2, quantiles=(0.05, 0.5, 0.95),
+                     seed=0, scenario='standard'):
+    """
+    全工程の param_names を三角分布で振り、100mmウエハ単価の分位点を点数を倍々に増やしながら求める。
+    前回からの分位点の相対変化の最大値が rtol 未満の回が patience 回続いたら打ち切る。
+    min_samples は2のべき乗に切り上げる (Sobol 列は2のべき乗の点数で最も均一になる)。
+
+    戻り値: {
+        'method': 実際に使った方式,
+        'converged': 打ち切り条件を満たしたか,
+        'samples': 評価した点数,
+        'quantiles': {q: 値, ...},
+        'history': 回ごとの DataFrame (列: samples, mean, p5, p50, p95, max_rel_change),
+        'wafer_cost': 評価した全点の100mmウエハ単価の配列,
+    }
+    """
+    keys = [(process_name, param_name) for process_name in processes_input for param_name in param_names]
+    bounds = triangular_bounds(processes_input, keys)
+    sampler, used_method = make_sampler(method, len(keys), seed)
+    dimension_order = dimension_order_by_width(bounds)
+    quantile_columns = [f'p{q * 100:g}' for q in quantiles]
+
+    target = 1 << int(np.ceil(np.log2(max(min_samples, 2))))
+    wafer_costs = []
+    evaluated = 0
+    history = []
+    previous = None
+    stable_rounds = 0
+    while True:
+        u = sampler.random(target - evaluated)[:, dimension_order]
+        wafer_costs.append(evaluate_wafer_cost(
+            processes_input, metadata, scenario, keys, parameter_values(u, bounds, keys)
+        ))
+        evaluated = target
+        wafer_cost = np.concatenate(wafer_costs)
+        finite = wafer_cost[np.isfinite(wafer_cost)]
+        current = np.quantile(finite, quantiles) if len(finite) else np.full(len(quantiles), np.nan)
+
+        if previous is None:
+            change = np.nan
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = float(np.max(np.abs(current - previous) / np.abs(previous)))
+        stable_rounds = stable_rounds + 1 if change < rtol else 0
+        history.append({
+            'samples': evaluated, 'mean': finite.mean() if len(finite) else np.nan,
+            **dict(zip(quantile_columns, current)), 'max_rel_change': change,
+        })
+        previous = current
+        converged = stable_rounds >= patience
+        if converged or target * 2 > max_samples:
+            break
+        target *= 2
+
+    return {
+        'method': used_method,
+        'converged': converged,
+        'samples': evaluated,
+        'quantiles': dict(zip(quantiles, current)),
+        'history': pd.DataFrame(history),
+        'wafer_cost': wafer_cost,
+    }